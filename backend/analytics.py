@@ -0,0 +1,268 @@
+"""
+Earnings and route analytics from daily rollup documents.
+
+daily_order_stats holds one document per user, UTC day and delivery app with
+the completed orders, their earnings (payment_amount) and their pickup to
+dropoff kilometres. daily_combination_stats holds one document per user and
+day with the accepted combinations and the kilometres they saved. Both are
+kept up to date with $inc as orders are completed (or un-completed) and
+combinations accepted, so reports aggregate O(days) documents, never the
+orders themselves.
+
+The rollups can be rebuilt from orders and order_combinations with
+aggregation pipelines (MongoDB 4.2+):
+
+    python analytics.py [--user USER_ID]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from distance_matrix import EARTH_RADIUS_KM, haversine_pairs
+
+BUCKETS = ("day", "month")
+
+ORDER_COUNTERS = ("completed_orders", "paid_orders", "earnings", "distance_km")
+COMBINATION_COUNTERS = ("accepted_combinations", "combined_orders", "route_km", "saved_km")
+
+
+def day_of(moment):
+    return moment.strftime("%Y-%m-%d")
+
+
+def order_distance_km(order):
+    pickup, dropoff = order["pickup_location"], order["dropoff_location"]
+    return float(haversine_pairs(pickup["latitude"], pickup["longitude"], dropoff["latitude"], dropoff["longitude"]))
+
+
+def saved_km(total_distance, savings_percentage):
+    """Kilometres saved against doing the orders separately"""
+    if savings_percentage >= 100:
+        return 0.0
+    return total_distance * savings_percentage / (100 - savings_percentage)
+
+
+async def record_order_completion(db, order, completed_at, sign=1, session=None):
+    """
+    Add a completed order to its day's rollup, or with sign=-1 take back an
+    order that left the completed status
+    """
+    day = day_of(completed_at)
+    payment = order.get("payment_amount")
+    await db.daily_order_stats.update_one(
+        {"user_id": order["user_id"], "day": day, "app_name": order["app_name"]},
+        {
+            "$inc": {
+                "completed_orders": sign,
+                "paid_orders": sign if payment is not None else 0,
+                "earnings": sign * (payment or 0.0),
+                "distance_km": sign * order_distance_km(order),
+            },
+            "$setOnInsert": {"month": day[:7]},
+        },
+        upsert=True,
+        session=session
+    )
+
+
+async def record_combination_acceptance(db, combination, accepted_at, session=None):
+    day = day_of(accepted_at)
+    await db.daily_combination_stats.update_one(
+        {"user_id": combination["user_id"], "day": day},
+        {
+            "$inc": {
+                "accepted_combinations": 1,
+                "combined_orders": len(combination["order_ids"]),
+                "route_km": combination["total_distance"],
+                "saved_km": saved_km(combination["total_distance"], combination["savings_percentage"]),
+            },
+            "$setOnInsert": {"month": day[:7]},
+        },
+        upsert=True,
+        session=session
+    )
+
+
+def _sum_counters(counters):
+    return {name: {"$sum": f"${name}"} for name in counters}
+
+
+def _empty_period(period):
+    return {
+        "period": period,
+        **{name: 0 for name in ORDER_COUNTERS + COMBINATION_COUNTERS},
+        "apps": {},
+    }
+
+
+def _finish(period):
+    period["km_per_order"] = (
+        round(period["distance_km"] / period["completed_orders"], 2) if period["completed_orders"] else None
+    )
+    for name in ("earnings", "distance_km", "route_km", "saved_km"):
+        period[name] = round(period[name], 2)
+    period["apps"] = sorted(period["apps"].values(), key=lambda app: app["earnings"], reverse=True)
+    for app in period["apps"]:
+        app["earnings"] = round(app["earnings"], 2)
+        app["distance_km"] = round(app["distance_km"], 2)
+    return period
+
+
+async def report(db, user_id, days=30, bucket="day", today=None):
+    """
+    Totals and per-period (day or month) figures of the last `days` days,
+    newest period first, each broken down by delivery app
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {BUCKETS}")
+    today = today or datetime.utcnow()
+    since = day_of(today - timedelta(days=days - 1))
+    match = {"$match": {"user_id": user_id, "day": {"$gte": since}}}
+    key = f"${bucket}"
+
+    order_rows = await db.daily_order_stats.aggregate([
+        match,
+        {"$group": {"_id": {"period": key, "app_name": "$app_name"}, **_sum_counters(ORDER_COUNTERS)}},
+    ]).to_list(None)
+    combination_rows = await db.daily_combination_stats.aggregate([
+        match,
+        {"$group": {"_id": key, **_sum_counters(COMBINATION_COUNTERS)}},
+    ]).to_list(None)
+
+    periods = {}
+    totals = _empty_period("total")
+    for row in order_rows:
+        app_name = row["_id"]["app_name"]
+        for target in (periods.setdefault(row["_id"]["period"], _empty_period(row["_id"]["period"])), totals):
+            app = target["apps"].setdefault(
+                app_name, {"app_name": app_name, "completed_orders": 0, "earnings": 0.0, "distance_km": 0.0}
+            )
+            for name in ORDER_COUNTERS:
+                target[name] += row[name]
+                if name in app:
+                    app[name] += row[name]
+    for row in combination_rows:
+        for target in (periods.setdefault(row["_id"], _empty_period(row["_id"])), totals):
+            for name in COMBINATION_COUNTERS:
+                target[name] += row[name]
+
+    return {
+        "since": since,
+        "bucket": bucket,
+        "totals": _finish(totals),
+        "periods": [_finish(periods[period]) for period in sorted(periods, reverse=True)],
+    }
+
+
+def _haversine_expression(lat1, lon1, lat2, lon2):
+    """Haversine distance in kilometres between two field paths, as an aggregation expression"""
+    def half_sine_squared(a, b):
+        return {"$pow": [{"$sin": {"$divide": [{"$degreesToRadians": {"$subtract": [b, a]}}, 2]}}, 2]}
+
+    a = {"$add": [
+        half_sine_squared(lat1, lat2),
+        {"$multiply": [
+            {"$cos": {"$degreesToRadians": lat1}},
+            {"$cos": {"$degreesToRadians": lat2}},
+            half_sine_squared(lon1, lon2),
+        ]},
+    ]}
+    return {"$multiply": [2 * EARTH_RADIUS_KM, {"$asin": {"$sqrt": {"$min": [a, 1]}}}]}
+
+
+def order_rollup_pipeline(scope):
+    completed = {"$ifNull": ["$completed_at", "$updated_at"]}
+    return [
+        {"$match": {**scope, "status": "completed"}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": completed}},
+                "app_name": "$app_name",
+            },
+            "completed_orders": {"$sum": 1},
+            "paid_orders": {"$sum": {"$cond": [{"$eq": [{"$ifNull": ["$payment_amount", None]}, None]}, 0, 1]}},
+            "earnings": {"$sum": {"$ifNull": ["$payment_amount", 0]}},
+            "distance_km": {"$sum": _haversine_expression(
+                "$pickup_location.latitude", "$pickup_location.longitude",
+                "$dropoff_location.latitude", "$dropoff_location.longitude",
+            )},
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "day": "$_id.day",
+            "month": {"$substrBytes": ["$_id.day", 0, 7]},
+            "app_name": "$_id.app_name",
+            **{name: 1 for name in ORDER_COUNTERS},
+        }},
+        {"$merge": {"into": "daily_order_stats", "on": ["user_id", "day", "app_name"], "whenMatched": "replace"}},
+    ]
+
+
+def combination_rollup_pipeline(scope):
+    accepted = {"$ifNull": ["$accepted_at", "$created_at"]}
+    savings = "$savings_percentage"
+    return [
+        {"$match": {**scope, "is_accepted": True}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": accepted}},
+            },
+            "accepted_combinations": {"$sum": 1},
+            "combined_orders": {"$sum": {"$size": "$order_ids"}},
+            "route_km": {"$sum": "$total_distance"},
+            "saved_km": {"$sum": {"$cond": [
+                {"$lt": [savings, 100]},
+                {"$divide": [{"$multiply": ["$total_distance", savings]}, {"$subtract": [100, savings]}]},
+                0,
+            ]}},
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "day": "$_id.day",
+            "month": {"$substrBytes": ["$_id.day", 0, 7]},
+            **{name: 1 for name in COMBINATION_COUNTERS},
+        }},
+        {"$merge": {"into": "daily_combination_stats", "on": ["user_id", "day"], "whenMatched": "replace"}},
+    ]
+
+
+async def rebuild_rollups(db, user_id=None):
+    """Recompute the rollups of one user, or of everyone, from the source collections"""
+    scope = {"user_id": user_id} if user_id else {}
+    await db.daily_order_stats.delete_many(scope)
+    await db.daily_combination_stats.delete_many(scope)
+    await db.orders.aggregate(order_rollup_pipeline(scope)).to_list(None)
+    await db.order_combinations.aggregate(combination_rollup_pipeline(scope)).to_list(None)
+
+
+async def main(user_id=None):
+    from database import create_client, settings_from_env
+    from indexes import ensure_indexes
+
+    load_dotenv(Path(__file__).parent / '.env')
+    settings = settings_from_env()
+    client = create_client(settings)
+    db = client[settings.db_name]
+    try:
+        # $merge needs the unique indexes on the rollup keys
+        await ensure_indexes(db)
+        await rebuild_rollups(db, user_id)
+    finally:
+        client.close()
+    print("Rollups rebuilt" + (f" for {user_id}" if user_id else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the analytics rollups from orders and combinations")
+    parser.add_argument("--user", help="only rebuild this user's rollups")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(user_id=args.user)))
@@ -0,0 +1,209 @@
+"""
+Microbenchmarks of the hot paths behind the API: notification parsing,
+gazetteer geocoding, the Haversine distance matrix, list response
+serialization and the pair/triplet combination search, serial and across the
+process pool.
+
+Run from the backend directory:
+    python -m benchmarks.bench_hot_paths
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import timeit
+
+from benchmarks.bench_notification_parser import build_corpus
+from benchmarks.harness import import_server, make_orders
+from distance_matrix import haversine_matrix
+from geocoding import GazetteerGeocoder
+from notification_parser import parse_notification_content
+
+COMBINATION_SIZES = (10, 50, 500, 5000)
+PAGE_SIZES = (50, 200)
+
+
+def corpus_addresses(corpus):
+    addresses = []
+    for app, content in corpus:
+        parsed = parse_notification_content(app, content)
+        addresses.extend(address for address in (parsed.pickup_address, parsed.dropoff_address) if address)
+    return addresses
+
+
+def bench_process_notification(server, corpus_size, repeat):
+    corpus = build_corpus(corpus_size)
+    notifications = [
+        server.Notification(user_id="bench", app_id="bench", app_name=app, title="New order", content=content)
+        for app, content in corpus
+    ]
+    # Geocoding is cached in production; parse and build against resolved locations
+    gazetteer = GazetteerGeocoder.load()
+    locations = {
+        address: gazetteer.lookup(address) or server.geocoder.fallback
+        for address in corpus_addresses(corpus)
+    }
+    process = server.NotificationProcessor.process_notification
+
+    def loop():
+        for notification in notifications:
+            process(notification, locations)
+
+    best = min(timeit.repeat(loop, number=1, repeat=repeat))
+    return {"corpus_size": corpus_size, "us_per_notification": round(best / len(notifications) * 1e6, 2)}
+
+
+def bench_gazetteer_lookup(corpus_size, repeat):
+    """Cost of one cache miss resolved by the offline gazetteer"""
+    addresses = corpus_addresses(build_corpus(corpus_size))
+    gazetteer = GazetteerGeocoder.load()
+    matched = sum(gazetteer.lookup(address) is not None for address in addresses)
+
+    def loop():
+        for address in addresses:
+            gazetteer.lookup(address)
+
+    best = min(timeit.repeat(loop, number=1, repeat=repeat))
+    return {
+        "addresses": len(addresses),
+        "matched": matched,
+        "us_per_call": round(best / len(addresses) * 1e6, 2),
+    }
+
+
+def bench_distance_matrix(points, repeat):
+    """The pairwise Haversine distances the combination search starts from"""
+    rng = random.Random(3)
+    lat = [30 + rng.random() for _ in range(points)]
+    lon = [31 + rng.random() for _ in range(points)]
+
+    best = min(timeit.repeat(lambda: haversine_matrix(lat, lon, lat, lon), number=1, repeat=repeat))
+    return {"points": points, "ns_per_pair": round(best / points ** 2 * 1e9, 2)}
+
+
+def bench_list_responses(server, page_sizes, repeat):
+    """
+    GET /api/orders body for one page of stored documents: validated into
+    Order models and serialized by FastAPI (FAST_JSON_RESPONSES=false)
+    against written straight out by orjson
+    """
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    from responses import documents_response
+
+    route = next(route for route in server.app.routes if getattr(route, "path", None) == "/api/orders")
+
+    async def legacy(docs):
+        models = [server.Order(**doc) for doc in docs]
+        content = await serialize_response(field=route.response_field, response_content=models)
+        return JSONResponse(content=content).body
+
+    async def fast(docs):
+        return documents_response(docs, server.Order).body
+
+    async def timed(render, docs, loops):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(loops):
+                await render(docs)
+            best = min(best, (time.perf_counter() - started) / loops)
+        return best
+
+    results = {}
+    for size in page_sizes:
+        docs = [order.dict() for order in make_orders(server, size)]
+        # Both paths must produce the same bytes
+        assert asyncio.run(legacy(docs)) == asyncio.run(fast(docs))
+        legacy_seconds = asyncio.run(timed(legacy, docs, 20))
+        fast_seconds = asyncio.run(timed(fast, docs, 20))
+        results[f"page={size}"] = {
+            "documents": size,
+            "legacy_ms": round(legacy_seconds * 1000, 3),
+            "fast_ms": round(fast_seconds * 1000, 3),
+            "speedup": round(legacy_seconds / fast_seconds, 1),
+        }
+    return results
+
+
+def bench_combination_search(server, sizes, repeat):
+    from combinations import search_candidates
+    from order_columns import OrderColumns
+
+    results = {}
+    for n in sizes:
+        orders = OrderColumns.from_orders(make_orders(server, n))
+        # Large inputs take seconds per run; time those fewer times
+        runs = repeat if n <= 500 else 1
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            candidates = search_candidates(orders)
+            timings.append(time.perf_counter() - started)
+        results[f"n={n}"] = {
+            "orders": n,
+            "candidates": len(candidates),
+            "ms": round(min(timings) * 1000, 2),
+        }
+    return results
+
+
+def bench_parallel_search(server, sizes, workers):
+    from combinations import search_candidates
+    from order_columns import OrderColumns
+    from parallel_search import CombinationSearchEngine
+
+    if workers < 2:
+        return {"skipped": "needs at least 2 CPUs"}
+
+    engine = CombinationSearchEngine(workers=workers, min_parallel_orders=0)
+
+    async def search(orders):
+        started = time.perf_counter()
+        await engine.search(orders)
+        return time.perf_counter() - started
+
+    results = {"workers": workers}
+    try:
+        # Start the workers before timing anything
+        asyncio.run(search(OrderColumns.from_orders(make_orders(server, 50))))
+        for n in sizes:
+            orders = OrderColumns.from_orders(make_orders(server, n))
+            started = time.perf_counter()
+            search_candidates(orders)
+            serial = time.perf_counter() - started
+            parallel = asyncio.run(search(orders))
+            results[f"n={n}"] = {
+                "orders": n,
+                "ms": round(parallel * 1000, 2),
+                "speedup": round(serial / parallel, 2),
+            }
+    finally:
+        engine.shutdown()
+    return results
+
+
+def run(corpus_size=2000, distance_points=1000, sizes=COMBINATION_SIZES, repeat=5, workers=None):
+    server = import_server()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    return {
+        "process_notification": bench_process_notification(server, corpus_size, repeat),
+        "gazetteer_lookup": bench_gazetteer_lookup(corpus_size, repeat),
+        "distance_matrix": bench_distance_matrix(distance_points, repeat),
+        "list_responses": bench_list_responses(server, PAGE_SIZES, repeat),
+        "combination_search": bench_combination_search(server, sizes, repeat),
+        "parallel_combination_search": bench_parallel_search(server, [n for n in sizes if n >= 500], workers),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(COMBINATION_SIZES),
+                        help="order counts for the combination search")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, help="processes for the parallel search (default: one per CPU)")
+    args = parser.parse_args()
+    for name, result in run(sizes=args.sizes, repeat=args.repeat, workers=args.workers).items():
+        print(f"{name}: {result}")
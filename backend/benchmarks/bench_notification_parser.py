@@ -0,0 +1,211 @@
+"""
+Compare the precompiled notification pattern engine with the original
+per-call keyword loop on a corpus of Arabic and English notifications.
+
+Run from the backend directory:
+    python -m benchmarks.bench_notification_parser
+"""
+import argparse
+import random
+import timeit
+
+from notification_parser import ParsedFields, parse_notification_content
+
+APP_NAMES = ["Talabat", "Careem", "InDrive", "Uber Eats", "Instashop", "Mrsool"]
+
+TEMPLATES = [
+    "New order! Pickup from {place}, deliver to {street}. Amount: {amount} EGP. Customer {name}.",
+    "Collect from {place}, customer address {street}. Payment {amount} جنيه",
+    "Restaurant {place}. Deliver to {street}, customer {name}. Total {amount} egp",
+    "Pickup at {place}, dropoff at {street}. Fare {amount} EGP",
+    "Starting point {place}, destination {street}. Price {amount} ج.م",
+    "طلب جديد من {place_ar}، إلى {street_ar}. المبلغ {amount} جنيه. العميل {name_ar}",
+    "استلام من {place_ar}\nتوصيل إلى {street_ar}\nالسعر {amount} ج.م",
+    "Shop {place} has your order ready. Delivery address {street}. Order total {amount} EGP. Client {name}.",
+    "Trip request: from {place} to {street}, cost {amount} egp, recipient {name}",
+    "Reminder: rate your last trip",
+]
+
+PLACES = ["KFC Tahrir Square", "Zooba Zamalek branch", "Carrefour City Stars", "Gad Dokki Mesaha", "Buffalo Burger Maadi"]
+STREETS = ["15 Abbas El Akkad St Nasr City", "Building 7 Street 9 Maadi", "26th of July Corridor Sheikh Zayed", "Gameat El Dewal Mohandessin"]
+NAMES = ["Ahmed Hassan", "Mona Adel", "Omar Khaled", "Sara Mahmoud"]
+PLACES_AR = ["مطعم الشبراوي التحرير", "كشري أبو طارق وسط البلد", "فول وفلافل الدقي"]
+STREETS_AR = ["شارع عباس العقاد مدينة نصر", "شارع التسعين التجمع الخامس", "ميدان لبنان المهندسين"]
+NAMES_AR = ["أحمد حسن", "منى عادل", "عمر خالد"]
+
+
+def build_corpus(size, seed=42):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        template = rng.choice(TEMPLATES)
+        content = template.format(
+            place=rng.choice(PLACES),
+            street=rng.choice(STREETS),
+            name=rng.choice(NAMES),
+            place_ar=rng.choice(PLACES_AR),
+            street_ar=rng.choice(STREETS_AR),
+            name_ar=rng.choice(NAMES_AR),
+            amount=f"{rng.uniform(20, 400):.2f}" if rng.random() < 0.5 else rng.randint(20, 400),
+        )
+        corpus.append((rng.choice(APP_NAMES), content))
+    return corpus
+
+
+def legacy_parse(app_name, content):
+    """The original NotificationProcessor keyword loop, kept as a baseline"""
+    content = content.lower()
+    app_name = app_name.lower()
+
+    # The pattern tables used to be rebuilt on every call
+    app_patterns = {
+        "talabat": {
+            "pickup_patterns": [
+                "pickup from", "collect from", "restaurant", "pickup location", "من"
+            ],
+            "dropoff_patterns": [
+                "deliver to", "delivery address", "customer address", "destination", "إلى"
+            ],
+            "amount_patterns": [
+                "amount", "price", "payment", "جنيه", "ج.م", "egp"
+            ]
+        },
+        "careem": {
+            "pickup_patterns": [
+                "pickup", "pick up", "starting location", "from", "pickup at"
+            ],
+            "dropoff_patterns": [
+                "dropoff", "drop off", "destination", "to", "dropoff at"
+            ],
+            "amount_patterns": [
+                "fare", "cost", "price", "egp", "جنيه", "ج.م"
+            ]
+        },
+        "indrive": {
+            "pickup_patterns": [
+                "pickup from", "starting point", "from", "pickup location"
+            ],
+            "dropoff_patterns": [
+                "destination", "drop-off", "to", "delivery location"
+            ],
+            "amount_patterns": [
+                "fare", "price", "egp", "جنيه", "ج.م", "cost"
+            ]
+        },
+        "uber eats": {
+            "pickup_patterns": [
+                "restaurant", "pickup from", "collect from", "ready at"
+            ],
+            "dropoff_patterns": [
+                "deliver to", "customer", "destination", "drop off at"
+            ],
+            "amount_patterns": [
+                "total", "amount", "price", "جنيه", "egp"
+            ]
+        },
+        "instashop": {
+            "pickup_patterns": [
+                "shop", "store", "pickup from", "pickup at", "collect from"
+            ],
+            "dropoff_patterns": [
+                "deliver to", "customer", "destination", "delivery address"
+            ],
+            "amount_patterns": [
+                "order total", "total", "amount", "price", "egp", "جنيه"
+            ]
+        },
+        # Default patterns for unknown apps
+        "default": {
+            "pickup_patterns": [
+                "pickup", "from", "restaurant", "store", "shop", "source", "origin"
+            ],
+            "dropoff_patterns": [
+                "deliver", "to", "customer", "destination", "dropoff", "delivery"
+            ],
+            "amount_patterns": [
+                "amount", "price", "payment", "total", "cost", "fare", "egp", "جنيه"
+            ]
+        }
+    }
+    current_patterns = app_patterns.get(app_name, app_patterns["default"])
+
+    def address_after(patterns):
+        for pattern in patterns:
+            if pattern in content:
+                idx = content.find(pattern) + len(pattern)
+                end_markers = ['.', ',', '\n']
+                end_idx = len(content)
+                for marker in end_markers:
+                    marker_idx = content.find(marker, idx)
+                    if marker_idx != -1 and marker_idx < end_idx:
+                        end_idx = marker_idx
+                address = content[idx:end_idx].strip()
+                if len(address) > 5:
+                    return address
+        return None
+
+    pickup_address = address_after(current_patterns["pickup_patterns"])
+    dropoff_address = address_after(current_patterns["dropoff_patterns"])
+
+    payment_amount = None
+    for pattern in current_patterns["amount_patterns"]:
+        if pattern in content:
+            pattern_idx = content.find(pattern)
+            import re
+            numbers = re.findall(r'\d+(?:\.\d+)?', content[max(0, pattern_idx-20):pattern_idx+20])
+            if numbers:
+                payment_amount = float(max(numbers, key=float))
+                break
+
+    customer_name = None
+    for indicator in ["customer", "client", "recipient", "name"]:
+        if indicator in content:
+            idx = content.find(indicator) + len(indicator)
+            end_idx = min(idx + 30, len(content))
+            potential_name = content[idx:end_idx].strip()
+            first_sentence_end = potential_name.find('.')
+            if first_sentence_end != -1:
+                potential_name = potential_name[:first_sentence_end].strip()
+            if len(potential_name) > 2:
+                customer_name = potential_name
+                break
+
+    return ParsedFields(pickup_address, dropoff_address, payment_amount, customer_name)
+
+
+def run(corpus_size=2000, repeat=5):
+    corpus = build_corpus(corpus_size)
+
+    mismatches = [
+        (app, content) for app, content in corpus
+        if legacy_parse(app, content) != parse_notification_content(app, content)
+    ]
+    if mismatches:
+        app, content = mismatches[0]
+        raise AssertionError(
+            f"{len(mismatches)} notifications parsed differently, e.g. {app!r}: {content!r}"
+        )
+
+    def bench(parse):
+        def loop():
+            for app, content in corpus:
+                parse(app, content)
+        return min(timeit.repeat(loop, number=1, repeat=repeat)) / len(corpus) * 1e6
+
+    legacy_us = bench(legacy_parse)
+    compiled_us = bench(parse_notification_content)
+    return {
+        "corpus_size": corpus_size,
+        "legacy_us_per_notification": round(legacy_us, 2),
+        "compiled_us_per_notification": round(compiled_us, 2),
+        "speedup": round(legacy_us / compiled_us, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=2000, help="number of notifications in the corpus")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for key, value in run(args.size, args.repeat).items():
+        print(f"{key}: {value}")
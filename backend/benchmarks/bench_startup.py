@@ -0,0 +1,133 @@
+"""
+Cold start of the backend: how long a fresh interpreter takes to import the
+app module, from `python -X importtime`, and which of its imports account for
+the time. The modules importing server leaves out are measured separately:
+the lifespan loads the NumPy ones in a thread before serving, and the first
+login loads passlib. Time to ready covers the import and the lifespan up to
+the point the app serves, against mongomock so no database latency is in it.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Not loaded by importing server (see server.DEFERRED_MODULES)
+DEFERRED_MODULES = ("parallel_search", "analytics", "passlib.context")
+
+COLD_START_TARGET_MS = 1000
+
+# Prints the milliseconds from before `import server` until its lifespan has
+# started, i.e. until uvicorn would accept the first request
+READY_SCRIPT = """
+import asyncio, time
+from benchmarks.harness import import_server, open_database, use_database
+started = time.perf_counter()
+server = import_server()
+# Importing mongomock is not part of the app's startup
+mock_started = time.perf_counter()
+_, db = open_database()
+mock_seconds = time.perf_counter() - mock_started
+use_database(server, db)
+
+async def ready():
+    async with server.app.router.lifespan_context(server.app):
+        print((time.perf_counter() - started - mock_seconds) * 1000)
+
+asyncio.run(ready())
+"""
+
+
+def parse_importtime(stderr):
+    """(module, depth, self_us, cumulative_us) of every line -X importtime wrote"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # The header
+        # One space after the bar, then two per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def import_once(statement):
+    """Wall time of a fresh interpreter running `statement`, and its import times"""
+    env = {**os.environ, "PYTHONWARNINGS": "ignore"}
+    # Importing the app does not connect, but needs a URL to build the client
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return time.perf_counter() - started, parse_importtime(result.stderr)
+
+
+def ready_once():
+    """Milliseconds a fresh interpreter takes from importing server to serving"""
+    env = {**os.environ, "PYTHONWARNINGS": "ignore"}
+    result = subprocess.run(
+        [sys.executable, "-c", READY_SCRIPT],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.split()[-1])
+
+
+def cumulative_ms(imports, module):
+    return next(cumulative for name, _, _, cumulative in imports if name == module) / 1000
+
+
+def run(repeat=5, top=10):
+    # One unmeasured run compiles the bytecode and fills the OS file cache;
+    # the rest of the run-to-run noise is taken out by keeping the fastest
+    import_once("import server")
+    runs = [import_once("import server") for _ in range(repeat)]
+    _, imports = min(runs, key=lambda attempt: cumulative_ms(attempt[1], "server"))
+    # The imports of the server module itself, by what they add to it
+    direct = sorted(
+        (entry for entry in imports if entry[1] == 1),
+        key=lambda entry: entry[3], reverse=True,
+    )
+
+    deferred = [import_once(f"import server, {', '.join(DEFERRED_MODULES)}") for _ in range(repeat)]
+    deferred_ms = min(
+        sum(cumulative / 1000 for name, _, _, cumulative in loaded if name in DEFERRED_MODULES)
+        for _, loaded in deferred
+    )
+
+    ready_once()
+    ready_ms = min(ready_once() for _ in range(repeat))
+
+    import_ms = cumulative_ms(imports, "server")
+    return {
+        "import_ms": round(import_ms, 1),
+        "process_ms": round(min(seconds for seconds, _ in runs) * 1000, 1),
+        "deferred_import_ms": round(deferred_ms, 1),
+        "ready_ms": round(ready_ms, 1),
+        "within_target": import_ms < COLD_START_TARGET_MS,
+        "modules": {name: round(cumulative / 1000, 1) for name, _, _, cumulative in direct[:top]},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="how many of the slowest imports to list")
+    args = parser.parse_args()
+    result = run(repeat=args.repeat, top=args.top)
+    print(f"import server: {result['import_ms']} ms (target {COLD_START_TARGET_MS} ms)")
+    print(f"interpreter start to exit: {result['process_ms']} ms")
+    print(f"loaded later, by the lifespan or the first login: {result['deferred_import_ms']} ms")
+    print(f"import server to lifespan started: {result['ready_ms']} ms")
+    print("slowest imports (cumulative ms):")
+    for name, ms in result["modules"].items():
+        print(f"  {ms:8.1f}  {name}")
@@ -0,0 +1,101 @@
+"""
+Shared setup for the benchmarks: importing the app against a benchmark
+database, synthetic orders and latency statistics.
+"""
+import math
+import os
+import random
+import statistics
+
+# Cairo, where the parser places every order
+CENTER_LAT, CENTER_LON = 30.0444, 31.2357
+KM_PER_DEGREE = 111.0
+
+
+def import_server():
+    """Import the app module without needing a configured .env"""
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    import server
+    return server
+
+
+def open_database(mongo_url=None, name="mandoob_bench"):
+    """
+    A fresh benchmark database: mongomock-motor by default, or a database
+    on a real mongod when `mongo_url` is given. Returns (client, db).
+    """
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    return client, client[f"{name}_{os.getpid()}"]
+
+
+def use_database(server, db):
+    """Point the app, and everything holding a collection, at `db`"""
+    server.client = db.client
+    server.db = db
+    server.notification_queue.collection = db.notification_jobs
+    server.notification_queue.notifications = db.notifications
+    server.geocoder.collection = db.geocode_cache
+    server.event_relay.collection = db.event_log
+
+
+def spread_for(n, neighbours=8, radius_km=4.0):
+    """
+    Half-width in degrees of the square around Cairo that n uniformly spread
+    pickups must cover so each has about `neighbours` others within
+    `radius_km`, the widest bundling distance. Keeping the density fixed
+    makes runs at different n comparable.
+    """
+    area_km2 = n * math.pi * radius_km ** 2 / max(neighbours, 1)
+    return math.sqrt(area_km2) / 2 / KM_PER_DEGREE
+
+
+def make_orders(server, n, seed=7, neighbours=8, user_id="bench"):
+    """
+    n pending orders with pickups scattered around central Cairo at a fixed
+    density (see spread_for) and dropoffs within a few kilometres of them
+    """
+    rng = random.Random(seed)
+    spread_deg = spread_for(n, neighbours)
+    orders = []
+    for i in range(n):
+        pickup_lat = CENTER_LAT + rng.uniform(-spread_deg, spread_deg)
+        pickup_lon = CENTER_LON + rng.uniform(-spread_deg, spread_deg)
+        orders.append(server.Order(
+            user_id=user_id,
+            app_id="bench",
+            app_name="Talabat",
+            order_reference=f"BENCH-{i}",
+            pickup_location=server.Location(latitude=pickup_lat, longitude=pickup_lon, address=f"pickup {i}"),
+            dropoff_location=server.Location(
+                latitude=pickup_lat + rng.uniform(-0.04, 0.04),
+                longitude=pickup_lon + rng.uniform(-0.04, 0.04),
+                address=f"dropoff {i}"
+            ),
+        ))
+    return orders
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean/max in milliseconds of a list of durations"""
+    values = sorted(value * 1000 for value in seconds)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50), 2),
+        "p95_ms": round(percentile(values, 95), 2),
+        "p99_ms": round(percentile(values, 99), 2),
+        "mean_ms": round(statistics.fmean(values), 2) if values else 0.0,
+        "max_ms": round(values[-1], 2) if values else 0.0,
+    }
@@ -0,0 +1,165 @@
+"""
+Concurrent load scenario driven through the ASGI app in process: virtual
+users log in, post notifications, list their orders and generate
+combinations. Reports per-endpoint latency percentiles and throughput.
+
+Run from the backend directory (mongomock-motor unless --mongo-url):
+    python -m benchmarks.load_test --users 20 --iterations 25
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.bench_notification_parser import build_corpus
+from benchmarks.harness import import_server, latency_summary, open_database, use_database
+from delivery_apps import DEFAULT_DELIVERY_APPS
+
+
+class LoadRecorder:
+    """Latencies and status codes per endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, client, name, method, url, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[name].append(time.perf_counter() - started)
+        self.statuses[name][response.status_code] += 1
+        return response
+
+    def summary(self, wall_seconds):
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            "requests": total,
+            "wall_seconds": round(wall_seconds, 3),
+            "rps": round(total / wall_seconds, 1) if wall_seconds else 0.0,
+            "endpoints": {
+                name: {
+                    **latency_summary(values),
+                    "statuses": {str(code): count for code, count in sorted(self.statuses[name].items())},
+                }
+                for name, values in sorted(self.latencies.items())
+            },
+        }
+
+
+PASSWORD = "bench-password"
+
+
+async def register_user(client, index):
+    username = f"bench{index}"
+    response = await client.post("/api/users", json={
+        "username": username,
+        "email": f"{username}@example.com",
+        "full_name": f"Bench User {index}",
+        "password": PASSWORD,
+    })
+    response.raise_for_status()
+
+
+async def virtual_user(client, recorder, index, iterations, corpus, relogin_every, generate_every, think_seconds):
+    username = f"bench{index}"
+    rng = random.Random(index)
+    headers = {}
+    for iteration in range(iterations):
+        if iteration % relogin_every == 0:
+            response = await recorder.request(
+                client, "POST /api/token", "POST", "/api/token",
+                data={"username": username, "password": PASSWORD}
+            )
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        app_name, content = rng.choice(corpus)
+        await recorder.request(
+            client, "POST /api/notifications/simulate", "POST", "/api/notifications/simulate",
+            json={"app_name": app_name, "title": "New order", "content": content}, headers=headers
+        )
+        await recorder.request(client, "GET /api/orders", "GET", "/api/orders", headers=headers)
+        if iteration % generate_every == generate_every - 1:
+            await recorder.request(
+                client, "POST /api/combinations/generate", "POST", "/api/combinations/generate", headers=headers
+            )
+        # Even at zero think time this yields to the event loop, as a real
+        # client's network round trip would; mongomock calls never do
+        await asyncio.sleep(think_seconds)
+
+
+async def run_scenario(users=10, iterations=20, relogin_every=10, generate_every=5, think_seconds=0.0, mongo_url=None,
+                       fast_json=True):
+    server = import_server()
+    server.FAST_JSON_RESPONSES = fast_json
+    # One log line per request would dominate the measurement
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    mongo_client, db = open_database(mongo_url)
+    use_database(server, db)
+
+    # Only apps in the catalogue; the rest would just be rejected
+    app_names = {app["name"] for app in DEFAULT_DELIVERY_APPS}
+    corpus = [(app, content) for app, content in build_corpus(500) if app in app_names]
+
+    recorder = LoadRecorder()
+    try:
+        # ASGITransport does not run the lifespan itself
+        async with server.app.router.lifespan_context(server.app):
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                # Sign-ups are setup, not part of the measured scenario
+                await asyncio.gather(*(register_user(client, index) for index in range(users)))
+                started = time.perf_counter()
+                await asyncio.gather(*(
+                    virtual_user(client, recorder, index, iterations, corpus, relogin_every, generate_every, think_seconds)
+                    for index in range(users)
+                ))
+                wall_seconds = time.perf_counter() - started
+    finally:
+        if mongo_url:
+            await mongo_client.drop_database(db.name)
+        mongo_client.close()
+
+    return {
+        "users": users,
+        "iterations": iterations,
+        "bcrypt_rounds": server.password_hasher.rounds,
+        "fast_json": fast_json,
+        **recorder.summary(wall_seconds),
+    }
+
+
+def run(**kwargs):
+    return asyncio.run(run_scenario(**kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--iterations", type=int, default=20, help="notifications posted per user")
+    parser.add_argument("--relogin-every", type=int, default=10)
+    parser.add_argument("--generate-every", type=int, default=5)
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause between iterations of a user")
+    parser.add_argument("--mongo-url", help="benchmark against a real mongod instead of mongomock-motor")
+    parser.add_argument("--legacy-json", action="store_true",
+                        help="serve list endpoints through the response models (FAST_JSON_RESPONSES=false)")
+    args = parser.parse_args()
+
+    result = run(
+        users=args.users,
+        iterations=args.iterations,
+        relogin_every=args.relogin_every,
+        generate_every=args.generate_every,
+        think_seconds=args.think_ms / 1000,
+        mongo_url=args.mongo_url,
+        fast_json=not args.legacy_json,
+    )
+    print(f"{result['requests']} requests in {result['wall_seconds']}s ({result['rps']} req/s)")
+    for name, stats in result["endpoints"].items():
+        print(
+            f"{name:40} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  "
+            f"p99 {stats['p99_ms']:>8} ms  {stats['statuses']}"
+        )
@@ -0,0 +1,118 @@
+"""
+Run every benchmark and compare the results with the recorded baseline.
+
+Run from the backend directory:
+    python -m benchmarks.run                  # compare with baseline.json
+    python -m benchmarks.run --save-baseline  # record a new baseline
+    python -m benchmarks.run --quick          # skip n=5000 and the load test
+
+Exits with status 1 when a metric regressed by more than --tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks import bench_hot_paths, bench_notification_parser, bench_startup, load_test
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+# Metric name suffixes and whether a larger value is better
+LOWER_IS_BETTER = ("ms", "us_per_notification", "us_per_call", "ns_per_pair")
+HIGHER_IS_BETTER = ("rps", "speedup")
+
+
+def collect(quick=False, load_users=10, load_iterations=20, mongo_url=None):
+    # Quick runs skip the slow cases but keep the others' inputs identical,
+    # so their numbers stay comparable with the baseline
+    results = {
+        "notification_parser": bench_notification_parser.run(),
+        "startup": bench_startup.run(),
+        **bench_hot_paths.run(
+            sizes=(10, 50, 500) if quick else bench_hot_paths.COMBINATION_SIZES,
+        ),
+    }
+    if not quick:
+        results["load"] = load_test.run(users=load_users, iterations=load_iterations, mongo_url=mongo_url)
+    return results
+
+
+def flatten(results, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, numeric leaves only"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def direction(metric):
+    leaf = metric.rsplit(".", 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0  # counts and settings are not compared
+
+
+def compare(baseline, current, tolerance):
+    """(metric, baseline, current, change) of every metric that got worse than tolerance"""
+    before, after = flatten(baseline), flatten(current)
+    regressions = []
+    for metric, old in before.items():
+        new = after.get(metric)
+        sign = direction(metric)
+        if new is None or sign == 0 or old == 0:
+            continue
+        change = (new - old) / old
+        if -sign * change > tolerance:
+            regressions.append((metric, old, new, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="skip n=5000 and the load test")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write the results to {BASELINE_PATH.name}")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown (default 0.25)")
+    parser.add_argument("--output", type=Path, help="also write the results to this JSON file")
+    parser.add_argument("--mongo-url", help="run the load test against a real mongod")
+    args = parser.parse_args()
+
+    report = {
+        "recorded_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "database": "mongod" if args.mongo_url else "mongomock-motor",
+        },
+        "results": collect(quick=args.quick, mongo_url=args.mongo_url),
+    }
+    print(json.dumps(report["results"], indent=2))
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    if args.save_baseline:
+        BASELINE_PATH.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+    if not BASELINE_PATH.exists():
+        print("No baseline recorded yet; run with --save-baseline")
+        return 0
+
+    baseline = json.loads(BASELINE_PATH.read_text())
+    regressions = compare(baseline["results"], report["results"], args.tolerance)
+    for metric, old, new, change in regressions:
+        print(f"REGRESSION {metric}: {old} -> {new} ({change:+.0%})")
+    print(f"{len(regressions)} regressions against the baseline from {baseline['recorded_at']}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import heapq
+import itertools
+from typing import List, NamedTuple, Optional, Tuple
+
+from distance_matrix import DistanceMatrix
+from routing import DEFAULT_TIME_BUDGET_MS, RoutingEngine, solve_route
+from spatial_index import pickup_neighbours
+
+# Maximum pickup distances (km) for orders to be bundled together
+PAIR_PICKUP_KM = 3.0
+TRIPLET_PICKUP_KM = 3.5
+TRIPLET_OUTER_PICKUP_KM = 4.0
+
+# Minimum savings (%) for a bundle to be worth suggesting, by bundle size
+MIN_SAVINGS_PERCENTAGE = {2: 0, 3: 5}  # Higher threshold for triplets
+
+
+class Candidate(NamedTuple):
+    """A bundle of order indices that is worth combining, with its route"""
+    indices: Tuple[int, ...]
+    total_distance: float  # in kilometers
+    estimated_time: int  # in minutes
+    savings_percentage: float
+    stops: List[int]  # routing.Route stops over `indices`
+
+
+def is_bundle(pickup_dist, bundle):
+    """
+    Whether the pickups of a bundle (order indices in canonical order) are
+    close enough to each other to be combined
+    """
+    if len(bundle) == 2:
+        i, j = bundle
+        return pickup_dist[i][j] <= PAIR_PICKUP_KM
+    i, j, k = bundle
+    return (
+        pickup_dist[i][j] <= TRIPLET_PICKUP_KM and
+        pickup_dist[j][k] <= TRIPLET_PICKUP_KM and
+        pickup_dist[i][k] <= TRIPLET_OUTER_PICKUP_KM
+    )
+
+
+def candidate_bundles(n, pickup_dist, neighbours, start=0, stop=None):
+    """
+    Yield every pair, then every triplet, of order indices whose pickups are
+    close enough to bundle. neighbours[i] lists the j > i whose pickup is
+    within TRIPLET_OUTER_PICKUP_KM of order i, in ascending order, and
+    pickup_dist rows are the dicts of a DistanceMatrix built over those pairs.
+    With start/stop only bundles whose first index is in [start, stop) are
+    yielded, so the search can be split into disjoint ranges.
+    """
+    stop = n if stop is None else stop
+    for i in range(start, stop):
+        row_i = pickup_dist[i]
+        for j in neighbours[i]:
+            if row_i[j] <= PAIR_PICKUP_KM:
+                yield (i, j)
+
+    for i in range(start, stop):
+        row_i = pickup_dist[i]
+        for j in neighbours[i]:
+            if row_i[j] > TRIPLET_PICKUP_KM:
+                continue
+            row_j = pickup_dist[j]
+            for k in neighbours[j]:
+                if row_j[k] <= TRIPLET_PICKUP_KM and row_i.get(k, TRIPLET_OUTER_PICKUP_KM + 1) <= TRIPLET_OUTER_PICKUP_KM:
+                    yield (i, j, k)
+
+
+def bundles_containing(target, n, pickup_dist):
+    """
+    Yield the pairs and triplets among n orders (dense pickup_dist) that
+    include order `target`, with indices in canonical order
+    """
+    others = [i for i in range(n) if i != target]
+    for other in others:
+        bundle = tuple(sorted((other, target)))
+        if is_bundle(pickup_dist, bundle):
+            yield bundle
+
+    for a_pos, a in enumerate(others):
+        for b in others[a_pos + 1:]:
+            bundle = tuple(sorted((a, b, target)))
+            if is_bundle(pickup_dist, bundle):
+                yield bundle
+
+
+def evaluate_bundle(bundle, distances, engine=RoutingEngine.AUTO, time_budget_ms=DEFAULT_TIME_BUDGET_MS) -> Optional[Candidate]:
+    """
+    Route a bundle and compare it with delivering each order separately.
+    Returns None when the savings are below the threshold for its size.
+    """
+    route = solve_route(distances.stop_distances(bundle), len(bundle), engine=engine, time_budget_ms=time_budget_ms)
+    total_distance = round(route.distance, 2)
+
+    # Calculate independent delivery distance (if done separately)
+    direct = distances.direct
+    separate_distance = sum(direct[i] for i in bundle)
+    if separate_distance <= 0:
+        # Every order starts where it ends (one place, or addresses located
+        # no closer than the same point), so there is nothing to save
+        return None
+    savings_percentage = ((separate_distance - total_distance) / separate_distance) * 100
+    if savings_percentage <= MIN_SAVINGS_PERCENTAGE[len(bundle)]:
+        return None
+
+    # Estimated time in minutes (assuming average speed of 30 km/h in Cairo traffic)
+    # 30 km/h = 0.5 km/min, so time = distance / 0.5 = distance * 2
+    estimated_time = int(route.distance * 2) + (5 * len(bundle))  # Add 5 minutes per stop
+
+    return Candidate(
+        indices=bundle,
+        total_distance=total_distance,
+        estimated_time=estimated_time,
+        savings_percentage=round(max(0, savings_percentage), 1),
+        stops=route.stops,
+    )
+
+
+def bundle_rank(bundle, n):
+    """
+    Position of a bundle in enumeration order (pairs before triplets, then
+    by indices). Among equal savings, the earlier bundle is preferred.
+    """
+    if len(bundle) == 2:
+        i, j = bundle
+        return i * n * n + j * n
+    i, j, k = bundle
+    return n ** 3 + i * n * n + j * n + k
+
+
+def keep_best(heap, entry, top_k=None):
+    """
+    Push (savings, tie_break, candidate) onto a min-heap holding the best
+    `top_k` entries (all when None). The first two fields must be unique,
+    so candidates themselves are never compared.
+    """
+    if top_k is None or len(heap) < top_k:
+        heapq.heappush(heap, entry)
+    elif entry[:2] > heap[0][:2]:
+        heapq.heapreplace(heap, entry)
+
+
+def best_first(heap):
+    """The candidates of a keep_best heap, best first"""
+    return [entry[2] for entry in sorted(heap, key=lambda entry: entry[:2], reverse=True)]
+
+
+def search_range(pickup_dist, neighbours, distances, start, stop, engine=RoutingEngine.AUTO,
+                 time_budget_ms=DEFAULT_TIME_BUDGET_MS, top_k=None):
+    """
+    The best `top_k` (all when None) candidates among the bundles whose first
+    order index is in [start, stop), best first. Only a bounded heap of
+    (savings, -rank, candidate) tuples is kept while searching.
+    """
+    n = len(distances)
+    heap = []
+    for bundle in candidate_bundles(n, pickup_dist, neighbours, start, stop):
+        candidate = evaluate_bundle(bundle, distances, engine, time_budget_ms)
+        if candidate is None:
+            continue
+        keep_best(heap, (candidate.savings_percentage, -bundle_rank(bundle, n), candidate), top_k)
+    return best_first(heap)
+
+
+def merge_candidates(partitions, n, top_k=None):
+    """Merge the best-first candidate lists of disjoint index ranges"""
+    merged = heapq.merge(
+        *partitions,
+        key=lambda candidate: (-candidate.savings_percentage, bundle_rank(candidate.indices, n))
+    )
+    return list(itertools.islice(merged, top_k))
+
+
+def search_candidates(orders, engine=RoutingEngine.AUTO, time_budget_ms=DEFAULT_TIME_BUDGET_MS, top_k=None) -> List[Candidate]:
+    """
+    The best `top_k` (all when None) pairs and triplets of `orders`, an
+    order_columns.OrderColumns, best savings first
+    """
+    # Index pickups spatially so only orders whose pickups are within the
+    # widest combination threshold are ever paired up
+    pairs, neighbours = pickup_neighbours(orders.pickup_lat, orders.pickup_lon, TRIPLET_OUTER_PICKUP_KM)
+
+    # Distances between candidate orders are computed once up front; bundle
+    # enumeration and routing below only look them up
+    distances = DistanceMatrix.from_columns(orders, pairs=pairs)
+    return search_range(distances.pickup, neighbours, distances, 0, len(orders), engine, time_budget_ms, top_k)
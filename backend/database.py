@@ -0,0 +1,149 @@
+"""
+MongoDB connection management.
+
+The Motor client is built from MongoSettings, read from the environment and
+validated when the server starts, so a bad value fails the deploy instead of
+the first query. Options written into MONGO_URL's query string take
+precedence over the MONGO_* variables. warm_up() opens the pool's first
+connections before traffic arrives, so the first requests after a deploy do
+not pay for TCP, TLS and the handshake.
+
+    MONGO_URL, DB_NAME
+    MONGO_APP_NAME                      shown in the server's logs and currentOp
+    MONGO_MAX_POOL_SIZE                 connections per server worker (50)
+    MONGO_MIN_POOL_SIZE                 kept open even when idle (4)
+    MONGO_MAX_IDLE_TIME_MS              idle connections above the minimum are closed (300000)
+    MONGO_MAX_CONNECTING                connections being established at once (2)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS         fail a checkout after waiting this long (unset: wait)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS   fail fast when no server is reachable (5000)
+    MONGO_CONNECT_TIMEOUT_MS            (5000)
+    MONGO_SOCKET_TIMEOUT_MS             (unset: no timeout)
+    MONGO_COMPRESSORS                   e.g. "zstd,snappy,zlib"; zstd needs zstandard, snappy python-snappy
+    MONGO_READ_PREFERENCE               primary, primaryPreferred, secondary, secondaryPreferred or nearest
+    MONGO_WRITE_CONCERN                 a number of members or "majority" (unset: the server's default)
+    MONGO_JOURNAL                       true or false (unset: the server's default)
+    MONGO_WARM_CONNECTIONS              opened at startup (default: MONGO_MIN_POOL_SIZE)
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from typing import List, Literal, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import BaseModel, Field, model_validator
+
+logger = logging.getLogger(__name__)
+
+# Python packages the wire compressors need; zlib is in the standard library
+COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+class MongoSettings(BaseModel):
+    url: str
+    db_name: str = "mandoob_plus"
+    app_name: str = "mandoob-plus"
+    max_pool_size: int = Field(50, ge=1)
+    min_pool_size: int = Field(4, ge=0)
+    max_idle_time_ms: Optional[int] = Field(300000, ge=1)
+    max_connecting: int = Field(2, ge=1)
+    wait_queue_timeout_ms: Optional[int] = Field(None, ge=1)
+    server_selection_timeout_ms: int = Field(5000, ge=1)
+    connect_timeout_ms: int = Field(5000, ge=1)
+    socket_timeout_ms: Optional[int] = Field(None, ge=1)
+    compressors: List[Literal["zstd", "snappy", "zlib"]] = Field(default_factory=list)  # In order of preference
+    read_preference: Literal["primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"] = "primary"
+    write_concern: Optional[str] = Field(None, pattern=r"^([0-9]+|majority)$")
+    journal: Optional[bool] = None
+    warm_connections: Optional[int] = Field(None, ge=0)
+
+    @model_validator(mode="after")
+    def check_consistency(self):
+        if self.min_pool_size > self.max_pool_size:
+            raise ValueError("MONGO_MIN_POOL_SIZE cannot exceed MONGO_MAX_POOL_SIZE")
+        if self.warm_connections is not None and self.warm_connections > self.max_pool_size:
+            raise ValueError("MONGO_WARM_CONNECTIONS cannot exceed MONGO_MAX_POOL_SIZE")
+        for compressor in self.compressors:
+            if importlib.util.find_spec(COMPRESSOR_PACKAGES[compressor]) is None:
+                raise ValueError(f"The {compressor} compressor needs the {COMPRESSOR_PACKAGES[compressor]} package")
+        return self
+
+    def client_options(self):
+        """Keyword arguments for the client, leaving out options set in the URL"""
+        options = {
+            "appname": self.app_name,
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "maxIdleTimeMS": self.max_idle_time_ms,
+            "maxConnecting": self.max_connecting,
+            "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "compressors": ",".join(self.compressors) or None,
+            "readPreference": self.read_preference,
+            "w": int(self.write_concern) if self.write_concern and self.write_concern.isdigit() else self.write_concern,
+            "journal": self.journal,
+        }
+        in_url = {name.lower() for name in parse_qs(urlsplit(self.url).query)}
+        return {
+            name: value for name, value in options.items()
+            if value is not None and name.lower() not in in_url
+        }
+
+    @property
+    def connections_to_warm(self):
+        return self.min_pool_size if self.warm_connections is None else self.warm_connections
+
+
+# Environment variable of each setting
+ENVIRONMENT = {
+    "url": "MONGO_URL",
+    "db_name": "DB_NAME",
+    "app_name": "MONGO_APP_NAME",
+    "max_pool_size": "MONGO_MAX_POOL_SIZE",
+    "min_pool_size": "MONGO_MIN_POOL_SIZE",
+    "max_idle_time_ms": "MONGO_MAX_IDLE_TIME_MS",
+    "max_connecting": "MONGO_MAX_CONNECTING",
+    "wait_queue_timeout_ms": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "server_selection_timeout_ms": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connect_timeout_ms": "MONGO_CONNECT_TIMEOUT_MS",
+    "socket_timeout_ms": "MONGO_SOCKET_TIMEOUT_MS",
+    "compressors": "MONGO_COMPRESSORS",
+    "read_preference": "MONGO_READ_PREFERENCE",
+    "write_concern": "MONGO_WRITE_CONCERN",
+    "journal": "MONGO_JOURNAL",
+    "warm_connections": "MONGO_WARM_CONNECTIONS",
+}
+
+
+def settings_from_env():
+    """MongoSettings from the environment; raises a ValueError naming the bad settings"""
+    values = {}
+    for field, variable in ENVIRONMENT.items():
+        value = os.environ.get(variable)
+        if value is None or value == "":
+            continue
+        if field == "compressors":
+            value = [name.strip() for name in value.split(",") if name.strip()]
+        values[field] = value
+    return MongoSettings(**values)
+
+
+def create_client(settings, event_listeners=()):
+    return AsyncIOMotorClient(settings.url, event_listeners=list(event_listeners), **settings.client_options())
+
+
+async def warm_up(client, connections):
+    """
+    Open `connections` pooled connections by running that many pings at
+    once. Returns the seconds it took.
+    """
+    started = time.perf_counter()
+    if connections:
+        await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+    logger.info("Warmed %s MongoDB connections in %.0f ms", connections, elapsed * 1000)
+    return elapsed
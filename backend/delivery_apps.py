@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, NamedTuple
+
+import orjson
+
+# Apps created on first startup
+DEFAULT_DELIVERY_APPS = [
+    {
+        "name": "Talabat",
+        "logo_url": "https://play-lh.googleusercontent.com/HN9-_FL6v4AwKslcCKD9BB0rsmbK_BLJdzjFTKPaHRQr7-xM3xkJl2E0M4TjRH1__Ps",
+    },
+    {
+        "name": "Careem",
+        "logo_url": "https://play-lh.googleusercontent.com/uf19YZxHI1RdHhvDGbwPrMupvYF2BxLVvheEPolXsHFRjGfnZJQJg-9qoCLMJVE54Q",
+    },
+    {
+        "name": "InDrive",
+        "logo_url": "https://play-lh.googleusercontent.com/Q6oi2-y7Mega_8VYu-UvdE9PBgHfBZTb-KnFPXHxjDgWbkgnJqMzwlMxhW9or6P12KDU",
+    },
+    {
+        "name": "Uber Eats",
+        "logo_url": "https://play-lh.googleusercontent.com/kDzXOuJzWFNJNwWH45Ck3ZjhIK3UCxNXmOqYJcLb8wEJ2QXRzQ-BXgbD7q9LlJmeoa0",
+    },
+    {
+        "name": "Instashop",
+        "logo_url": "https://play-lh.googleusercontent.com/BYpbl6-tIYf4VGzvsb5dhPP6Lq8Ql-FEyxNYgO6v-3RQbTIPU85oRFQvGk8QxLQvqA",
+    },
+]
+
+
+class CatalogueSnapshot(NamedTuple):
+    version: int
+    etag: str
+    body: bytes  # JSON list served as-is by /api/delivery-apps
+    apps: List[dict]
+    by_name: Dict[str, dict]
+
+
+class DeliveryAppCatalogue:
+    """
+    In-memory snapshot of the delivery_apps collection. The list barely ever
+    changes, so it is loaded once at startup and reloaded every
+    `refresh_seconds` (or on demand via refresh()). Each distinct content
+    gets a new version and ETag so clients can revalidate with 304s.
+    """
+
+    def __init__(self, refresh_seconds=300):
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def seed(self, db):
+        """Insert the default apps that are missing; safe under concurrent startups"""
+        for app in DEFAULT_DELIVERY_APPS:
+            await db.delivery_apps.update_one(
+                {"name": app["name"]},
+                {"$setOnInsert": {
+                    "id": str(uuid.uuid4()),
+                    "name": app["name"],
+                    "logo_url": app["logo_url"],
+                    "is_active": True,
+                    "created_at": datetime.utcnow(),
+                }},
+                upsert=True
+            )
+
+    async def refresh(self, db):
+        apps = await db.delivery_apps.find({}, {"_id": 0}).sort("created_at", 1).to_list(length=None)
+        body = orjson.dumps(apps)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+
+        previous = self.snapshot
+        if previous is None or previous.etag != etag:
+            version = previous.version + 1 if previous else 1
+            self.snapshot = CatalogueSnapshot(version, etag, body, apps, {app["name"]: app for app in apps})
+        self._loaded_at = time.monotonic()
+        return self.snapshot
+
+    async def current(self, db):
+        """The current snapshot, reloading it first if it is older than refresh_seconds"""
+        if self.snapshot is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return self.snapshot
+        async with self._lock:
+            # Another request may have refreshed while we waited for the lock
+            if self.snapshot is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return self.snapshot
+            return await self.refresh(db)
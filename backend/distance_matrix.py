@@ -0,0 +1,116 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # Radius of the Earth in kilometers
+
+
+def haversine_pairs(lat1, lon1, lat2, lon2):
+    """
+    Element-wise Haversine distances in kilometers between two sets of points
+    given in degrees. Inputs broadcast against each other like NumPy arrays.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    # Guard against rounding pushing a marginally outside [0, 1]
+    a = np.clip(a, 0.0, 1.0)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """
+    Pairwise Haversine distances in kilometers between two sets of points.
+    Inputs are 1-D sequences of degrees; the result has shape (len(lat1), len(lat2)).
+    """
+    return haversine_pairs(
+        np.asarray(lat1, dtype=np.float64)[:, None],
+        np.asarray(lon1, dtype=np.float64)[:, None],
+        np.asarray(lat2, dtype=np.float64)[None, :],
+        np.asarray(lon2, dtype=np.float64)[None, :],
+    )
+
+
+class DistanceMatrix:
+    """
+    Pickup and dropoff distances for a set of orders, computed in vectorized
+    passes. Order i's pickup is point i and its dropoff is point n + i.
+
+    Without `pairs` every distance is computed (a dense 2n x 2n matrix).
+    With `pairs`, an (m, 2) array of order index pairs such as the candidates
+    from spatial_index.pickup_neighbours, only the distances between those
+    orders are computed and the rows become dicts. This keeps memory linear
+    in the number of candidates for large order sets.
+
+    Either way the views (pickup, dropoff, pickup_to_dropoff, direct) are
+    indexed as view[i][j]. The combination loops use them directly, because
+    plain list and dict lookups are much cheaper than scalar NumPy indexing
+    inside Python loops.
+    """
+
+    def __init__(self, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, pairs=None):
+        pickup_lat = np.asarray(pickup_lat, dtype=np.float64)
+        pickup_lon = np.asarray(pickup_lon, dtype=np.float64)
+        dropoff_lat = np.asarray(dropoff_lat, dtype=np.float64)
+        dropoff_lon = np.asarray(dropoff_lon, dtype=np.float64)
+        n = len(pickup_lat)
+        self.size = n
+
+        # Distance of each order done on its own: its pickup to its dropoff
+        direct = haversine_pairs(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon)
+        self.direct = direct.tolist()
+
+        if pairs is None:
+            lat = np.concatenate([pickup_lat, dropoff_lat])
+            lon = np.concatenate([pickup_lon, dropoff_lon])
+            matrix = haversine_matrix(lat, lon, lat, lon)
+            self.pickup = matrix[:n, :n].tolist()
+            self.dropoff = matrix[n:, n:].tolist()
+            self.pickup_to_dropoff = matrix[:n, n:].tolist()
+            return
+
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        i, j = pairs[:, 0], pairs[:, 1]
+        pickup = haversine_pairs(pickup_lat[i], pickup_lon[i], pickup_lat[j], pickup_lon[j])
+        dropoff = haversine_pairs(dropoff_lat[i], dropoff_lon[i], dropoff_lat[j], dropoff_lon[j])
+        i_to_j = haversine_pairs(pickup_lat[i], pickup_lon[i], dropoff_lat[j], dropoff_lon[j])
+        j_to_i = haversine_pairs(pickup_lat[j], pickup_lon[j], dropoff_lat[i], dropoff_lon[i])
+
+        self.pickup = [{a: 0.0} for a in range(n)]
+        self.dropoff = [{a: 0.0} for a in range(n)]
+        self.pickup_to_dropoff = [{a: d} for a, d in enumerate(self.direct)]
+        for a, b, pp, dd, ab, ba in zip(
+            i.tolist(), j.tolist(), pickup.tolist(), dropoff.tolist(), i_to_j.tolist(), j_to_i.tolist()
+        ):
+            self.pickup[a][b] = self.pickup[b][a] = pp
+            self.dropoff[a][b] = self.dropoff[b][a] = dd
+            self.pickup_to_dropoff[a][b] = ab
+            self.pickup_to_dropoff[b][a] = ba
+
+    @classmethod
+    def from_columns(cls, orders, pairs=None):
+        """Build the matrix from an order_columns.OrderColumns"""
+        return cls(orders.pickup_lat, orders.pickup_lon, orders.dropoff_lat, orders.dropoff_lon, pairs=pairs)
+
+    def stop_distances(self, indices):
+        """
+        Distance matrix between the stops of the given orders, in the layout
+        routing.solve_route expects: stop s < k is the pickup of indices[s]
+        and stop k + s is its dropoff.
+        """
+        pickup = self.pickup
+        dropoff = self.dropoff
+        pickup_to_dropoff = self.pickup_to_dropoff
+        rows = []
+        for a in indices:
+            rows.append([pickup[a][b] for b in indices] + [pickup_to_dropoff[a][b] for b in indices])
+        for a in indices:
+            rows.append([pickup_to_dropoff[b][a] for b in indices] + [dropoff[a][b] for b in indices])
+        return rows
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from pymongo import ASCENDING, CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of per-user events for the push stream.
+    Every subscriber gets a bounded queue; a subscriber that falls behind
+    loses its oldest events rather than slowing publishers down.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+
+    @contextmanager
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def subscriber_count(self, user_id=None):
+        if user_id is not None:
+            return len(self._subscribers.get(user_id, ()))
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, user_id, event_type, data):
+        queues = self._subscribers.get(user_id)
+        if not queues:
+            return
+        event = {
+            "type": event_type,
+            "data": jsonable_encoder(data),
+            "sent_at": datetime.utcnow().isoformat(),
+        }
+        for queue in list(queues):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+# Change stream operation types mapped to the events they publish
+_CHANGE_EVENTS = {
+    ("orders", "insert"): "order.created",
+    ("orders", "update"): "order.updated",
+    ("order_combinations", "insert"): "combination.created",
+}
+
+
+async def _watch_collection(db, collection, bus):
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update"]}}}]
+    async with db[collection].watch(pipeline, full_document="updateLookup") as stream:
+        async for change in stream:
+            event_type = _CHANGE_EVENTS.get((collection, change["operationType"]))
+            document = change.get("fullDocument")
+            if event_type is None or not document:
+                continue
+            document.pop("_id", None)
+            bus.publish(document.get("user_id"), event_type, document)
+
+
+async def watch_change_streams(db, bus, retry_seconds=5):
+    """
+    Feed the bus from MongoDB change streams instead of from the request
+    handlers, so events written by any process reach every subscriber.
+    Requires a replica set.
+    """
+    collections = sorted({collection for collection, _ in _CHANGE_EVENTS})
+    while True:
+        try:
+            await asyncio.gather(*(_watch_collection(db, collection, bus) for collection in collections))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Change stream failed, retrying in %ss", retry_seconds)
+            await asyncio.sleep(retry_seconds)
+
+
+class MongoEventRelay:
+    """
+    Shares published events between server processes through a capped
+    collection. publish() only queues the event; a writer task inserts the
+    queued events in batches. Every process tails the collection and hands
+    the events to its local bus, so a subscriber connected to any worker
+    gets the events published by all of them. Unlike change streams this
+    works on a standalone mongod.
+    """
+
+    def __init__(self, collection, bus, size_bytes=16 * 1024 * 1024, max_pending=10000, retry_seconds=1):
+        self.collection = collection
+        self.bus = bus
+        self.size_bytes = size_bytes
+        self.retry_seconds = retry_seconds
+        self._pending = asyncio.Queue(maxsize=max_pending)
+        self._tasks = []
+
+    async def ensure_collection(self):
+        try:
+            await self.collection.database.create_collection(
+                self.collection.name, capped=True, size=self.size_bytes
+            )
+        except CollectionInvalid:
+            pass  # created by another process
+
+    def publish(self, user_id, event_type, data):
+        if self._pending.full():
+            self._pending.get_nowait()
+        self._pending.put_nowait({
+            "user_id": user_id,
+            "type": event_type,
+            "data": jsonable_encoder(data),
+            "published_at": datetime.utcnow(),
+        })
+
+    async def _write(self):
+        while True:
+            batch = [await self._pending.get()]
+            while not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+            try:
+                await self.collection.insert_many(batch, ordered=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Dropped %s events that could not be relayed", len(batch))
+
+    async def _tail(self, since):
+        # After a failure the tail resumes where it stopped
+        seen = set()  # ids already delivered at the `since` timestamp
+        while True:
+            try:
+                cursor = self.collection.find(
+                    {"published_at": {"$gte": since}},
+                    cursor_type=CursorType.TAILABLE_AWAIT,
+                ).sort("$natural", ASCENDING)
+                while cursor.alive:
+                    async for event in cursor:
+                        if event["_id"] in seen:
+                            continue
+                        if event["published_at"] > since:
+                            since, seen = event["published_at"], set()
+                        seen.add(event["_id"])
+                        self.bus.publish(event["user_id"], event["type"], event["data"])
+                # A tailable cursor dies when nothing matches yet
+                await asyncio.sleep(self.retry_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Event relay tail failed, retrying in %ss", self.retry_seconds)
+                await asyncio.sleep(self.retry_seconds)
+
+    async def start(self):
+        # Only events published from now on are delivered; Mongo dates have
+        # millisecond precision
+        now = datetime.utcnow()
+        since = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        await self.ensure_collection()
+        self._tasks = [asyncio.create_task(self._write()), asyncio.create_task(self._tail(since))]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,260 @@
+"""
+Address geocoding behind a two-tier cache.
+
+Geocoders subclass Geocoder and implement `geocode_many(addresses)`.
+GazetteerGeocoder is an offline stand-in that matches addresses against a
+gazetteer of Cairo and Giza districts, streets and landmarks
+(data/cairo_gazetteer.json). Another geocoder can be plugged in with
+GEOCODER=package.module:ClassName.
+
+CachedGeocoder keys results by normalized address, so case, punctuation and
+Arabic spelling variants share one entry. It checks an in-process LRU, then
+the geocode_cache collection, and only sends the remaining addresses to the
+geocoder, in one batch. Concurrent lookups of an address wait for the one
+already in flight, so no address is ever resolved twice.
+"""
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from pymongo import UpdateOne
+
+from cache import TTLCache
+
+DEFAULT_GAZETTEER_PATH = Path(__file__).parent / "data" / "cairo_gazetteer.json"
+
+# How specific each kind of gazetteer place is; the most specific match wins
+KIND_RANK = {"landmark": 4, "street": 3, "district": 2, "road": 1}
+
+# A district match, or the city fallback, puts every address in it on one
+# point, so a pickup and dropoff there would be zero distance apart. Each
+# address is moved off that point by up to this many degrees, by an offset
+# derived from the address itself so it always lands in the same place.
+SPREAD_DEGREES = {"city": 0.05, "district": 0.01}
+
+
+class GeocodeResult(NamedTuple):
+    latitude: float
+    longitude: float
+    precision: str  # gazetteer kind, or "city" for the fallback
+    match: str  # name of the matched place
+
+
+_ARABIC_DIACRITICS = re.compile("[ً-ٰٟـ]")  # harakat, dagger alef, tatweel
+_ARABIC_LETTERS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ة": "ه", "ى": "ي"})
+_ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def spread(result: "GeocodeResult", key: str) -> "GeocodeResult":
+    """The result moved off its low-precision point, see SPREAD_DEGREES"""
+    radius = SPREAD_DEGREES.get(result.precision)
+    if not radius:
+        return result
+    digest = hashlib.sha1(key.encode()).digest()
+    # Two uniform values in [-1, 1] from the address
+    dlat, dlon = (int.from_bytes(digest[i:i + 4], "big") / 0xFFFFFFFF * 2 - 1 for i in (0, 4))
+    return result._replace(latitude=result.latitude + dlat * radius, longitude=result.longitude + dlon * radius)
+
+
+def normalize_address(address: str) -> str:
+    """
+    Canonical form of an address for matching and cache keys: case-folded,
+    punctuation removed, Arabic letter variants and diacritics unified and
+    the Arabic article dropped from words.
+    """
+    text = unicodedata.normalize("NFKC", address).casefold()
+    text = _ARABIC_DIACRITICS.sub("", text).translate(_ARABIC_LETTERS).translate(_ARABIC_DIGITS)
+    tokens = []
+    for token in _NON_WORD.sub(" ", text).split():
+        if token.startswith("ال") and len(token) > 3:
+            token = token[2:]
+        tokens.append(token)
+    return " ".join(tokens)
+
+
+class Geocoder(ABC):
+    """Resolves addresses to coordinates"""
+
+    name = "geocoder"
+
+    @abstractmethod
+    async def geocode_many(self, addresses: List[str]) -> List[Optional[GeocodeResult]]:
+        """One result per address, None where it cannot be resolved"""
+
+
+class GazetteerGeocoder(Geocoder):
+    """
+    Offline geocoder: the most specific gazetteer place whose name or alias
+    appears in the address, preferring longer aliases among equally specific
+    places. Addresses without any match resolve to None.
+    """
+
+    def __init__(self, places, name="gazetteer"):
+        self.name = name
+        self._aliases = {}
+        for place in places:
+            result = GeocodeResult(place["latitude"], place["longitude"], place["kind"], place["name"])
+            for alias in [place["name"], *place.get("aliases", [])]:
+                key = tuple(normalize_address(alias).split())
+                if key:
+                    self._aliases.setdefault(key, result)
+        self._longest = max((len(key) for key in self._aliases), default=0)
+
+    @classmethod
+    def load(cls, path=DEFAULT_GAZETTEER_PATH):
+        raw = Path(path).read_bytes()
+        gazetteer = json.loads(raw)
+        # Cached results are tied to the gazetteer version they came from
+        version = hashlib.sha1(raw).hexdigest()[:8]
+        return cls(gazetteer["places"], name=f"gazetteer:{gazetteer.get('name', 'custom')}:{version}")
+
+    def lookup(self, address: str) -> Optional[GeocodeResult]:
+        tokens = normalize_address(address).split()
+        best = None
+        best_rank = None
+        for size in range(min(self._longest, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                result = self._aliases.get(tuple(tokens[start:start + size]))
+                if result is None:
+                    continue
+                rank = (KIND_RANK.get(result.precision, 0), size)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = result, rank
+        return best
+
+    async def geocode_many(self, addresses):
+        return [self.lookup(address) for address in addresses]
+
+
+class CachedGeocoder:
+    """
+    Memory and MongoDB cache in front of a geocoder. Unresolved addresses
+    are cached too and come back as `fallback`. District and city results
+    are spread per address (SPREAD_DEGREES) on the way out, so the cache
+    keeps the geocoder's own coordinates.
+    """
+
+    def __init__(self, geocoder, collection, fallback, maxsize=10000, ttl=24 * 3600):
+        self.geocoder = geocoder
+        self.collection = collection
+        self.fallback = fallback
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight = {}  # normalized address -> Future of its result
+        self.resolved = 0  # addresses sent to the geocoder
+
+    async def geocode(self, address: str) -> GeocodeResult:
+        return (await self.geocode_many([address]))[address]
+
+    async def geocode_many(self, addresses: List[str]) -> Dict[str, GeocodeResult]:
+        """Map each of the given addresses to its location"""
+        keys = {address: normalize_address(address) for address in addresses}
+        found = {}
+        waiting = {}
+        owned = {}  # key -> an address to resolve it with
+        for address, key in keys.items():
+            if key in found or key in waiting or key in owned:
+                continue
+            cached = self.memory.get(key)
+            if cached is not None:
+                found[key] = cached
+            elif key in self._in_flight:
+                waiting[key] = self._in_flight[key]
+            else:
+                owned[key] = address
+
+        if owned:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in owned}
+            self._in_flight.update(futures)
+            resolved = {}
+            try:
+                resolved = await self._resolve(owned)
+                for key, result in resolved.items():
+                    self.memory.set(key, result)
+            finally:
+                for key, future in futures.items():
+                    del self._in_flight[key]
+                    # None tells waiters this lookup failed and to try again
+                    future.set_result(resolved.get(key))
+            found.update(resolved)
+
+        retry = []
+        for key, future in waiting.items():
+            result = await future
+            if result is None:
+                retry.append(key)
+            else:
+                found[key] = result
+        if retry:
+            addresses_of = {key: address for address, key in keys.items()}
+            again = await self.geocode_many([addresses_of[key] for key in retry])
+            found.update({key: again[addresses_of[key]] for key in retry})
+
+        return {address: self._public(found[key], key) for address, key in keys.items()}
+
+    def _public(self, result, key):
+        return spread(self.fallback if result.precision == "unresolved" else result, key)
+
+    async def _resolve(self, owned):
+        """Results for cache-missed keys: from MongoDB, else from the geocoder"""
+        results = {}
+        async for doc in self.collection.find(
+            {"geocoder": self.geocoder.name, "key": {"$in": list(owned)}}, {"_id": 0}
+        ):
+            results[doc["key"]] = GeocodeResult(doc["latitude"], doc["longitude"], doc["precision"], doc["match"])
+
+        missing = [key for key in owned if key not in results]
+        if not missing:
+            return results
+        located = await self.geocoder.geocode_many([owned[key] for key in missing])
+        self.resolved += len(missing)
+
+        now = datetime.utcnow()
+        writes = []
+        for key, result in zip(missing, located):
+            if result is None:
+                result = GeocodeResult(None, None, "unresolved", None)
+            results[key] = result
+            writes.append(UpdateOne(
+                {"geocoder": self.geocoder.name, "key": key},
+                {"$setOnInsert": {**result._asdict(), "address": owned[key], "created_at": now}},
+                upsert=True
+            ))
+        await self.collection.bulk_write(writes, ordered=False)
+        return results
+
+
+def load_fallback(path=DEFAULT_GAZETTEER_PATH):
+    """The gazetteer's city centre, used for addresses nothing resolves"""
+    fallback = json.loads(Path(path).read_bytes())["fallback"]
+    return GeocodeResult(fallback["latitude"], fallback["longitude"], "city", fallback["name"])
+
+
+def geocoder_from_env(collection):
+    """
+    GEOCODER is "gazetteer" (GAZETTEER_PATH) or a module:Class import path;
+    GEOCODE_CACHE_SIZE bounds the in-process tier.
+    """
+    path = os.environ.get("GAZETTEER_PATH", DEFAULT_GAZETTEER_PATH)
+    spec = os.environ.get("GEOCODER", "gazetteer")
+    if spec == "gazetteer":
+        geocoder = GazetteerGeocoder.load(path)
+    else:
+        module_name, _, class_name = spec.partition(":")
+        geocoder_class = getattr(importlib.import_module(module_name), class_name)
+        if not (isinstance(geocoder_class, type) and issubclass(geocoder_class, Geocoder)):
+            raise TypeError(f"GEOCODER={spec} is not a geocoding.Geocoder subclass")
+        geocoder = geocoder_class()
+    return CachedGeocoder(
+        geocoder, collection, load_fallback(path),
+        maxsize=int(os.environ.get("GEOCODE_CACHE_SIZE", 10000)),
+    )
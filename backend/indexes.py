@@ -0,0 +1,194 @@
+"""
+MongoDB index declarations and a query-shape audit.
+
+ensure_indexes() is run at application startup and creates every declared
+index idempotently. The audit runs explain() for the query shape of each hot
+route and reports any that would fall back to a collection scan:
+
+    python indexes.py            # create indexes, then audit
+    python indexes.py --audit    # audit only
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "delivery_apps": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Unique so concurrent startups cannot seed the same app twice
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+    ],
+    "notifications": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("received_at", DESCENDING), ("id", DESCENDING)], name="user_received_id"),
+        IndexModel([("is_processed", ASCENDING), ("received_at", ASCENDING)], name="processed_received"),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_status_created_id"
+        ),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_created_id"),
+        # One order per notification, so a retried processing job cannot duplicate it
+        IndexModel(
+            [("notification_id", ASCENDING)], name="notification_unique", unique=True,
+            partialFilterExpression={"notification_id": {"$type": "string"}}
+        ),
+    ],
+    "order_combinations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created"),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_accepted", ASCENDING), ("savings_percentage", DESCENDING)],
+            name="user_open_savings"
+        ),
+        IndexModel([("order_ids", ASCENDING)], name="order_ids"),
+        # One open combination per set of orders (bundle_key is the sorted ids)
+        IndexModel(
+            [("user_id", ASCENDING), ("bundle_key", ASCENDING)], name="user_open_bundle_unique", unique=True,
+            partialFilterExpression={"is_accepted": False, "bundle_key": {"$exists": True}}
+        ),
+        # Open combinations carry expires_at (COMBINATION_TTL_SECONDS);
+        # accepting one unsets it so it is kept
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "combination_pools": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "geocode_cache": [
+        # One entry per normalized address and geocoder version
+        IndexModel([("geocoder", ASCENDING), ("key", ASCENDING)], name="geocoder_key_unique", unique=True),
+    ],
+    "daily_order_stats": [
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING), ("app_name", ASCENDING)], name="user_day_app_unique", unique=True),
+    ],
+    "daily_combination_stats": [
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], name="user_day_unique", unique=True),
+    ],
+    "notification_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("state", ASCENDING), ("available_at", ASCENDING)], name="state_available"),
+        IndexModel([("state", ASCENDING), ("leased_until", ASCENDING)], name="state_leased"),
+        # Finished jobs are kept a week for /notifications/{id}/status
+        IndexModel([("finished_at", ASCENDING)], name="finished_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+}
+
+AUDIT_TIME = datetime(2024, 1, 1)
+
+# Query shapes issued by the API routes: (route, collection, filter, sort).
+# Values are placeholders; only the shape matters to the planner.
+QUERY_SHAPES = [
+    ("get_user", "users", {"username": "audit"}, None),
+    ("create_user", "users", {"email": "audit@example.com"}, None),
+    ("delivery_apps seed", "delivery_apps", {"name": "Talabat"}, None),
+    ("get_notifications", "notifications", {"user_id": "audit"}, [("received_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_notifications?cursor", "notifications", {"user_id": "audit", "$or": [
+        {"received_at": {"$lt": AUDIT_TIME}}, {"received_at": AUDIT_TIME, "id": {"$lt": "audit"}}
+    ]}, [("received_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_notification_status", "notification_jobs", {"id": "audit"}, None),
+    ("notification_queue claim", "notification_jobs", {"state": "queued", "available_at": {"$lte": AUDIT_TIME}}, [("available_at", ASCENDING)]),
+    ("notification_queue claim expired", "notification_jobs", {"state": "processing", "leased_until": {"$lte": AUDIT_TIME}}, None),
+    ("notification_queue backlog", "notification_jobs", {"state": {"$in": ["queued", "processing"]}}, None),
+    ("notification_queue sweep", "notifications", {"is_processed": False, "received_at": {"$gte": AUDIT_TIME, "$lte": AUDIT_TIME}}, None),
+    ("notification_queue sweep jobs", "notification_jobs", {"id": {"$in": ["audit"]}}, None),
+    ("process_queued_notification", "orders", {"notification_id": "audit"}, None),
+    ("geocode_many", "geocode_cache", {"geocoder": "audit", "key": {"$in": ["audit"]}}, None),
+    ("get_orders", "orders", {"user_id": "audit"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_orders?status", "orders", {"user_id": "audit", "status": "pending"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_order", "orders", {"id": "audit", "user_id": "audit"}, None),
+    ("update_order_status", "orders", {"id": "audit", "user_id": "audit"}, None),
+    ("analytics", "daily_order_stats", {"user_id": "audit", "day": {"$gte": "2024-01-01"}}, None),
+    ("analytics", "daily_combination_stats", {"user_id": "audit", "day": {"$gte": "2024-01-01"}}, None),
+    ("load_pending_orders", "orders", {"user_id": "audit", "status": "pending"}, [("created_at", ASCENDING)]),
+    ("get_combinations", "order_combinations", {"user_id": "audit"}, [("created_at", DESCENDING)]),
+    ("get_combinations?open", "order_combinations", {"user_id": "audit", "is_accepted": False}, [("savings_percentage", DESCENDING)]),
+    ("invalidate_order_combinations", "order_combinations", {"user_id": "audit", "is_accepted": False, "order_ids": {"$in": ["audit"]}}, None),
+    ("trim_combination_pool", "order_combinations", {"id": {"$in": ["audit"]}}, None),
+    ("claim_pool_rebuild", "combination_pools", {"user_id": "audit"}, None),
+    ("store_open_combinations", "order_combinations", {"user_id": "audit", "bundle_key": "audit", "is_accepted": False}, None),
+    ("accept_combination", "order_combinations", {"id": "audit", "user_id": "audit", "is_accepted": False}, None),
+    ("accept_combination orders", "orders", {"id": {"$in": ["audit"]}, "user_id": "audit", "status": "pending"}, None),
+]
+
+
+async def ensure_indexes(db):
+    """Create every declared index. Safe to run on each startup."""
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as exc:
+            # e.g. a unique index over data that already has duplicates;
+            # keep serving and surface it rather than failing startup
+            logger.error("Could not create indexes on %s: %s", collection, exc)
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+async def audit_query_shapes(db):
+    """
+    Explain every query shape and return (route, collection, stages) for the
+    ones whose winning plan contains a COLLSCAN.
+    """
+    failures = []
+    for route, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = list(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            failures.append((route, collection, stages))
+    return failures
+
+
+async def main(audit_only=False):
+    from database import create_client, settings_from_env
+
+    load_dotenv(Path(__file__).parent / '.env')
+    settings = settings_from_env()
+    client = create_client(settings)
+    db = client[settings.db_name]
+    try:
+        if not audit_only:
+            await ensure_indexes(db)
+        failures = await audit_query_shapes(db)
+    finally:
+        client.close()
+
+    for route, collection, stages in failures:
+        print(f"COLLSCAN: {route} on {collection} ({' <- '.join(stages)})")
+    print(f"{len(QUERY_SHAPES) - len(failures)}/{len(QUERY_SHAPES)} query shapes use an index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes and audit route query shapes")
+    parser.add_argument("--audit", action="store_true", help="only run the audit, do not create indexes")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(audit_only=args.audit)))
@@ -0,0 +1,479 @@
+"""
+Request, MongoDB and processing-stage metrics in the Prometheus text format.
+
+MetricsMiddleware times every HTTP request per route and, with
+server_timing=True, reports the request's time in the app, in MongoDB and
+in each timed stage through a Server-Timing header. MongoCommandListener
+is registered on the Motor client; Motor runs commands on its executor with
+the caller's context, so each command is attributed to the request that
+issued it. MongoPoolListener times connection checkouts and counts the
+pool's open and checked out connections.
+
+Each worker process has its own registry. With several workers,
+MultiprocessMetrics writes every worker's values to a shared directory and
+a scrape of any worker reports the sum over all of them.
+"""
+import asyncio
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from pymongo import monitoring
+
+# Latency buckets in seconds, from sub-millisecond Mongo calls to slow
+# combination searches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def state(self):
+        with self._lock:
+            return [[list(label_values), value] for label_values, value in self._values.items()]
+
+    def merge(self, state):
+        for label_values, value in state:
+            self.inc(*label_values, amount=value)
+
+    def empty(self):
+        return Counter(self.name, self.documentation, self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def state(self):
+        with self._lock:
+            return [[list(label_values), list(series)] for label_values, series in self._series.items()]
+
+    def merge(self, state):
+        with self._lock:
+            for label_values, series in state:
+                current = self._series.setdefault(tuple(label_values), [0] * (len(self.buckets) + 1) + [0.0, 0])
+                for idx, value in enumerate(series):
+                    current[idx] += value
+
+    def empty(self):
+        return Histogram(self.name, self.documentation, self.labels, self.buckets)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series):
+                    cumulative += count
+                    le = 'le="%s"' % _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Sampled from a callback at scrape time, or summed from workers"""
+
+    def __init__(self, name, documentation, callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.value = 0
+
+    def state(self):
+        return self.callback()
+
+    def merge(self, state):
+        self.value += state
+
+    def empty(self):
+        return Gauge(self.name, self.documentation)
+
+    def render(self):
+        value = self.callback() if self.callback is not None else self.value
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(value)}",
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    @property
+    def metrics(self):
+        return list(self._metrics)
+
+    def state(self):
+        return {metric.name: metric.state() for metric in self._metrics}
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MultiprocessMetrics:
+    """
+    Metrics of every worker process sharing `directory`. Each process
+    writes its registry's values to <directory>/<pid>.json every
+    `interval` seconds and just before rendering; render() sums them.
+    Counters and histograms of workers that exited still count, as their
+    requests happened; gauges are summed over the live workers only. The
+    directory must be emptied before the workers start (entrypoint.sh).
+    """
+
+    def __init__(self, registry, directory, interval=5.0, pid=None):
+        self.registry = registry
+        self.directory = Path(directory)
+        self.interval = interval
+        self._pid = pid
+
+    @property
+    def pid(self):
+        # Read when used, so a registry built before a fork writes per worker
+        return self._pid or os.getpid()
+
+    def write(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{self.pid}.json"
+        partial = path.with_suffix(".tmp")
+        partial.write_text(json.dumps(self.registry.state()))
+        # Readers see the previous file or the whole new one
+        os.replace(partial, path)
+
+    def _snapshots(self):
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                state = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue  # Removed meanwhile
+            pid = int(path.stem)
+            yield pid == self.pid or _process_alive(pid), state
+
+    def render(self):
+        self.write()
+        merged = [metric.empty() for metric in self.registry.metrics]
+        for alive, state in self._snapshots():
+            for metric in merged:
+                if metric.name not in state or (isinstance(metric, Gauge) and not alive):
+                    continue
+                metric.merge(state[metric.name])
+        lines = []
+        for metric in merged:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    async def run(self):
+        """Write this worker's values until cancelled, and once more then"""
+        try:
+            while True:
+                await asyncio.to_thread(self.write)
+                await asyncio.sleep(self.interval)
+        finally:
+            self.write()
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "mandoob_http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+REQUESTS = registry.counter(
+    "mandoob_http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")
+)
+ROUTE_MONGO_OPERATIONS = registry.counter(
+    "mandoob_route_mongo_operations_total", "MongoDB commands issued while serving each route", ("method", "route")
+)
+ROUTE_MONGO_SECONDS = registry.counter(
+    "mandoob_route_mongo_seconds_total", "Time spent in MongoDB commands while serving each route", ("method", "route")
+)
+MONGO_COMMAND_SECONDS = registry.histogram(
+    "mandoob_mongo_command_duration_seconds", "MongoDB command round trip time", ("command", "outcome")
+)
+MONGO_CHECKOUT_WAIT_SECONDS = registry.histogram(
+    "mandoob_mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled MongoDB connection", ("outcome",)
+)
+MONGO_POOL_EVENTS = registry.counter(
+    "mandoob_mongo_pool_events_total", "MongoDB connections created and closed, and pools cleared", ("event",)
+)
+PASSWORD_HASH_WAIT_SECONDS = registry.histogram(
+    "mandoob_password_hash_wait_seconds", "Time bcrypt operations waited for a hashing worker", ("operation",)
+)
+PASSWORD_HASH_SECONDS = registry.histogram(
+    "mandoob_password_hash_duration_seconds", "Time bcrypt took to hash or verify a password", ("operation",)
+)
+PASSWORD_HASH_REJECTED = registry.counter(
+    "mandoob_password_hash_rejected_total", "bcrypt operations rejected because the hashing pool was busy", ("operation",)
+)
+STAGE_SECONDS = registry.histogram(
+    "mandoob_stage_duration_seconds", "Time spent in processing stages such as parsing and combination search",
+    ("stage",)
+)
+
+
+class RequestTimings:
+    """What one request spent in MongoDB and in each timed stage"""
+
+    __slots__ = ("mongo_operations", "mongo_seconds", "stages", "_lock")
+
+    def __init__(self):
+        self.mongo_operations = 0
+        self.mongo_seconds = 0.0
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add_mongo(self, seconds):
+        # Listener callbacks run on Motor's executor threads
+        with self._lock:
+            self.mongo_operations += 1
+            self.mongo_seconds += seconds
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def timed(stage):
+    """Record the duration of a block as a processing stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage)
+        timings = _current.get()
+        if timings is not None:
+            timings.add_stage(stage, elapsed)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "failure")
+
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.observe(seconds, event.command_name, outcome)
+        timings = _current.get()
+        if timings is not None:
+            timings.add_mongo(seconds)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Checkout wait times, and the open and checked out connection counts
+    for gauges. A checkout starts and ends on the same thread, so the start
+    time is kept in a thread local.
+    """
+
+    def __init__(self):
+        self.open_connections = 0
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._checkout = threading.local()
+
+    def _adjust(self, open_connections=0, in_use=0):
+        with self._lock:
+            self.open_connections += open_connections
+            self.in_use += in_use
+
+    def _checkout_waited(self, outcome):
+        started = getattr(self._checkout, "started", None)
+        if started is not None:
+            MONGO_CHECKOUT_WAIT_SECONDS.observe(time.perf_counter() - started, outcome)
+            self._checkout.started = None
+
+    def connection_check_out_started(self, event):
+        self._checkout.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._checkout_waited("success")
+        self._adjust(in_use=1)
+
+    def connection_check_out_failed(self, event):
+        # reason is "timeout", "poolClosed" or "connectionError"
+        self._checkout_waited(event.reason)
+
+    def connection_checked_in(self, event):
+        self._adjust(in_use=-1)
+
+    def connection_created(self, event):
+        MONGO_POOL_EVENTS.inc("connection_created")
+        self._adjust(open_connections=1)
+
+    def connection_closed(self, event):
+        MONGO_POOL_EVENTS.inc("connection_closed")
+        self._adjust(open_connections=-1)
+
+    def pool_cleared(self, event):
+        MONGO_POOL_EVENTS.inc("pool_cleared")
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+def _server_timing(total_seconds, timings):
+    entries = [f"app;dur={total_seconds * 1000:.1f}"]
+    if timings.mongo_operations:
+        entries.append(f'db;dur={timings.mongo_seconds * 1000:.1f};desc="{timings.mongo_operations} ops"')
+    for stage, seconds in timings.stages.items():
+        entries.append(f"{stage};dur={seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so it adds no task or buffering per request and
+    leaves WebSockets alone. Routes are labelled by their path template
+    (/api/orders/{order_id}), never by the raw path.
+    """
+
+    def __init__(self, app, server_timing=False):
+        self.app = app
+        self.server_timing = server_timing
+        self._route_paths = None
+
+    def _route_label(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            router = scope["app"].router
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path for route in router.routes
+            }
+        return self._route_paths.get(endpoint, getattr(endpoint, "__name__", "unknown"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    header = _server_timing(time.perf_counter() - started, timings)
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            method = scope["method"]
+            route = self._route_label(scope)
+            REQUEST_SECONDS.observe(elapsed, method, route)
+            REQUESTS.inc(method, route, str(status_code))
+            if timings.mongo_operations:
+                ROUTE_MONGO_OPERATIONS.inc(method, route, amount=timings.mongo_operations)
+                ROUTE_MONGO_SECONDS.inc(method, route, amount=timings.mongo_seconds)
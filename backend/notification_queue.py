@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Job states in the notification_jobs collection
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """Raised when the backlog of unprocessed notifications is at its limit"""
+
+
+class NotificationQueue:
+    """
+    Durable work queue of notifications waiting to be parsed, kept in a Mongo
+    collection so queued work survives restarts and is shared by every app
+    process. Workers lease a job for `lease_seconds`; a job whose worker died
+    is picked up again once the lease runs out. Failed jobs are retried with
+    exponential backoff up to `max_attempts` times.
+
+    `handler(job)` processes one job and returns `(order_id, created)`: the
+    job's order id (or None) and whether this run created the order rather
+    than finding it from an earlier run. `after_batch(user_id, order_ids)` is
+    then called once per user with the orders a batch created, so per-user
+    follow-up work is not repeated for every notification, nor for orders
+    whose job ran twice. Jobs are claimed one at a time as the batch goes,
+    so each lease starts when its job does.
+
+    ensure_capacity() checks a backlog count refreshed at most every
+    `backlog_seconds`, plus what this process queued since.
+
+    Storing a notification and queueing it are two writes. With
+    `notifications` (the collection they are stored in) set, an idle worker
+    sweeps it every `sweep_seconds` and queues unprocessed notifications
+    that have no job, so one stored by a request that failed or died
+    between the writes is still parsed.
+    """
+
+    def __init__(self, collection, handler, after_batch=None, workers=4, batch_size=50,
+                 lease_seconds=30, max_attempts=5, max_backlog=10000, poll_seconds=1.0,
+                 notifications=None, sweep_seconds=60, orphan_grace_seconds=60,
+                 orphan_window_seconds=3600, backlog_seconds=1.0):
+        self.collection = collection
+        self.handler = handler
+        self.after_batch = after_batch
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_backlog = max_backlog
+        self.poll_seconds = poll_seconds
+        self.notifications = notifications
+        self.sweep_seconds = sweep_seconds
+        # Younger notifications may still be between their two writes
+        self.orphan_grace = timedelta(seconds=orphan_grace_seconds)
+        self.orphan_window = timedelta(seconds=orphan_window_seconds)
+        self._next_sweep = 0.0
+        self.backlog_seconds = backlog_seconds
+        self._backlog = None
+        self._backlog_counted_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = []
+
+    async def backlog(self):
+        """Unfinished jobs, counted up to max_backlog"""
+        return await self.collection.count_documents(
+            {"state": {"$in": [QUEUED, PROCESSING]}}, limit=self.max_backlog
+        )
+
+    async def _recent_backlog(self):
+        now = time.monotonic()
+        if self._backlog is None or now - self._backlog_counted_at >= self.backlog_seconds:
+            self._backlog = await self.backlog()
+            self._backlog_counted_at = now
+        return self._backlog
+
+    async def ensure_capacity(self, count):
+        """Raise QueueFull if `count` more jobs would exceed max_backlog"""
+        if await self._recent_backlog() + count > self.max_backlog:
+            raise QueueFull(f"More than {self.max_backlog} notifications waiting to be processed")
+
+    async def enqueue(self, notifications):
+        """Queue notifications that are already stored"""
+        await self._insert_jobs(notifications)
+        if self._backlog is not None:
+            self._backlog += len(notifications)
+        self._wakeup.set()
+
+    async def _insert_jobs(self, notifications):
+        now = datetime.utcnow()
+        await self.collection.insert_many([
+            {
+                "id": notification["id"],
+                "user_id": notification["user_id"],
+                "state": QUEUED,
+                "attempts": 0,
+                "available_at": now,
+                "leased_until": None,
+                "lease_owner": None,
+                "order_id": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                "finished_at": None,
+            }
+            for notification in notifications
+        ], ordered=False)
+
+    async def requeue_orphans(self):
+        """Queue stored notifications that never got a job; returns how many"""
+        now = datetime.utcnow()
+        candidates = await self.notifications.find(
+            {"is_processed": False, "received_at": {"$gte": now - self.orphan_window, "$lte": now - self.orphan_grace}},
+            {"_id": 0, "id": 1, "user_id": 1}
+        ).to_list(self.max_backlog)
+        if not candidates:
+            return 0
+
+        queued = await self.collection.distinct("id", {"id": {"$in": [doc["id"] for doc in candidates]}})
+        orphans = [doc for doc in candidates if doc["id"] not in set(queued)]
+        if not orphans:
+            return 0
+        try:
+            await self._insert_jobs(orphans)
+        except BulkWriteError as exc:
+            # Another process queued some of them first
+            if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+                raise
+        logger.warning("Queued %s stored notifications that had no job", len(orphans))
+        self._wakeup.set()
+        return len(orphans)
+
+    async def claim(self, owner):
+        """Lease the next due job, or a job whose lease expired"""
+        now = datetime.utcnow()
+        job = await self.collection.find_one_and_update(
+            {"$or": [
+                {"state": QUEUED, "available_at": {"$lte": now}},
+                {"state": PROCESSING, "leased_until": {"$lte": now}},
+            ]},
+            {
+                "$set": {
+                    "state": PROCESSING,
+                    "lease_owner": owner,
+                    "leased_until": now + timedelta(seconds=self.lease_seconds),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            job.pop("_id", None)
+        return job
+
+    async def _finish(self, job, owner, update):
+        # Only the current lease holder may settle the job
+        update["updated_at"] = datetime.utcnow()
+        await self.collection.update_one({"id": job["id"], "lease_owner": owner}, {"$set": update})
+
+    async def _process(self, job, owner):
+        """The order id the job created, or None"""
+        try:
+            order_id, created = await self.handler(job)
+        except Exception as exc:
+            logger.exception("Processing notification %s failed (attempt %s)", job["id"], job["attempts"])
+            if job["attempts"] >= self.max_attempts:
+                await self._finish(job, owner, {
+                    "state": FAILED,
+                    "error": str(exc),
+                    "leased_until": None,
+                    "finished_at": datetime.utcnow(),
+                })
+            else:
+                backoff = min(2 ** (job["attempts"] - 1), 300)
+                await self._finish(job, owner, {
+                    "state": QUEUED,
+                    "error": str(exc),
+                    "available_at": datetime.utcnow() + timedelta(seconds=backoff),
+                    "leased_until": None,
+                })
+            return None
+
+        await self._finish(job, owner, {
+            "state": DONE,
+            "order_id": order_id,
+            "error": None,
+            "leased_until": None,
+            "finished_at": datetime.utcnow(),
+        })
+        return order_id if created else None
+
+    async def run_once(self, owner):
+        """Claim and process up to batch_size jobs; returns how many were claimed"""
+        claimed = 0
+        created = defaultdict(list)
+        while claimed < self.batch_size:
+            job = await self.claim(owner)
+            if job is None:
+                break
+            claimed += 1
+            order_id = await self._process(job, owner)
+            if order_id:
+                created[job["user_id"]].append(order_id)
+
+        if self.after_batch:
+            for user_id, order_ids in created.items():
+                try:
+                    await self.after_batch(user_id, order_ids)
+                except Exception:
+                    logger.exception("Post-processing orders of user %s failed", user_id)
+        return claimed
+
+    async def _worker(self):
+        owner = uuid.uuid4().hex
+        while not self._stopping:
+            try:
+                if await self.run_once(owner):
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Notification worker error")
+            if self.notifications is not None and time.monotonic() >= self._next_sweep:
+                # Claimed before awaiting, so one idle worker per process sweeps
+                self._next_sweep = time.monotonic() + self.sweep_seconds
+                try:
+                    if await self.requeue_orphans():
+                        continue
+                except Exception:
+                    logger.exception("Notification sweep error")
+            # Idle: sleep until new work is queued in this process or the
+            # next poll for work queued elsewhere and for retries coming due
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # wait_for() can swallow a cancellation that races with the wakeup
+        # event, so the workers also check this flag
+        self._stopping = True
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
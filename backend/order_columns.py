@@ -0,0 +1,96 @@
+"""
+Column-oriented pending orders for combination planning.
+
+The planning path only needs ids and coordinates (plus payment and creation
+time), so orders are loaded from a projected cursor straight into NumPy
+columns instead of Order models with nested Location models. Pydantic stays
+at the API boundary.
+"""
+import numpy as np
+
+# The only fields planning reads
+PLANNING_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "pickup_location.latitude": 1,
+    "pickup_location.longitude": 1,
+    "dropoff_location.latitude": 1,
+    "dropoff_location.longitude": 1,
+    "payment_amount": 1,
+    "created_at": 1,
+}
+
+
+class OrderColumns:
+    """
+    n orders as parallel columns: `ids` is a list of str, coordinates and
+    payment_amount (NaN when unknown) are float64 arrays, created_at is a
+    datetime64[ms] array. Order i is row i of every column.
+    """
+
+    __slots__ = (
+        "ids", "pickup_lat", "pickup_lon", "dropoff_lat", "dropoff_lon", "payment_amount", "created_at"
+    )
+
+    def __init__(self, ids, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, payment_amount=None, created_at=None):
+        n = len(ids)
+        self.ids = list(ids)
+        self.pickup_lat = np.asarray(pickup_lat, dtype=np.float64)
+        self.pickup_lon = np.asarray(pickup_lon, dtype=np.float64)
+        self.dropoff_lat = np.asarray(dropoff_lat, dtype=np.float64)
+        self.dropoff_lon = np.asarray(dropoff_lon, dtype=np.float64)
+        self.payment_amount = (
+            np.full(n, np.nan) if payment_amount is None else np.asarray(payment_amount, dtype=np.float64)
+        )
+        self.created_at = (
+            np.full(n, np.datetime64("NaT"), dtype="datetime64[ms]") if created_at is None
+            else np.asarray(created_at, dtype="datetime64[ms]")
+        )
+
+    @classmethod
+    def from_documents(cls, docs):
+        """Build the columns from order documents read with PLANNING_PROJECTION"""
+        n = len(docs)
+        pickup_lat = np.empty(n)
+        pickup_lon = np.empty(n)
+        dropoff_lat = np.empty(n)
+        dropoff_lon = np.empty(n)
+        payment_amount = np.empty(n)
+        ids = []
+        created_at = []
+        for idx, doc in enumerate(docs):
+            ids.append(doc["id"])
+            pickup, dropoff = doc["pickup_location"], doc["dropoff_location"]
+            pickup_lat[idx] = pickup["latitude"]
+            pickup_lon[idx] = pickup["longitude"]
+            dropoff_lat[idx] = dropoff["latitude"]
+            dropoff_lon[idx] = dropoff["longitude"]
+            payment = doc.get("payment_amount")
+            payment_amount[idx] = np.nan if payment is None else payment
+            created_at.append(doc.get("created_at"))
+        return cls(ids, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, payment_amount, created_at)
+
+    @classmethod
+    def from_orders(cls, orders):
+        """Build the columns from Order models"""
+        return cls.from_documents([order.dict() for order in orders])
+
+    def take(self, indices):
+        """The orders at `indices`, in that order"""
+        indices = list(indices)
+        return OrderColumns(
+            [self.ids[idx] for idx in indices],
+            self.pickup_lat[indices],
+            self.pickup_lon[indices],
+            self.dropoff_lat[indices],
+            self.dropoff_lon[indices],
+            self.payment_amount[indices],
+            self.created_at[indices],
+        )
+
+    def coordinates(self):
+        """A (4, n) float64 array: pickup lat, pickup lon, dropoff lat, dropoff lon"""
+        return np.stack([self.pickup_lat, self.pickup_lon, self.dropoff_lat, self.dropoff_lon])
+
+    def __len__(self):
+        return len(self.ids)
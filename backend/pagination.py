@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from pymongo import DESCENDING
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def encode_cursor(sort_value: datetime, doc_id: str) -> str:
+    """Opaque cursor pointing just past a document in (sort field, id) order"""
+    raw = json.dumps({"t": sort_value.isoformat(), "id": doc_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["t"]), str(data["id"])
+    except (ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursor("Malformed pagination cursor") from exc
+
+
+def keyset_filter(sort_field: str, cursor: Optional[str]) -> dict:
+    """
+    Filter selecting the documents after `cursor` when paging in descending
+    (sort field, id) order. The id breaks ties between equal timestamps.
+    """
+    if not cursor:
+        return {}
+    sort_value, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        {sort_field: {"$lt": sort_value}},
+        {sort_field: sort_value, "id": {"$lt": doc_id}},
+    ]}
+
+
+def keyset_sort(sort_field: str):
+    return [(sort_field, DESCENDING), ("id", DESCENDING)]
+
+
+def build_projection(fields: Optional[str], allowed: Iterable[str], sort_field: str) -> dict:
+    """
+    Mongo projection for a comma separated `fields` parameter. The id and
+    sort field are always kept since the next cursor is built from them.
+    Without `fields` only Mongo's _id is dropped.
+    """
+    if not fields:
+        return {"_id": 0}
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    projection = {field: 1 for field in requested | {"id", sort_field}}
+    projection["_id"] = 0
+    return projection
+
+
+async def fetch_page(collection, query: dict, sort_field: str, cursor: Optional[str], limit: int, projection: dict):
+    """
+    One page of documents in descending (sort field, id) order, plus the
+    cursor for the next page (None on the last page).
+    """
+    query = {**query, **keyset_filter(sort_field, cursor)}
+    docs = await collection.find(query, projection).sort(keyset_sort(sort_field)).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last[sort_field], last["id"])
+    return docs, next_cursor
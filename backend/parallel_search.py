@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from combinations import TRIPLET_OUTER_PICKUP_KM, merge_candidates, search_candidates, search_range
+from distance_matrix import DistanceMatrix
+from routing import DEFAULT_TIME_BUDGET_MS, RoutingEngine
+from spatial_index import pickup_neighbours
+
+
+def _search_partition(coordinates, pairs, start, stop, engine, time_budget_ms, top_k):
+    """
+    Worker entry point. Receives only a (4, n) float array of pickup and
+    dropoff coordinates and the (m, 2) candidate pairs whose first index is
+    at least `start`, never the order models.
+    """
+    pickup_lat, pickup_lon, dropoff_lat, dropoff_lon = coordinates
+    n = coordinates.shape[1]
+    neighbours = [[] for _ in range(n)]
+    for a, b in pairs.tolist():
+        neighbours[a].append(b)
+    distances = DistanceMatrix(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, pairs=pairs)
+    return search_range(distances.pickup, neighbours, distances, start, stop, engine, time_budget_ms, top_k)
+
+
+def partition_ranges(neighbours, parts):
+    """
+    Split order indices into at most `parts` contiguous [start, stop) ranges
+    of similar cost. Bundles starting at order i cost roughly the square of
+    its forward neighbour count (the triplet loop), so ranges are balanced
+    on that rather than on the number of orders.
+    """
+    n = len(neighbours)
+    if n == 0:
+        return []
+    cost = np.cumsum([len(row) ** 2 + 1 for row in neighbours], dtype=np.float64)
+    bounds = np.searchsorted(cost, cost[-1] * np.arange(1, parts) / parts, side="right")
+    edges = [0] + sorted(set(int(bound) for bound in bounds if 0 < bound < n)) + [n]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+class CombinationSearchEngine:
+    """
+    Runs the pair/triplet search off the event loop. Small order sets are
+    searched in a thread; from `min_parallel_orders` orders the index space
+    is split into cost-balanced ranges searched in a process pool, each
+    worker keeping its own top-k, and the partial results are merged.
+    The pool uses spawned processes: forking a process that runs Motor's
+    threads is unsafe.
+    """
+
+    def __init__(self, workers=None, min_parallel_orders=300, partitions_per_worker=4):
+        self.workers = max(workers if workers is not None else (os.cpu_count() or 1) - 1, 0)
+        self.min_parallel_orders = min_parallel_orders
+        self.partitions_per_worker = partitions_per_worker
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def search(self, orders, engine=RoutingEngine.AUTO, time_budget_ms=DEFAULT_TIME_BUDGET_MS, top_k=None):
+        """The best `top_k` (all when None) candidates of `orders` (OrderColumns), best first"""
+        loop = asyncio.get_running_loop()
+        if self.workers < 2 or len(orders) < self.min_parallel_orders:
+            return await loop.run_in_executor(None, search_candidates, orders, engine, time_budget_ms, top_k)
+
+        coordinates = orders.coordinates()
+        pairs, neighbours = pickup_neighbours(coordinates[0], coordinates[1], TRIPLET_OUTER_PICKUP_KM)
+
+        futures = []
+        for start, stop in partition_ranges(neighbours, self.workers * self.partitions_per_worker):
+            # A range only touches pairs whose first order is in or after it
+            relevant = pairs[pairs[:, 0] >= start]
+            futures.append(loop.run_in_executor(
+                self.executor, _search_partition,
+                coordinates, relevant, start, stop, engine, time_budget_ms, top_k
+            ))
+        return merge_candidates(await asyncio.gather(*futures), len(orders), top_k)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def engine_from_env():
+    workers = os.environ.get("COMBINATION_WORKERS")
+    if workers is None and int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+        # Every server worker already has a core; a pool each would oversubscribe them
+        workers = 0
+    return CombinationSearchEngine(
+        workers=int(workers) if workers is not None else None,
+        min_parallel_orders=int(os.environ.get("COMBINATION_PARALLEL_MIN_ORDERS", 300)),
+    )
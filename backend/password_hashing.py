@@ -0,0 +1,83 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS, PASSWORD_HASH_WAIT_SECONDS
+
+
+class HashingPoolBusy(Exception):
+    """Raised when too many hash/verify calls are already queued"""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a dedicated, size-limited thread
+    pool so a burst of logins never blocks the event loop. bcrypt releases
+    the GIL, so the workers hash in parallel. Calls beyond `max_pending`
+    in flight are rejected with HashingPoolBusy instead of queueing forever.
+    """
+
+    def __init__(self, workers=4, max_pending=64, rounds=12):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.pending = 0
+        self._context = None
+        self._executor = None
+
+    @property
+    def context(self):
+        # passlib is imported on the first login or signup, not at startup
+        if self._context is None:
+            from passlib.context import CryptContext
+
+            self._context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=self.rounds)
+        return self._context
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, operation, func, *args):
+        if self.pending >= self.max_pending:
+            PASSWORD_HASH_REJECTED.inc(operation)
+            raise HashingPoolBusy(f"{self.pending} password operations already pending")
+
+        queued_at = time.perf_counter()
+        started = []
+
+        def timed():
+            started.append(time.perf_counter())
+            return func(*args)
+
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.pending -= 1
+        finished = time.perf_counter()
+        PASSWORD_HASH_WAIT_SECONDS.observe(started[0] - queued_at, operation)
+        PASSWORD_HASH_SECONDS.observe(finished - started[0], operation)
+        return result
+
+    async def hash(self, password):
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password, hashed_password):
+        return await self._run("verify", self.context.verify, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def hasher_from_env():
+    return PasswordHasher(
+        workers=int(os.environ.get("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1))),
+        max_pending=int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 64)),
+        rounds=int(os.environ.get("BCRYPT_ROUNDS", 12)),
+    )
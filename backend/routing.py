@@ -0,0 +1,217 @@
+import math
+import time
+from enum import Enum
+from functools import lru_cache
+from typing import List, NamedTuple
+
+# Bundles up to this many orders are solved exactly by the auto engine
+EXACT_MAX_ORDERS = 4
+DEFAULT_TIME_BUDGET_MS = 20
+
+
+class RoutingEngine(str, Enum):
+    AUTO = "auto"
+    NEAREST_NEIGHBOUR = "nearest_neighbour"
+    EXACT = "exact"
+    LOCAL_SEARCH = "local_search"
+
+
+class Route(NamedTuple):
+    """
+    A route over the stops of k orders. Stop s < k is the pickup of order s
+    and stop k + s is its dropoff.
+    """
+    distance: float
+    stops: List[int]
+
+
+def route_distance(dist, stops):
+    return sum(dist[a][b] for a, b in zip(stops, stops[1:]))
+
+
+def is_feasible(stops, k):
+    """Every order must be picked up before it is dropped off"""
+    position = {stop: pos for pos, stop in enumerate(stops)}
+    return all(position[order] < position[order + k] for order in range(k))
+
+
+def nearest_neighbour_route(dist, k):
+    """
+    The original heuristic: nearest neighbour over pickups starting from the
+    first order, then the dropoffs in order.
+    """
+    current = 0
+    pickups = [0]
+    unvisited = list(range(1, k))
+    while unvisited:
+        row = dist[current]
+        current = min(unvisited, key=lambda stop: row[stop])
+        pickups.append(current)
+        unvisited.remove(current)
+
+    stops = pickups + [k + order for order in range(k)]
+    return Route(route_distance(dist, stops), stops)
+
+
+@lru_cache(maxsize=None)
+def _transitions(k):
+    """
+    For k orders, the stops that may follow each reachable set of visited
+    stops (as a bitmask). Only depends on k, so it is built once per size.
+    """
+    n = 2 * k
+    transitions = [None] * (1 << n)
+    for mask in range(1 << n):
+        # A dropoff can only be visited once its pickup has been
+        if any(mask >> (k + order) & 1 and not mask >> order & 1 for order in range(k)):
+            continue
+        transitions[mask] = tuple(
+            stop for stop in range(n)
+            if not mask >> stop & 1 and (stop < k or mask >> (stop - k) & 1)
+        )
+    return transitions
+
+
+def exact_route(dist, k):
+    """
+    Shortest open route through all pickups and dropoffs with pickup-before-
+    dropoff precedence, by dynamic programming over (visited set, last stop).
+    """
+    n = 2 * k
+    full = (1 << n) - 1
+    transitions = _transitions(k)
+    cost = [None] * (1 << n)
+    parent = [None] * (1 << n)
+
+    for pickup in range(k):
+        mask = 1 << pickup
+        cost[mask] = {pickup: 0.0}
+        parent[mask] = {pickup: None}
+
+    # Visiting a stop only ever adds a bit, so increasing mask order is a
+    # valid order to process subproblems in
+    for mask in range(1, full):
+        costs = cost[mask]
+        if not costs:
+            continue
+        for last, so_far in costs.items():
+            row = dist[last]
+            for stop in transitions[mask]:
+                next_mask = mask | (1 << stop)
+                candidate = so_far + row[stop]
+                next_costs = cost[next_mask]
+                if next_costs is None:
+                    cost[next_mask] = next_costs = {}
+                    parent[next_mask] = {}
+                if candidate < next_costs.get(stop, math.inf):
+                    next_costs[stop] = candidate
+                    parent[next_mask][stop] = last
+
+    last, distance = min(cost[full].items(), key=lambda item: item[1])
+    stops = []
+    mask = full
+    while last is not None:
+        stops.append(last)
+        previous = parent[mask][last]
+        mask &= ~(1 << last)
+        last = previous
+    stops.reverse()
+    return Route(distance, stops)
+
+
+def _greedy_route(dist, k, start):
+    stops = [start]
+    visited = {start}
+    while len(stops) < 2 * k:
+        row = dist[stops[-1]]
+        available = [
+            stop for stop in range(2 * k)
+            if stop not in visited and (stop < k or stop - k in visited)
+        ]
+        stop = min(available, key=lambda s: row[s])
+        stops.append(stop)
+        visited.add(stop)
+    return stops
+
+
+def _improve(dist, k, stops, deadline):
+    """
+    Apply 2-opt and or-opt moves that keep pickup-before-dropoff precedence
+    until none improves the route or the deadline passes
+    """
+    best = route_distance(dist, stops)
+    n = len(stops)
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # 2-opt: reverse stops[i..j]. Distances are symmetric, so only the
+        # two edges at the ends of the segment change
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                before = (dist[stops[i - 1]][stops[i]] if i > 0 else 0.0) + \
+                    (dist[stops[j]][stops[j + 1]] if j < n - 1 else 0.0)
+                after = (dist[stops[i - 1]][stops[j]] if i > 0 else 0.0) + \
+                    (dist[stops[i]][stops[j + 1]] if j < n - 1 else 0.0)
+                if after < before - 1e-9:
+                    candidate = stops[:i] + stops[i:j + 1][::-1] + stops[j + 1:]
+                    if is_feasible(candidate, k):
+                        stops, best, improved = candidate, best - before + after, True
+            if time.perf_counter() >= deadline:
+                break
+
+        # or-opt: move a segment of 1-3 stops to another position
+        for length in (1, 2, 3):
+            for i in range(n - length + 1):
+                segment = stops[i:i + length]
+                rest = stops[:i] + stops[i + length:]
+                for j in range(len(rest) + 1):
+                    if j == i:
+                        continue
+                    candidate = rest[:j] + segment + rest[j:]
+                    distance = route_distance(dist, candidate)
+                    if distance < best - 1e-9 and is_feasible(candidate, k):
+                        stops, best, improved = candidate, distance, True
+                        break
+                if time.perf_counter() >= deadline:
+                    break
+
+    return stops
+
+
+def local_search_route(dist, k, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """
+    Greedy construction from every pickup, each followed by 2-opt and or-opt
+    improvement moves that keep pickup-before-dropoff precedence, until no
+    move improves the route or the time budget runs out. The most promising
+    starts are improved first, so a tight budget still gets the best one.
+    """
+    deadline = time.perf_counter() + time_budget_ms / 1000
+
+    starts = sorted((_greedy_route(dist, k, start) for start in range(k)),
+                    key=lambda route: route_distance(dist, route))
+    best = starts[0]
+    for stops in starts:
+        if time.perf_counter() >= deadline:
+            break
+        stops = _improve(dist, k, stops, deadline)
+        if route_distance(dist, stops) < route_distance(dist, best) - 1e-9:
+            best = stops
+
+    return Route(route_distance(dist, best), best)
+
+
+def solve_route(dist, k, engine=RoutingEngine.AUTO, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """
+    Route the pickups and dropoffs of k orders given the (2k x 2k) stop
+    distance matrix, using the requested engine.
+    """
+    if engine == RoutingEngine.AUTO:
+        engine = RoutingEngine.EXACT if k <= EXACT_MAX_ORDERS else RoutingEngine.LOCAL_SEARCH
+
+    if engine == RoutingEngine.NEAREST_NEIGHBOUR:
+        return nearest_neighbour_route(dist, k)
+    if engine == RoutingEngine.EXACT:
+        return exact_route(dist, k)
+    return local_search_route(dist, k, time_budget_ms)
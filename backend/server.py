@@ -1,32 +1,55 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Body
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, Body, Query, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import asyncio
+import importlib
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import TYPE_CHECKING, List, Optional
 from enum import Enum
 import uuid
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 import jwt
-from jose import JWTError
 import json
-import math
+import hmac
+import time
+from contextlib import asynccontextmanager
+
+from cache import TTLCache
+from database import create_client, settings_from_env, warm_up
+from delivery_apps import DeliveryAppCatalogue
+from events import EventBus, MongoEventRelay, watch_change_streams
+from geocoding import geocoder_from_env
+from indexes import ensure_indexes
+from metrics import MetricsMiddleware, MongoCommandListener, MongoPoolListener, MultiprocessMetrics, registry, timed
+from notification_parser import parse_notification_content
+from notification_queue import NotificationQueue, QueueFull
+from pagination import InvalidCursor, InvalidFields, build_projection, fetch_page
+from password_hashing import HashingPoolBusy, hasher_from_env
+from responses import documents_response, model_projection
+from routing import DEFAULT_TIME_BUDGET_MS, RoutingEngine
+
+if TYPE_CHECKING:
+    # Imported where used at runtime, so importing server does not load NumPy
+    from order_columns import OrderColumns
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'mandoob_plus')]
-
-# Create the main app without a prefix
-app = FastAPI(title="Mandoob+ API")
+# MongoDB connection, configured by MONGO_URL and the MONGO_* pool, timeout
+# and compression settings (see database.py); every command and connection
+# checkout is timed for /api/metrics
+mongo_settings = settings_from_env()
+mongo_pool_listener = MongoPoolListener()
+client = create_client(mongo_settings, [MongoCommandListener(), mongo_pool_listener])
+db = client[mongo_settings.db_name]
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -36,8 +59,111 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "mandoobplussecretkey123456789")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Combination generation: pending orders considered per request
+MAX_COMBINATION_ORDERS = int(os.environ.get("MAX_COMBINATION_ORDERS", 2000))
+
+# Incremental mode keeps each user's open combinations up to date as orders
+# arrive or leave pending, so listing them needs no recomputation
+INCREMENTAL_COMBINATIONS = os.environ.get("INCREMENTAL_COMBINATIONS", "true").lower() == "true"
+COMBINATION_POOL_SIZE = int(os.environ.get("COMBINATION_POOL_SIZE", 200))
+
+# Combinations returned (and, outside incremental mode, stored) per generate
+COMBINATION_TOP_K = int(os.environ.get("COMBINATION_TOP_K", 10))
+# Combinations listed by GET /combinations
+COMBINATIONS_LISTED = 20
+# Outside incremental mode, open combinations are a snapshot that expires
+# this long after it was generated (0 = never); accepted ones are kept
+COMBINATION_TTL_SECONDS = int(os.environ.get("COMBINATION_TTL_SECONDS", 24 * 3600))
+
+# The delivery app catalogue is served from memory and reloaded this often
+DELIVERY_APPS_REFRESH_SECONDS = float(os.environ.get("DELIVERY_APPS_REFRESH_SECONDS", 300))
+DELIVERY_APPS_MAX_AGE_SECONDS = int(os.environ.get("DELIVERY_APPS_MAX_AGE_SECONDS", 300))
+
+# Page sizes for the keyset-paginated list endpoints
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 200))
+
+# List endpoints write the stored documents straight to JSON with orjson;
+# false validates every document into its response model on each read
+FAST_JSON_RESPONSES = os.environ.get("FAST_JSON_RESPONSES", "true").lower() == "true"
+
+# Upper bound for one /notifications/batch request
+MAX_NOTIFICATION_BATCH = int(os.environ.get("MAX_NOTIFICATION_BATCH", 1000))
+
+# Resolved users are cached per access token to skip the users lookup on
+# every request. The cache lives in each server worker and nothing
+# invalidates it, so a change to a user's document reaches every worker
+# within USER_CACHE_TTL_SECONDS; keep it short. With TRUST_TOKEN_CLAIMS the
+# user is rebuilt from the signed token claims instead and the lookup is
+# skipped entirely.
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", 60))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+TRUST_TOKEN_CLAIMS = os.environ.get("TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+
+# New orders, status changes and combinations are pushed to clients over the
+# /api/events WebSocket. EVENTS_SOURCE=change_streams feeds order events from
+# MongoDB change streams (replica set only) instead of the request handlers.
+# With several server workers (WEB_CONCURRENCY) a client's stream is served
+# by one of them; EVENTS_SOURCE=mongo relays every event through a capped
+# collection so it reaches the streams on all workers. It defaults to mongo
+# when WEB_CONCURRENCY > 1.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+EVENTS_SOURCE = os.environ.get("EVENTS_SOURCE", "mongo" if WEB_CONCURRENCY > 1 else "local").lower()
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", 100))
+# A stream is closed unless its auth message arrives this soon after connecting
+EVENT_AUTH_TIMEOUT_SECONDS = float(os.environ.get("EVENT_AUTH_TIMEOUT_SECONDS", 10))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get("EVENT_HEARTBEAT_SECONDS", 25))
+
+# Ingestion only stores notifications and queues them; background workers
+# parse them into orders. NOTIFICATION_QUEUE=false parses inline instead.
+NOTIFICATION_QUEUE = os.environ.get("NOTIFICATION_QUEUE", "true").lower() == "true"
+NOTIFICATION_WORKERS = int(os.environ.get("NOTIFICATION_WORKERS", 4))
+NOTIFICATION_MAX_BACKLOG = int(os.environ.get("NOTIFICATION_MAX_BACKLOG", 10000))
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get("NOTIFICATION_MAX_ATTEMPTS", 5))
+
+# Run combination acceptance in a multi-document transaction (replica set
+# only). Without it a failed acceptance is undone by compensating writes.
+MONGO_TRANSACTIONS = os.environ.get("MONGO_TRANSACTIONS", "false").lower() == "true"
+
+# /api/metrics is only for the Prometheus scraper. A scraper on this host
+# may read it from uvicorn directly; through nginx, which marks requests with
+# X-Forwarded-For, it needs "Authorization: Bearer <METRICS_TOKEN>". With
+# METRICS_TOKEN set every scrape needs the token.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+# With several workers each keeps its own metrics; METRICS_DIR (set by
+# entrypoint.sh) is where they share them, so any worker answers a scrape
+# with the totals. Values of other workers are up to METRICS_WRITE_SECONDS old.
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_WRITE_SECONDS = float(os.environ.get("METRICS_WRITE_SECONDS", 5))
+
+# Add a Server-Timing header (app, db and stage durations) to every response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+
+# bcrypt runs on a bounded worker pool (PASSWORD_HASH_WORKERS,
+# PASSWORD_HASH_MAX_PENDING, BCRYPT_ROUNDS) off the event loop
+password_hasher = hasher_from_env()
+# Combination searches run off the event loop, in a thread or, from
+# COMBINATION_PARALLEL_MIN_ORDERS orders, split across COMBINATION_WORKERS
+# processes (default: one per CPU but one; 0 keeps them in a thread). The
+# engine, and NumPy with it, is loaded by the first search.
+_combination_search = None
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+delivery_app_catalogue = DeliveryAppCatalogue(refresh_seconds=DELIVERY_APPS_REFRESH_SECONDS)
+event_bus = EventBus(queue_size=EVENT_QUEUE_SIZE)
+event_relay = MongoEventRelay(db.event_log, event_bus)
+# Pickup and dropoff addresses are geocoded through an in-process LRU and the
+# geocode_cache collection (GEOCODER, GAZETTEER_PATH, GEOCODE_CACHE_SIZE)
+geocoder = geocoder_from_env(db.geocode_cache)
+
+registry.gauge("mandoob_password_hash_pending", "bcrypt operations queued or running", lambda: password_hasher.pending)
+registry.gauge("mandoob_user_cache_entries", "Access tokens with a cached user", lambda: len(user_cache))
+registry.gauge("mandoob_event_subscribers", "Open /api/events streams", event_bus.subscriber_count)
+registry.gauge("mandoob_mongo_connections_open", "Open MongoDB connections", lambda: mongo_pool_listener.open_connections)
+registry.gauge("mandoob_mongo_connections_in_use", "MongoDB connections checked out", lambda: mongo_pool_listener.in_use)
+registry.gauge("mandoob_geocode_cache_entries", "Addresses in the in-process geocode cache", lambda: len(geocoder.memory))
+shared_metrics = MultiprocessMetrics(registry, METRICS_DIR, METRICS_WRITE_SECONDS) if METRICS_DIR else None
 
 # Define Models
 class Token(BaseModel):
@@ -106,8 +232,14 @@ class Order(BaseModel):
     estimated_delivery_time: Optional[datetime] = None
     payment_amount: Optional[float] = None
     status: str = "pending"
+    combination_id: Optional[str] = None  # Set when accepted as part of a combination
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None  # Day the order counts towards in the analytics
+
+class RouteStop(BaseModel):
+    order_id: str
+    stop_type: str  # "pickup" or "dropoff"
 
 class OrderCombination(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -116,20 +248,76 @@ class OrderCombination(BaseModel):
     total_distance: float  # in kilometers
     estimated_time: int  # in minutes
     savings_percentage: float  # compared to doing orders separately
+    route: List[RouteStop] = Field(default_factory=list)  # Full stop sequence
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: Optional[datetime] = None  # Removed by a TTL index unless accepted
     is_accepted: bool = False
+    accepted_at: Optional[datetime] = None
     
 class SimulatedNotification(BaseModel):
     app_name: str
     title: str
     content: str
 
+class NotificationBatch(BaseModel):
+    notifications: List[SimulatedNotification] = Field(..., min_length=1, max_length=MAX_NOTIFICATION_BATCH)
+
+class NotificationBatchItem(BaseModel):
+    index: int  # Position in the submitted batch
+    notification_id: Optional[str] = None
+    order_id: Optional[str] = None
+    is_processed: bool = False
+    error: Optional[str] = None
+
+class NotificationBatchResult(BaseModel):
+    received: int
+    stored: int
+    orders_created: int
+    queued: int = 0  # Stored notifications left to the processing workers
+    results: List[NotificationBatchItem]
+
+class AppEarnings(BaseModel):
+    app_name: str
+    completed_orders: int
+    earnings: float
+    distance_km: float
+
+class AnalyticsPeriod(BaseModel):
+    period: str  # "YYYY-MM-DD" or "YYYY-MM", "total" for the totals
+    completed_orders: int = 0
+    paid_orders: int = 0  # Completed orders with a known payment_amount
+    earnings: float = 0.0
+    distance_km: float = 0.0  # Pickup to dropoff, as the crow flies
+    km_per_order: Optional[float] = None
+    accepted_combinations: int = 0
+    combined_orders: int = 0
+    route_km: float = 0.0
+    saved_km: float = 0.0  # Against doing the combined orders separately
+    apps: List[AppEarnings] = Field(default_factory=list)
+
+class AnalyticsReport(BaseModel):
+    since: str
+    bucket: str
+    totals: AnalyticsPeriod
+    periods: List[AnalyticsPeriod]
+
+class NotificationStatus(BaseModel):
+    notification_id: str
+    state: str  # "queued", "processing", "done" or "failed"
+    is_processed: bool
+    attempts: int = 0
+    order_id: Optional[str] = None
+    error: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
 class NotificationProcessor:
     @staticmethod
-    def process_notification(notification):
+    def process_notification(notification, locations, parsed=None):
         """
         Enhanced notification processor with smart pattern recognition
         Uses rule-based parsing with adaptive learning capabilities
+        `locations` maps the parsed addresses to geocoding results
+        (see process_notifications)
         """
         # Initialize the order with basic information
         order = {
@@ -144,158 +332,30 @@ class NotificationProcessor:
             "payment_amount": None,
         }
         
-        # Preprocess the notification content
-        content = notification.content.lower()
-        title = notification.title.lower()
-        app_name = notification.app_name.lower()
+        # Run the precompiled matcher for this app over the content once
+        if parsed is None:
+            parsed = parse_notification_content(notification.app_name, notification.content)
         
-        # Extract location patterns based on different app formats
-        app_patterns = {
-            "talabat": {
-                "pickup_patterns": [
-                    "pickup from", "collect from", "restaurant", "pickup location", "من"
-                ],
-                "dropoff_patterns": [
-                    "deliver to", "delivery address", "customer address", "destination", "إلى"
-                ],
-                "amount_patterns": [
-                    "amount", "price", "payment", "جنيه", "ج.م", "egp"
-                ]
-            },
-            "careem": {
-                "pickup_patterns": [
-                    "pickup", "pick up", "starting location", "from", "pickup at"
-                ],
-                "dropoff_patterns": [
-                    "dropoff", "drop off", "destination", "to", "dropoff at"
-                ],
-                "amount_patterns": [
-                    "fare", "cost", "price", "egp", "جنيه", "ج.م"
-                ]
-            },
-            "indrive": {
-                "pickup_patterns": [
-                    "pickup from", "starting point", "from", "pickup location"
-                ],
-                "dropoff_patterns": [
-                    "destination", "drop-off", "to", "delivery location"
-                ],
-                "amount_patterns": [
-                    "fare", "price", "egp", "جنيه", "ج.م", "cost"
-                ]
-            },
-            "uber eats": {
-                "pickup_patterns": [
-                    "restaurant", "pickup from", "collect from", "ready at"
-                ],
-                "dropoff_patterns": [
-                    "deliver to", "customer", "destination", "drop off at"
-                ],
-                "amount_patterns": [
-                    "total", "amount", "price", "جنيه", "egp"
-                ]
-            },
-            "instashop": {
-                "pickup_patterns": [
-                    "shop", "store", "pickup from", "pickup at", "collect from"
-                ],
-                "dropoff_patterns": [
-                    "deliver to", "customer", "destination", "delivery address"
-                ],
-                "amount_patterns": [
-                    "order total", "total", "amount", "price", "egp", "جنيه"
-                ]
-            },
-            # Default patterns for unknown apps
-            "default": {
-                "pickup_patterns": [
-                    "pickup", "from", "restaurant", "store", "shop", "source", "origin"
-                ],
-                "dropoff_patterns": [
-                    "deliver", "to", "customer", "destination", "dropoff", "delivery"
-                ],
-                "amount_patterns": [
-                    "amount", "price", "payment", "total", "cost", "fare", "egp", "جنيه"
-                ]
-            }
-        }
-        
-        # Get patterns for the current app, fallback to default if not found
-        current_patterns = app_patterns.get(app_name, app_patterns["default"])
-        
-        # Extract pickup location
         pickup_location = None
-        for pattern in current_patterns["pickup_patterns"]:
-            if pattern in content:
-                idx = content.find(pattern) + len(pattern)
-                # Look for end of address (. or , or new line)
-                end_markers = ['.', ',', '\n']
-                end_idx = len(content)
-                for marker in end_markers:
-                    marker_idx = content.find(marker, idx)
-                    if marker_idx != -1 and marker_idx < end_idx:
-                        end_idx = marker_idx
-                
-                pickup_address = content[idx:end_idx].strip()
-                if len(pickup_address) > 5:  # Ensure we have a meaningful address
-                    pickup_location = Location(
-                        latitude=30.0444,  # Simulated coordinates for Cairo
-                        longitude=31.2357,
-                        address=pickup_address
-                    )
-                    break
+        if parsed.pickup_address:
+            located = locations[parsed.pickup_address]
+            pickup_location = Location(
+                latitude=located.latitude,
+                longitude=located.longitude,
+                address=parsed.pickup_address
+            )
         
-        # Extract dropoff location
         dropoff_location = None
-        for pattern in current_patterns["dropoff_patterns"]:
-            if pattern in content:
-                idx = content.find(pattern) + len(pattern)
-                # Look for end of address
-                end_markers = ['.', ',', '\n']
-                end_idx = len(content)
-                for marker in end_markers:
-                    marker_idx = content.find(marker, idx)
-                    if marker_idx != -1 and marker_idx < end_idx:
-                        end_idx = marker_idx
-                
-                dropoff_address = content[idx:end_idx].strip()
-                if len(dropoff_address) > 5:  # Ensure we have a meaningful address
-                    dropoff_location = Location(
-                        latitude=30.0566,  # Slightly different coordinates
-                        longitude=31.2394,
-                        address=dropoff_address
-                    )
-                    break
-        
-        # Extract payment amount
-        payment_amount = None
-        for pattern in current_patterns["amount_patterns"]:
-            if pattern in content:
-                # Find the pattern and look for numbers around it
-                pattern_idx = content.find(pattern)
-                # Look before and after the pattern for numbers
-                # This uses regex to find numbers with potential decimal points
-                import re
-                numbers = re.findall(r'\d+(?:\.\d+)?', content[max(0, pattern_idx-20):pattern_idx+20])
-                if numbers:
-                    # Take the largest number as the likely amount
-                    payment_amount = float(max(numbers, key=float))
-                    break
+        if parsed.dropoff_address:
+            located = locations[parsed.dropoff_address]
+            dropoff_location = Location(
+                latitude=located.latitude,
+                longitude=located.longitude,
+                address=parsed.dropoff_address
+            )
         
-        # Extract customer name (simplified)
-        customer_name = None
-        name_indicators = ["customer", "client", "recipient", "name"]
-        for indicator in name_indicators:
-            if indicator in content:
-                idx = content.find(indicator) + len(indicator)
-                end_idx = min(idx + 30, len(content))  # Take up to 30 chars after
-                potential_name = content[idx:end_idx].strip()
-                first_sentence_end = potential_name.find('.')
-                if first_sentence_end != -1:
-                    potential_name = potential_name[:first_sentence_end].strip()
-                if len(potential_name) > 2:
-                    customer_name = potential_name
-                    break
+        payment_amount = parsed.payment_amount
+        customer_name = parsed.customer_name
         
         # Set extracted values in the order
         if pickup_location:
@@ -310,28 +370,56 @@ class NotificationProcessor:
         if customer_name:
             order["customer_name"] = customer_name
         
-        # In a real app, we would use coordinates from geocoding APIs
-        # Here we're simulating with random variation for demo purposes
         if order["pickup_location"] and order["dropoff_location"]:
-            import random
-            # Add small random variations to coordinates for demo
-            order["pickup_location"].latitude += random.uniform(-0.05, 0.05)
-            order["pickup_location"].longitude += random.uniform(-0.05, 0.05)
-            order["dropoff_location"].latitude += random.uniform(-0.05, 0.05)
-            order["dropoff_location"].longitude += random.uniform(-0.05, 0.05)
-            
             # Create and return the complete order
             return Order(**order)
         
         # If we couldn't extract both pickup and dropoff, return None
         return None
 
+async def process_notifications(notifications):
+    """
+    Parse notifications into orders (None where no order could be
+    extracted), geocoding all their addresses in one batch
+    """
+    with timed("parse"):
+        parsed = [
+            parse_notification_content(notification.app_name, notification.content)
+            for notification in notifications
+        ]
+    addresses = [
+        address
+        for fields in parsed
+        for address in (fields.pickup_address, fields.dropoff_address)
+        if address
+    ]
+    with timed("geocode"):
+        locations = await geocoder.geocode_many(addresses)
+    with timed("parse"):
+        return [
+            NotificationProcessor.process_notification(notification, locations, fields)
+            for notification, fields in zip(notifications, parsed)
+        ]
+
 # Authentication functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HashingPoolBusy:
+        raise password_pool_busy()
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HashingPoolBusy:
+        raise password_pool_busy()
+
+def password_pool_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many concurrent logins, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
 
 async def get_user(username: str):
     user_doc = await db.users.find_one({"username": username})
@@ -342,7 +430,7 @@ async def authenticate_user(username: str, password: str):
     user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -357,6 +445,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await resolve_user(token)
+
+async def resolve_user(token: str):
+    """The user a JWT belongs to; raises a 401 HTTPException if it is invalid"""
+    cached_user = user_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -368,30 +464,397 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = await get_user(username=token_data.username)
-    if user is None:
+    except jwt.PyJWTError:
         raise credentials_exception
+    
+    if TRUST_TOKEN_CLAIMS and "uid" in payload:
+        user = User(
+            id=payload["uid"],
+            username=token_data.username,
+            email=payload["email"],
+            full_name=payload["name"],
+            created_at=payload["created_at"]
+        )
+    else:
+        user_in_db = await get_user(username=token_data.username)
+        if user_in_db is None:
+            raise credentials_exception
+        user = User(**user_in_db.dict())
+    
+    # Never serve a cached user past its token's expiry
+    ttl = USER_CACHE_TTL_SECONDS
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        user_cache.set(token, user, ttl=ttl)
     return user
 
 # Helper functions
-def calculate_distance(loc1, loc2):
-    """Calculate distance between two locations using Haversine formula"""
-    # Convert latitude and longitude from degrees to radians
-    lat1 = math.radians(loc1.latitude)
-    lon1 = math.radians(loc1.longitude)
-    lat2 = math.radians(loc2.latitude)
-    lon2 = math.radians(loc2.longitude)
-    
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    radius = 6371  # Radius of the Earth in kilometers
-    
-    return radius * c
+def publish_event(user_id: str, event_type: str, data):
+    # Order events come from the change streams when those are enabled
+    if EVENTS_SOURCE == "change_streams" and event_type.startswith("order."):
+        return
+    if EVENTS_SOURCE == "mongo":
+        event_relay.publish(user_id, event_type, data)
+        return
+    event_bus.publish(user_id, event_type, data)
+
+def combination_search():
+    global _combination_search
+    if _combination_search is None:
+        from parallel_search import engine_from_env
+        _combination_search = engine_from_env()
+    return _combination_search
+
+async def load_pending_orders(user_id: str) -> "OrderColumns":
+    """
+    Pending orders of a user in creation order, the canonical bundle order.
+    Only the fields planning needs are read, into columns rather than models.
+    """
+    from order_columns import PLANNING_PROJECTION, OrderColumns
+    
+    orders = await db.orders.find({
+        "user_id": user_id,
+        "status": "pending"
+    }, PLANNING_PROJECTION).sort("created_at", 1).to_list(MAX_COMBINATION_ORDERS)
+    return OrderColumns.from_documents(orders)
+
+def combination_expiry():
+    # The incremental pool is kept current as orders change; expiring it
+    # would only lose bundles of orders that are still pending
+    if INCREMENTAL_COMBINATIONS or COMBINATION_TTL_SECONDS <= 0:
+        return None
+    return datetime.utcnow() + timedelta(seconds=COMBINATION_TTL_SECONDS)
+
+def combination_from_candidate(candidate, orders, user_id, expires_at=None):
+    k = len(candidate.indices)
+    order_ids = [orders.ids[i] for i in candidate.indices]
+    return OrderCombination(
+        user_id=user_id,
+        expires_at=expires_at,
+        order_ids=order_ids,
+        total_distance=candidate.total_distance,
+        estimated_time=candidate.estimated_time,
+        savings_percentage=candidate.savings_percentage,
+        route=[
+            RouteStop(
+                order_id=order_ids[stop % k],
+                stop_type="pickup" if stop < k else "dropoff"
+            )
+            for stop in candidate.stops
+        ]
+    )
+
+def bundle_key(order_ids: List[str]) -> str:
+    """The same for every combination of the same orders"""
+    return "|".join(sorted(order_ids))
+
+async def store_open_combinations(combinations: List[OrderCombination]):
+    """
+    Insert open combinations, skipping bundles the user already has open.
+    Adds for different new orders each find the bundles they share (both
+    orders were stored before either add ran), and an add can race a
+    rebuild; the unique bundle_key index settles those.
+    """
+    writes = []
+    for combo in combinations:
+        doc = {**combo.dict(), "bundle_key": bundle_key(combo.order_ids)}
+        writes.append(UpdateOne(
+            {"user_id": combo.user_id, "bundle_key": doc["bundle_key"], "is_accepted": False},
+            {"$setOnInsert": doc},
+            upsert=True
+        ))
+    try:
+        await db.order_combinations.bulk_write(writes, ordered=False)
+    except BulkWriteError as exc:
+        # Concurrent upserts of one bundle: the other one was stored
+        if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+            raise
+
+async def add_order_combinations(user_id: str, order_ids: List[str]):
+    """
+    Incrementally add the combinations involving newly pending orders to the
+    user's open combinations, instead of regenerating every bundle.
+    """
+    from combinations import TRIPLET_OUTER_PICKUP_KM, best_first, bundles_containing, evaluate_bundle, keep_best
+    from distance_matrix import DistanceMatrix, haversine_pairs
+    
+    orders = await load_pending_orders(user_id)
+    position = {order_id: idx for idx, order_id in enumerate(orders.ids)}
+    new_positions = [position[order_id] for order_id in order_ids if order_id in position]
+    if not new_positions or len(orders) < 2:
+        return
+    
+    pickup_lat = orders.pickup_lat
+    pickup_lon = orders.pickup_lon
+    
+    # Candidates stay lightweight tuples in a heap bounded by the pool size;
+    # only the ones that can survive trimming become models
+    heap = []
+    sequence = 0
+    handled = set()
+    with timed("combinations"):
+        for target in new_positions:
+            # Only orders near the new one can be bundled with it
+            near = haversine_pairs(
+                pickup_lat[target], pickup_lon[target], pickup_lat, pickup_lon
+            ) <= TRIPLET_OUTER_PICKUP_KM
+            members = [idx for idx in near.nonzero()[0].tolist() if idx not in handled or idx == target]
+            if len(members) < 2:
+                handled.add(target)
+                continue
+            
+            subset = orders.take(members)
+            distances = DistanceMatrix.from_columns(subset)
+            for bundle in bundles_containing(members.index(target), len(subset), distances.pickup):
+                candidate = evaluate_bundle(bundle, distances)
+                if candidate:
+                    # Back to indices into orders; earlier bundles win ties
+                    candidate = candidate._replace(indices=tuple(members[idx] for idx in candidate.indices))
+                    sequence += 1
+                    keep_best(heap, (candidate.savings_percentage, -sequence, candidate), COMBINATION_POOL_SIZE)
+            # Bundles with this order are done; later new orders must not repeat them
+            handled.add(target)
+    
+    if heap:
+        expires_at = combination_expiry()
+        combinations = [
+            combination_from_candidate(candidate, orders, user_id, expires_at)
+            for candidate in best_first(heap)
+        ]
+        await store_open_combinations(combinations)
+        await trim_combination_pool(user_id)
+        publish_event(user_id, "combinations.updated", combinations[:COMBINATION_TOP_K])
+
+async def trim_combination_pool(user_id: str):
+    """Keep only the best COMBINATION_POOL_SIZE open combinations of a user"""
+    surplus = await db.order_combinations.find(
+        {"user_id": user_id, "is_accepted": False},
+        {"_id": 0, "id": 1}
+    ).sort("savings_percentage", -1).skip(COMBINATION_POOL_SIZE).to_list(None)
+    if surplus:
+        await db.order_combinations.delete_many({"id": {"$in": [combo["id"] for combo in surplus]}})
+        # The bundles cut here still beat nothing that was kept, but once
+        # enough of the kept ones are invalidated the pool must be rebuilt
+        await db.combination_pools.update_one({"user_id": user_id}, {"$set": {"trimmed": True}}, upsert=True)
+
+async def rebuild_combination_pool(user_id: str, orders, routing=RoutingEngine.AUTO,
+                                   routing_time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """
+    Search every bundle of the pending `orders` (see load_pending_orders)
+    and replace the user's open combinations with the best ones. Returns
+    them, best first.
+    """
+    # Check every close enough pair and triplet of orders, keeping only as
+    # many of the best as are stored below
+    top_k = COMBINATION_POOL_SIZE if INCREMENTAL_COMBINATIONS else COMBINATION_TOP_K
+    with timed("combinations"):
+        candidates = await combination_search().search(orders, routing, routing_time_budget_ms, top_k)
+        # Only the winners are materialized
+        expires_at = combination_expiry()
+        combinations = [
+            combination_from_candidate(candidate, orders, user_id, expires_at)
+            for candidate in candidates
+        ]
+    
+    # Replace the user's open combinations with the fresh ones in one write,
+    # so generating again does not pile up stale copies
+    await db.order_combinations.delete_many({"user_id": user_id, "is_accepted": False})
+    if combinations:
+        await store_open_combinations(combinations)
+    if INCREMENTAL_COMBINATIONS:
+        # A full pool may have left bundles out, just as trimming does
+        await db.combination_pools.update_one(
+            {"user_id": user_id}, {"$set": {"trimmed": len(candidates) >= COMBINATION_POOL_SIZE}}, upsert=True
+        )
+    return combinations
+
+async def claim_pool_rebuild(user_id: str):
+    """
+    Whether the user's pool may be missing bundles (it was trimmed, or
+    predates this bookkeeping), marking it complete so that only one of
+    concurrent callers rebuilds it
+    """
+    before = await db.combination_pools.find_one_and_update(
+        {"user_id": user_id},
+        {"$set": {"trimmed": False}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    return before is None or before["trimmed"]
+
+async def refill_combination_pool(user_id: str):
+    """
+    After invalidation: rebuild the pool if trimming cut bundles from it and
+    fewer than are listed are left open. Runs on the writes that invalidate,
+    so listing combinations stays a read.
+    """
+    wanted = min(COMBINATIONS_LISTED, COMBINATION_POOL_SIZE)
+    open_count = await db.order_combinations.count_documents(
+        {"user_id": user_id, "is_accepted": False}, limit=wanted
+    )
+    if open_count >= wanted:
+        return
+    pool = await db.combination_pools.find_one({"user_id": user_id}, {"_id": 0, "trimmed": 1})
+    if pool is not None and not pool["trimmed"]:
+        return
+    if await claim_pool_rebuild(user_id):
+        orders = await load_pending_orders(user_id)
+        if len(orders) >= 2:
+            await rebuild_combination_pool(user_id, orders)
+
+async def invalidate_order_combinations(user_id: str, order_ids: List[str], session=None):
+    """Drop open combinations involving orders that are no longer pending"""
+    await db.order_combinations.delete_many({
+        "user_id": user_id,
+        "is_accepted": False,
+        "order_ids": {"$in": order_ids}
+    }, session=session)
+
+class CombinationConflict(Exception):
+    pass
+
+async def claim_combination(combination_id: str, user_id: str, session=None):
+    """
+    Accept a combination and move its orders from pending to accepted.
+    The combination is claimed atomically, so it can be accepted once; its
+    orders are then updated in one update_many that only matches pending
+    orders. If any order was taken in the meantime, CombinationConflict is
+    raised, and without a session the writes made so far are undone here.
+    Returns the accepted combination, or None if it does not exist.
+    """
+    import analytics
+    
+    accepted_at = datetime.utcnow()
+    combo = await db.order_combinations.find_one_and_update(
+        {"id": combination_id, "user_id": user_id, "is_accepted": False},
+        {"$set": {"is_accepted": True, "accepted_at": accepted_at}, "$unset": {"expires_at": ""}},
+        return_document=ReturnDocument.BEFORE,
+        session=session
+    )
+    if combo is None:
+        if await db.order_combinations.count_documents({"id": combination_id, "user_id": user_id}, limit=1, session=session):
+            raise CombinationConflict("Combination has already been accepted")
+        return None
+    
+    order_ids = combo["order_ids"]
+    result = await db.orders.update_many(
+        {"id": {"$in": order_ids}, "user_id": user_id, "status": "pending"},
+        {"$set": {
+            "status": "accepted",
+            "combination_id": combination_id,
+            "updated_at": datetime.utcnow()
+        }},
+        session=session
+    )
+    if result.modified_count != len(order_ids):
+        if session is None:
+            await db.orders.update_many(
+                {"id": {"$in": order_ids}, "combination_id": combination_id},
+                {"$set": {"status": "pending", "updated_at": datetime.utcnow()}, "$unset": {"combination_id": ""}}
+            )
+            await db.order_combinations.update_one(
+                {"id": combination_id},
+                {"$set": {"is_accepted": False, "expires_at": combo.get("expires_at")}, "$unset": {"accepted_at": ""}}
+            )
+        raise CombinationConflict("Some orders in this combination are no longer pending")
+    
+    # Other open combinations sharing these orders can no longer be accepted
+    await invalidate_order_combinations(user_id, order_ids, session=session)
+    await analytics.record_combination_acceptance(db, combo, accepted_at, session=session)
+    combo.pop("expires_at", None)
+    return {**combo, "is_accepted": True, "accepted_at": accepted_at}
+
+async def process_queued_notification(job):
+    """
+    Parse a queued notification into an order. A job can run more than once
+    (retries, expired leases), so the order is upserted on its notification.
+    Returns the order id (or None) and whether this run created the order.
+    """
+    notification_doc = await db.notifications.find_one({"id": job["id"]}, {"_id": 0})
+    if notification_doc is None:
+        return None, False
+    notification = Notification(**notification_doc)
+    
+    order = (await process_notifications([notification]))[0]
+    order_id = None
+    created = False
+    if order:
+        result = await db.orders.update_one(
+            {"notification_id": notification.id},
+            {"$setOnInsert": order.dict()},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            order_id = order.id
+            created = True
+            publish_event(notification.user_id, "order.created", order)
+        else:
+            existing = await db.orders.find_one({"notification_id": notification.id}, {"_id": 0, "id": 1})
+            order_id = existing["id"]
+        await db.notifications.update_one({"id": notification.id}, {"$set": {"is_processed": True}})
+    return order_id, created
+
+async def after_notification_batch(user_id: str, order_ids: List[str]):
+    if INCREMENTAL_COMBINATIONS:
+        await add_order_combinations(user_id, order_ids)
+
+notification_queue = NotificationQueue(
+    db.notification_jobs,
+    process_queued_notification,
+    after_batch=after_notification_batch,
+    workers=NOTIFICATION_WORKERS,
+    max_backlog=NOTIFICATION_MAX_BACKLOG,
+    max_attempts=NOTIFICATION_MAX_ATTEMPTS,
+    notifications=db.notifications
+)
+
+async def enqueue_stored_notifications(notification_docs: List[dict]):
+    """
+    Queue notifications after they were stored. They are already accepted, so
+    a failed queue write is not the client's error: the queue's sweep picks
+    them up instead, and a retry by the client would only store them twice.
+    """
+    try:
+        await notification_queue.enqueue(notification_docs)
+    except Exception:
+        logger.exception("Queueing %s notifications failed", len(notification_docs))
+
+async def ensure_queue_capacity(count: int):
+    """Reject ingestion with a 503 while the processing backlog is full"""
+    try:
+        await notification_queue.ensure_capacity(count)
+    except QueueFull as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(exc),
+            headers={"Retry-After": "5"},
+        )
+
+async def paginated_response(response, collection, query, sort_field, model, cursor, limit, fields):
+    """
+    One keyset-paginated page of a user's documents, newest first. The next
+    page's cursor is returned in the X-Next-Cursor header. The projection is
+    pushed down to Mongo; with `fields` (or FAST_JSON_RESPONSES) the
+    documents are returned as-is instead of being validated into `model`.
+    """
+    try:
+        projection = build_projection(fields, model.model_fields, sort_field) if fields else model_projection(model)
+        docs, next_cursor = await fetch_page(collection, query, sort_field, cursor, limit, projection)
+    except (InvalidCursor, InvalidFields) as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc)
+        )
+    
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if FAST_JSON_RESPONSES:
+        return documents_response(docs, None if fields else model, headers)
+    if fields:
+        return JSONResponse(content=jsonable_encoder(docs), headers=headers)
+    
+    response.headers.update(headers)
+    return [model(**doc) for doc in docs]
 
 # Auth endpoints
 @api_router.post("/token", response_model=Token)
@@ -404,8 +867,17 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # Identity claims let get_current_user skip the users lookup when
+    # TRUST_TOKEN_CLAIMS is enabled
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={
+            "sub": user.username,
+            "uid": user.id,
+            "email": user.email,
+            "name": user.full_name,
+            "created_at": user.created_at.isoformat()
+        },
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -428,7 +900,7 @@ async def create_user(user: UserCreate):
             detail="Email already registered"
         )
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_dict = user.dict()
     del user_dict["password"]
     
@@ -439,7 +911,14 @@ async def create_user(user: UserCreate):
         created_at=datetime.utcnow()
     )
     
-    await db.users.insert_one(user_in_db.dict())
+    try:
+        await db.users.insert_one(user_in_db.dict())
+    except DuplicateKeyError as exc:
+        # A concurrent sign-up took the username or email after the checks above
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered" if "email" in str(exc) else "Username already registered"
+        )
     
     # Return user without hashed_password
     user_response = User(**user_in_db.dict())
@@ -451,49 +930,18 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
 
 # Delivery Apps endpoints
 @api_router.get("/delivery-apps", response_model=List[DeliveryApp])
-async def get_delivery_apps():
-    delivery_apps = await db.delivery_apps.find().to_list(length=100)
-    if not delivery_apps:
-        # Create default delivery apps if none exist
-        default_apps = [
-            DeliveryApp(
-                id=str(uuid.uuid4()),
-                name="Talabat",
-                logo_url="https://play-lh.googleusercontent.com/HN9-_FL6v4AwKslcCKD9BB0rsmbK_BLJdzjFTKPaHRQr7-xM3xkJl2E0M4TjRH1__Ps",
-                is_active=True
-            ),
-            DeliveryApp(
-                id=str(uuid.uuid4()),
-                name="Careem",
-                logo_url="https://play-lh.googleusercontent.com/uf19YZxHI1RdHhvDGbwPrMupvYF2BxLVvheEPolXsHFRjGfnZJQJg-9qoCLMJVE54Q",
-                is_active=True
-            ),
-            DeliveryApp(
-                id=str(uuid.uuid4()),
-                name="InDrive",
-                logo_url="https://play-lh.googleusercontent.com/Q6oi2-y7Mega_8VYu-UvdE9PBgHfBZTb-KnFPXHxjDgWbkgnJqMzwlMxhW9or6P12KDU",
-                is_active=True
-            ),
-            DeliveryApp(
-                id=str(uuid.uuid4()),
-                name="Uber Eats",
-                logo_url="https://play-lh.googleusercontent.com/kDzXOuJzWFNJNwWH45Ck3ZjhIK3UCxNXmOqYJcLb8wEJ2QXRzQ-BXgbD7q9LlJmeoa0",
-                is_active=True
-            ),
-            DeliveryApp(
-                id=str(uuid.uuid4()),
-                name="Instashop",
-                logo_url="https://play-lh.googleusercontent.com/BYpbl6-tIYf4VGzvsb5dhPP6Lq8Ql-FEyxNYgO6v-3RQbTIPU85oRFQvGk8QxLQvqA",
-                is_active=True
-            )
-        ]
-        
-        for app in default_apps:
-            await db.delivery_apps.insert_one(app.dict())
-        
-        return default_apps
+async def get_delivery_apps(request: Request):
+    # Served from the in-memory catalogue; clients revalidate with If-None-Match
+    catalogue = await delivery_app_catalogue.current(db)
+    headers = {
+        "ETag": catalogue.etag,
+        "Cache-Control": f"public, max-age={DELIVERY_APPS_MAX_AGE_SECONDS}"
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or catalogue.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
     
-    return [DeliveryApp(**app) for app in delivery_apps]
+    return Response(content=catalogue.body, media_type="application/json", headers=headers)
 
 # Notifications endpoints
 @api_router.post("/notifications/simulate", response_model=Notification)
@@ -502,7 +950,7 @@ async def simulate_notification(
     current_user: User = Depends(get_current_user)
 ):
     # Find the app ID based on app name
-    app = await db.delivery_apps.find_one({"name": simulated.app_name})
+    app = (await delivery_app_catalogue.current(db)).by_name.get(simulated.app_name)
     if not app:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -518,42 +966,172 @@ async def simulate_notification(
         content=simulated.content
     )
     
+    if NOTIFICATION_QUEUE:
+        # Store and queue only; a worker parses it and creates the order
+        await ensure_queue_capacity(1)
+        await db.notifications.insert_one(notification.dict())
+        await enqueue_stored_notifications([notification.dict()])
+        publish_event(current_user.id, "notification.created", notification)
+        return notification
+    
+    # Process notification to extract order if possible, so the notification
+    # is stored with its final is_processed flag in a single write
+    order = (await process_notifications([notification]))[0]
+    if order:
+        notification.is_processed = True
+    
     # Insert into database
     await db.notifications.insert_one(notification.dict())
-    
-    # Process notification to extract order if possible
-    order = NotificationProcessor.process_notification(notification)
+    publish_event(current_user.id, "notification.created", notification)
     if order:
         await db.orders.insert_one(order.dict())
-        
-        # Mark notification as processed
-        await db.notifications.update_one(
-            {"id": notification.id},
-            {"$set": {"is_processed": True}}
-        )
+        publish_event(current_user.id, "order.created", order)
+        if INCREMENTAL_COMBINATIONS:
+            await add_order_combinations(current_user.id, [order.id])
     
     return notification
 
+@api_router.post("/notifications/batch", response_model=NotificationBatchResult)
+async def ingest_notification_batch(
+    batch: NotificationBatch,
+    current_user: User = Depends(get_current_user)
+):
+    # Resolve every app name in the batch from the catalogue snapshot
+    apps_by_name = (await delivery_app_catalogue.current(db)).by_name
+    if NOTIFICATION_QUEUE:
+        await ensure_queue_capacity(len(batch.notifications))
+    
+    accepted = []
+    results = []
+    for index, simulated in enumerate(batch.notifications):
+        app = apps_by_name.get(simulated.app_name)
+        if not app:
+            results.append(NotificationBatchItem(
+                index=index,
+                error=f"Delivery app {simulated.app_name} not found"
+            ))
+            continue
+        
+        accepted.append((index, Notification(
+            user_id=current_user.id,
+            app_id=app["id"],
+            app_name=app["name"],
+            title=simulated.title,
+            content=simulated.content
+        )))
+    
+    # Inline parsing geocodes the whole batch's addresses at once
+    orders = [None] * len(accepted)
+    if not NOTIFICATION_QUEUE and accepted:
+        orders = await process_notifications([notification for _, notification in accepted])
+    
+    notification_docs = []
+    order_docs = []
+    for (index, notification), order in zip(accepted, orders):
+        if order:
+            notification.is_processed = True
+            order_docs.append(order.dict())
+        notification_docs.append(notification.dict())
+        
+        results.append(NotificationBatchItem(
+            index=index,
+            notification_id=notification.id,
+            order_id=order.id if order else None,
+            is_processed=notification.is_processed
+        ))
+    results.sort(key=lambda item: item.index)
+    
+    # Two bulk writes for the whole batch instead of up to four round trips per item
+    if notification_docs:
+        await db.notifications.insert_many(notification_docs, ordered=False)
+        for doc in notification_docs:
+            # The insert added the ObjectId, which is not part of the event
+            doc.pop("_id", None)
+            publish_event(current_user.id, "notification.created", doc)
+        if NOTIFICATION_QUEUE:
+            await enqueue_stored_notifications(notification_docs)
+    if order_docs:
+        await db.orders.bulk_write([InsertOne(doc) for doc in order_docs], ordered=False)
+        for doc in order_docs:
+            doc.pop("_id", None)
+            publish_event(current_user.id, "order.created", doc)
+        if INCREMENTAL_COMBINATIONS:
+            await add_order_combinations(current_user.id, [doc["id"] for doc in order_docs])
+    
+    return NotificationBatchResult(
+        received=len(batch.notifications),
+        stored=len(notification_docs),
+        orders_created=len(order_docs),
+        queued=len(notification_docs) if NOTIFICATION_QUEUE else 0,
+        results=results
+    )
+
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: User = Depends(get_current_user)):
-    notifications = await db.notifications.find(
-        {"user_id": current_user.id}
-    ).sort("received_at", -1).to_list(50)
+async def get_notifications(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    return await paginated_response(
+        response, db.notifications, {"user_id": current_user.id}, "received_at",
+        Notification, cursor, limit, fields
+    )
+
+@api_router.get("/notifications/{notification_id}/status", response_model=NotificationStatus)
+async def get_notification_status(
+    notification_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    notification = await db.notifications.find_one(
+        {"id": notification_id, "user_id": current_user.id},
+        {"_id": 0, "id": 1, "is_processed": 1}
+    )
+    if not notification:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Notification not found"
+        )
     
-    return [Notification(**notif) for notif in notifications]
+    job = await db.notification_jobs.find_one({"id": notification_id}, {"_id": 0})
+    if job is None:
+        # Parsed inline, or its finished job has already expired
+        order = await db.orders.find_one({"notification_id": notification_id}, {"_id": 0, "id": 1})
+        return NotificationStatus(
+            notification_id=notification_id,
+            state="done",
+            is_processed=notification["is_processed"],
+            order_id=order["id"] if order else None
+        )
+    
+    return NotificationStatus(
+        notification_id=notification_id,
+        state=job["state"],
+        is_processed=notification["is_processed"],
+        attempts=job["attempts"],
+        order_id=job["order_id"],
+        error=job["error"],
+        updated_at=job["updated_at"]
+    )
 
 # Orders endpoints
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders(
+    response: Response,
     status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     query = {"user_id": current_user.id}
     if status:
         query["status"] = status
     
-    orders = await db.orders.find(query).sort("created_at", -1).to_list(50)
-    return [Order(**order) for order in orders]
+    return await paginated_response(
+        response, db.orders, query, "created_at", Order, cursor, limit, fields
+    )
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(
@@ -573,51 +1151,104 @@ async def get_order(
 @api_router.put("/orders/{order_id}/status", response_model=Order)
 async def update_order_status(
     order_id: str,
-    status: str = Body(...),
+    new_status: str = Body(...),
     current_user: User = Depends(get_current_user)
 ):
     # Validate status
     valid_statuses = ["pending", "accepted", "in_progress", "completed", "cancelled"]
-    if status not in valid_statuses:
+    if new_status not in valid_statuses:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Invalid status. Must be one of: {', '.join(valid_statuses)}"
         )
     
     # Update the order
-    result = await db.orders.update_one(
+    now = datetime.utcnow()
+    changes = {"status": new_status, "updated_at": now}
+    if new_status != "completed":
+        changes["completed_at"] = None
+    before = await db.orders.find_one_and_update(
         {"id": order_id, "user_id": current_user.id},
-        {"$set": {
-            "status": status,
-            "updated_at": datetime.utcnow()
-        }}
+        {"$set": changes},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.modified_count == 0:
+    if before is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found or you don't have permission to update it"
         )
     
-    updated_order = await db.orders.find_one({"id": order_id})
-    return Order(**updated_order)
+    # Keep the analytics rollups in step with orders entering or leaving completed
+    import analytics
+    
+    was_completed = before["status"] == "completed"
+    if new_status == "completed" and not was_completed:
+        await db.orders.update_one({"id": order_id}, {"$set": {"completed_at": now}})
+        await analytics.record_order_completion(db, before, now)
+    elif was_completed and new_status != "completed":
+        await analytics.record_order_completion(
+            db, before, before.get("completed_at") or before["updated_at"], sign=-1
+        )
+    
+    if INCREMENTAL_COMBINATIONS:
+        await invalidate_order_combinations(current_user.id, [order_id])
+        if new_status == "pending":
+            await add_order_combinations(current_user.id, [order_id])
+        else:
+            await refill_combination_pool(current_user.id)
+    
+    updated_order = Order(**await db.orders.find_one({"id": order_id}))
+    publish_event(current_user.id, "order.updated", updated_order)
+    return updated_order
+
+# Analytics endpoints
+@api_router.get("/analytics", response_model=AnalyticsReport)
+async def get_analytics(
+    days: int = Query(30, ge=1, le=366),
+    bucket: str = Query("day", pattern="^(day|month)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Completed orders, earnings and kilometres of the last `days` days per
+    day or month and delivery app, read from the daily rollups
+    """
+    import analytics
+    
+    return await analytics.report(db, current_user.id, days=days, bucket=bucket)
 
 # Order combinations endpoints
+async def best_open_combinations(user_id: str):
+    return await db.order_combinations.find(
+        {"user_id": user_id, "is_accepted": False},
+        model_projection(OrderCombination)
+    ).sort("savings_percentage", -1).to_list(COMBINATIONS_LISTED)
+
 @api_router.get("/combinations", response_model=List[OrderCombination])
 async def get_combinations(current_user: User = Depends(get_current_user)):
-    combinations = await db.order_combinations.find(
-        {"user_id": current_user.id}
-    ).sort("created_at", -1).to_list(20)
+    if INCREMENTAL_COMBINATIONS:
+        # The open combinations are maintained as orders change (see
+        # refill_combination_pool), so the best ones can be served directly
+        combinations = await best_open_combinations(current_user.id)
+    else:
+        combinations = await db.order_combinations.find(
+            {"user_id": current_user.id},
+            model_projection(OrderCombination)
+        ).sort("created_at", -1).to_list(COMBINATIONS_LISTED)
     
+    if FAST_JSON_RESPONSES:
+        return documents_response(combinations, OrderCombination)
     return [OrderCombination(**combo) for combo in combinations]
 
 @api_router.post("/combinations/generate", response_model=List[OrderCombination])
-async def generate_combinations(current_user: User = Depends(get_current_user)):
+async def generate_combinations(
+    routing: RoutingEngine = RoutingEngine.AUTO,
+    routing_time_budget_ms: int = Query(DEFAULT_TIME_BUDGET_MS, ge=1, le=1000),
+    current_user: User = Depends(get_current_user)
+):
     # Get pending orders
-    orders = await db.orders.find({
-        "user_id": current_user.id,
-        "status": "pending"
-    }).to_list(50)
+    orders = await load_pending_orders(current_user.id)
     
     if len(orders) < 2:
         raise HTTPException(
@@ -625,169 +1256,9 @@ async def generate_combinations(current_user: User = Depends(get_current_user)):
             detail="Need at least 2 pending orders to generate combinations"
         )
     
-    # Convert to Order objects
-    order_objs = [Order(**order) for order in orders]
-    
-    # Generate combinations with enhanced algorithm
-    combinations = []
-    
-    # Simple function to check if two locations are within a reasonable distance
-    def are_locations_close(loc1, loc2, max_distance_km):
-        distance = calculate_distance(loc1, loc2)
-        return distance <= max_distance_km
-    
-    # Calculate the optimal routing order and total distance
-    def calculate_optimal_route(orders):
-        # This is a simplified version - in a production app, you'd use a more sophisticated algorithm
-        # or integrate with a routing API
-        
-        # Calculate all possible routes (for a small number of orders)
-        # For more orders, use a heuristic like nearest neighbor
-        
-        # Start with pickup locations, then dropoff locations
-        pickup_locations = [order.pickup_location for order in orders]
-        dropoff_locations = [order.dropoff_location for order in orders]
-        
-        # Find nearest neighbor path for pickups
-        current_location = pickup_locations[0]
-        path = [0]
-        unvisited = list(range(1, len(pickup_locations)))
-        
-        while unvisited:
-            nearest_idx = min(unvisited, key=lambda i: calculate_distance(current_location, pickup_locations[i]))
-            path.append(nearest_idx)
-            current_location = pickup_locations[nearest_idx]
-            unvisited.remove(nearest_idx)
-        
-        # Calculate pickup path distance
-        pickup_distance = 0
-        for i in range(len(path) - 1):
-            pickup_distance += calculate_distance(
-                pickup_locations[path[i]], 
-                pickup_locations[path[i+1]]
-            )
-        
-        # Now calculate distances between last pickup and first dropoff,
-        # and between dropoffs
-        dropoff_distance = calculate_distance(
-            pickup_locations[path[-1]], 
-            dropoff_locations[0]
-        )
-        
-        for i in range(len(dropoff_locations) - 1):
-            dropoff_distance += calculate_distance(
-                dropoff_locations[i],
-                dropoff_locations[i+1]
-            )
-        
-        # Total route distance
-        total_distance = pickup_distance + dropoff_distance
-        
-        # Estimated time in minutes (assuming average speed of 30 km/h in Cairo traffic)
-        # 30 km/h = 0.5 km/min, so time = distance / 0.5 = distance * 2
-        estimated_time = int(total_distance * 2) + (5 * len(orders))  # Add 5 minutes per stop
-        
-        return {
-            "total_distance": round(total_distance, 2),
-            "estimated_time": estimated_time,
-            "order_sequence": path
-        }
-    
-    # Calculate independent delivery distance (if done separately)
-    def calculate_separate_distance(orders):
-        total = 0
-        for order in orders:
-            # For each order: distance from pickup to dropoff
-            total += calculate_distance(
-                order.pickup_location, 
-                order.dropoff_location
-            )
-        return total
-    
-    # For this enhanced version, we'll check pairs and triplets of orders
-    # First, check all possible pairs
-    for i in range(len(order_objs)):
-        for j in range(i+1, len(order_objs)):
-            order1 = order_objs[i]
-            order2 = order_objs[j]
-            
-            # Check if pickup locations are close enough
-            pickup_close = are_locations_close(
-                order1.pickup_location, 
-                order2.pickup_location,
-                3.0  # 3 km threshold for pickups
-            )
-            
-            # Check if dropoff locations are in the same general direction
-            # by comparing the bearing angle
-            similar_direction = True  # Default assumption
-            
-            if pickup_close or similar_direction:
-                # Calculate optimal route
-                route_info = calculate_optimal_route([order1, order2])
-                
-                # Calculate distance if done separately
-                separate_distance = calculate_separate_distance([order1, order2])
-                
-                # Calculate savings
-                savings_percentage = ((separate_distance - route_info["total_distance"]) / separate_distance) * 100
-                
-                # Only include combinations with positive savings
-                if savings_percentage > 0:
-                    combination = OrderCombination(
-                        user_id=current_user.id,
-                        order_ids=[order1.id, order2.id],
-                        total_distance=route_info["total_distance"],
-                        estimated_time=route_info["estimated_time"],
-                        savings_percentage=round(max(0, savings_percentage), 1)
-                    )
-                    combinations.append(combination)
-    
-    # If we have at least 3 orders, check triplets as well
-    if len(order_objs) >= 3:
-        for i in range(len(order_objs)):
-            for j in range(i+1, len(order_objs)):
-                for k in range(j+1, len(order_objs)):
-                    order1, order2, order3 = order_objs[i], order_objs[j], order_objs[k]
-                    
-                    # Check if all pickup locations are close to each other
-                    pickup_close = (
-                        are_locations_close(order1.pickup_location, order2.pickup_location, 3.5) and 
-                        are_locations_close(order2.pickup_location, order3.pickup_location, 3.5) and
-                        are_locations_close(order1.pickup_location, order3.pickup_location, 4.0)
-                    )
-                    
-                    if pickup_close:
-                        # Calculate optimal route
-                        route_info = calculate_optimal_route([order1, order2, order3])
-                        
-                        # Calculate distance if done separately
-                        separate_distance = calculate_separate_distance([order1, order2, order3])
-                        
-                        # Calculate savings
-                        savings_percentage = ((separate_distance - route_info["total_distance"]) / separate_distance) * 100
-                        
-                        # Only include combinations with good savings
-                        if savings_percentage > 5:  # Higher threshold for triplets
-                            combination = OrderCombination(
-                                user_id=current_user.id,
-                                order_ids=[order1.id, order2.id, order3.id],
-                                total_distance=route_info["total_distance"],
-                                estimated_time=route_info["estimated_time"],
-                                savings_percentage=round(max(0, savings_percentage), 1)
-                            )
-                            combinations.append(combination)
-    
-    # Sort combinations by savings percentage (highest first)
-    combinations.sort(key=lambda x: x.savings_percentage, reverse=True)
-    
-    # Limit to top 10 combinations
-    combinations = combinations[:10]
-    
-    # Save combinations to database
-    for combo in combinations:
-        await db.order_combinations.insert_one(combo.dict())
-    
+    combinations = await rebuild_combination_pool(current_user.id, orders, routing, routing_time_budget_ms)
+    combinations = combinations[:COMBINATION_TOP_K]
+    publish_event(current_user.id, "combinations.updated", combinations)
     return combinations
 
 @api_router.put("/combinations/{combination_id}/accept", response_model=OrderCombination)
@@ -795,47 +1266,138 @@ async def accept_combination(
     combination_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    # Update the combination to accepted
-    result = await db.order_combinations.update_one(
-        {"id": combination_id, "user_id": current_user.id},
-        {"$set": {"is_accepted": True}}
-    )
+    try:
+        if MONGO_TRANSACTIONS:
+            async with await client.start_session() as session:
+                combo = await session.with_transaction(
+                    lambda session: claim_combination(combination_id, current_user.id, session)
+                )
+        else:
+            combo = await claim_combination(combination_id, current_user.id)
+    except CombinationConflict as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
     
-    if result.modified_count == 0:
+    if combo is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Combination not found or you don't have permission to update it"
         )
     
-    # Get the updated combination
-    combo = await db.order_combinations.find_one({"id": combination_id})
-    
-    # Update the orders in this combination to "accepted" status
-    for order_id in combo["order_ids"]:
-        await db.orders.update_one(
-            {"id": order_id, "user_id": current_user.id},
-            {"$set": {
-                "status": "accepted",
-                "updated_at": datetime.utcnow()
-            }}
-        )
+    if INCREMENTAL_COMBINATIONS:
+        # Accepting invalidated the other open bundles of these orders
+        await refill_combination_pool(current_user.id)
     
+    # Published once the claim (and its transaction) succeeded, so other
+    # open views drop the orders and the bundles that are gone
+    accepted_orders = await db.orders.find({"id": {"$in": combo["order_ids"]}}, {"_id": 0}).to_list(None)
+    for order in accepted_orders:
+        publish_event(current_user.id, "order.updated", order)
+    open_combinations = await best_open_combinations(current_user.id)
+    publish_event(current_user.id, "combinations.updated", open_combinations[:COMBINATION_TOP_K])
     return OrderCombination(**combo)
 
-@api_router.get("/status")
-async def status():
-    return {"status": "ok", "timestamp": datetime.utcnow().isoformat()}
+async def authenticate_event_stream(message):
+    """
+    The user and token expiry (a Unix time, or None) of an event stream's
+    {"type": "auth", "token": "<access token>"} message; raises a 401
+    HTTPException for any other message or an invalid token
+    """
+    try:
+        data = json.loads(message.get("text") or "")
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or data.get("type") != "auth" or not isinstance(data.get("token"), str):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Expected an auth message")
+    user = await resolve_user(data["token"])
+    # resolve_user has verified the signature
+    expires_at = jwt.decode(data["token"], options={"verify_signature": False}).get("exp")
+    return user, expires_at
 
-# Include the router in the main app
-app.include_router(api_router)
+@api_router.websocket("/events")
+async def event_stream(websocket: WebSocket):
+    """
+    Push channel for the user's new notifications, new and updated orders and
+    combinations. The client authenticates with a first message
+    {"type": "auth", "token": "<access token>"}, not in the URL, which
+    proxies write to their access logs, and may send another with a fresh
+    token to keep the stream open. The stream is closed with 1008 (policy
+    violation) when a token is invalid or expires, or the first message is
+    not an auth message. A ping event is sent when the stream has been idle
+    for EVENT_HEARTBEAT_SECONDS.
+    """
+    await websocket.accept()
+    try:
+        message = await asyncio.wait_for(websocket.receive(), EVENT_AUTH_TIMEOUT_SECONDS)
+        if message["type"] == "websocket.disconnect":
+            return
+        user, expires_at = await authenticate_event_stream(message)
+    except (asyncio.TimeoutError, HTTPException):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    with event_bus.subscribe(user.id) as queue:
+        # Reading has to run anyway so disconnects are noticed; it also
+        # receives renewed tokens
+        receiver = asyncio.create_task(websocket.receive())
+        try:
+            while True:
+                timeout = EVENT_HEARTBEAT_SECONDS
+                if expires_at is not None:
+                    timeout = min(timeout, expires_at - time.time())
+                    if timeout <= 0:
+                        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                        break
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait(
+                    {receiver, getter},
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter in done:
+                    await websocket.send_json(getter.result())
+                else:
+                    getter.cancel()
+                if receiver in done:
+                    message = receiver.result()
+                    if message["type"] == "websocket.disconnect":
+                        break
+                    try:
+                        renewed, expires_at = await authenticate_event_stream(message)
+                    except HTTPException:
+                        renewed = None
+                    if renewed is None or renewed.id != user.id:
+                        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                        break
+                    receiver = asyncio.create_task(websocket.receive())
+                elif not done and (expires_at is None or time.time() < expires_at):
+                    await websocket.send_json({"type": "ping", "sent_at": datetime.utcnow().isoformat()})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def metrics_allowed(request: Request) -> bool:
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    if METRICS_TOKEN and scheme.lower() == "bearer":
+        return hmac.compare_digest(credentials.encode(), METRICS_TOKEN.encode())
+    # Proxied requests come from loopback too; nginx marks them
+    local = request.client is not None and request.client.host in METRICS_LOOPBACK_HOSTS
+    return not METRICS_TOKEN and local and "x-forwarded-for" not in request.headers
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus text format metrics of every worker (see METRICS_DIR)"""
+    if not metrics_allowed(request):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Metrics are not public")
+    if shared_metrics is not None:
+        content = await asyncio.to_thread(shared_metrics.render)
+    else:
+        content = registry.render()
+    return Response(content=content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_router.get("/status")
+async def get_status():
+    return {"status": "ok", "timestamp": datetime.utcnow().isoformat()}
 
 # Configure logging
 logging.basicConfig(
@@ -844,6 +1406,73 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+# Imported by the functions that use them, so importing server does not load
+# NumPy; the lifespan imports them off the event loop before serving
+DEFERRED_MODULES = ("analytics", "combinations", "distance_matrix", "order_columns", "parallel_search")
+
+def import_deferred_modules():
+    for name in DEFERRED_MODULES:
+        importlib.import_module(name)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A module import holds the GIL but not the loop, so the startup I/O
+    # below proceeds meanwhile
+    deferred_imports = asyncio.create_task(asyncio.to_thread(import_deferred_modules))
+    # Warm the pool before anything else touches MongoDB, so startup work and
+    # the first requests find open connections
+    await warm_up(client, mongo_settings.connections_to_warm)
+    await ensure_indexes(db)
+    # Seed once at startup rather than inside a read request
+    await delivery_app_catalogue.seed(db)
+    await delivery_app_catalogue.refresh(db)
+    if NOTIFICATION_QUEUE:
+        notification_queue.start()
+    change_stream_task = None
+    if EVENTS_SOURCE == "change_streams":
+        change_stream_task = asyncio.create_task(watch_change_streams(db, event_bus))
+    elif EVENTS_SOURCE == "mongo":
+        await event_relay.start()
+    metrics_task = None
+    if shared_metrics is not None:
+        metrics_task = asyncio.create_task(shared_metrics.run())
+    await deferred_imports
+    
+    yield
+    
+    if metrics_task is not None:
+        metrics_task.cancel()
+        await asyncio.gather(metrics_task, return_exceptions=True)
+    if change_stream_task is not None:
+        change_stream_task.cancel()
+    await event_relay.stop()
+    await notification_queue.stop()
     client.close()
+    password_hasher.shutdown()
+    if _combination_search is not None:
+        _combination_search.shutdown()
+
+def create_app():
+    """
+    The ASGI application. Importing this module only defines the routes;
+    MongoDB is first contacted by the lifespan, which also imports the
+    modules behind combinations and analytics (NumPy) in a thread before
+    the app starts serving.
+    """
+    app = FastAPI(title="Mandoob+ API", lifespan=lifespan)
+    app.include_router(api_router)
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
+    )
+    
+    # Outermost, so the latency covers every other middleware too
+    app.add_middleware(MetricsMiddleware, server_timing=SERVER_TIMING)
+    return app
+
+app = create_app()
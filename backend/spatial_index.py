@@ -0,0 +1,91 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from distance_matrix import EARTH_RADIUS_KM, haversine_pairs
+
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+# Forward neighbour cells, so each pair of cells is only visited once
+_FORWARD_CELLS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+
+class GridIndex:
+    """
+    Uniform grid over a set of points, with square cells of `cell_km` side.
+
+    Points are projected onto a local equirectangular plane using the cosine
+    of the highest latitude in the set, which never overstates east-west
+    distances. Any two points within `cell_km` of each other therefore fall
+    in the same or adjacent cells, and a radius query only has to look at
+    neighbouring cells instead of every point.
+    """
+
+    def __init__(self, lat, lon, cell_km):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_km = cell_km
+
+        cos_lat = math.cos(math.radians(float(np.abs(self.lat).max()))) if len(self.lat) else 1.0
+        x = self.lon * KM_PER_DEGREE * max(cos_lat, 1e-6)
+        y = self.lat * KM_PER_DEGREE
+        cells_x = np.floor(x / cell_km).astype(np.int64)
+        cells_y = np.floor(y / cell_km).astype(np.int64)
+
+        self.cells = defaultdict(list)
+        for idx, cell in enumerate(zip(cells_x.tolist(), cells_y.tolist())):
+            self.cells[cell].append(idx)
+        self.cells = {cell: np.array(members, dtype=np.int64) for cell, members in self.cells.items()}
+
+    def pairs_within(self, radius_km):
+        """
+        Return (i, j, distance) arrays for every pair i < j whose Haversine
+        distance is at most radius_km. radius_km must not exceed cell_km.
+        """
+        if radius_km > self.cell_km:
+            raise ValueError("radius_km must not exceed the grid cell size")
+
+        first, second = [], []
+        for (cx, cy), members in self.cells.items():
+            for dx, dy in _FORWARD_CELLS:
+                others = self.cells.get((cx + dx, cy + dy))
+                if others is None:
+                    continue
+                a = np.repeat(members, len(others))
+                b = np.tile(others, len(members))
+                if dx == 0 and dy == 0:
+                    keep = a < b
+                    a, b = a[keep], b[keep]
+                first.append(a)
+                second.append(b)
+
+        if not first:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float64)
+
+        i = np.concatenate(first)
+        j = np.concatenate(second)
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        distance = haversine_pairs(self.lat[i], self.lon[i], self.lat[j], self.lon[j])
+        within = distance <= radius_km
+        i, j, distance = i[within], j[within], distance[within]
+
+        # Deterministic (i, j) order keeps downstream enumeration stable
+        order = np.lexsort((j, i))
+        return i[order], j[order], distance[order]
+
+
+def pickup_neighbours(pickup_lat, pickup_lon, radius_km):
+    """
+    Candidate pickup pairs within radius_km of each other.
+    Returns (pairs, neighbours) where pairs is an (m, 2) array of i < j and
+    neighbours[i] lists every j > i paired with i, in ascending order.
+    """
+    index = GridIndex(pickup_lat, pickup_lon, radius_km)
+    i, j, _ = index.pairs_within(radius_km)
+
+    neighbours = [[] for _ in range(len(index.lat))]
+    for a, b in zip(i.tolist(), j.tolist()):
+        neighbours[a].append(b)
+    return np.stack([i, j], axis=1), neighbours
@@ -4,18 +4,42 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+# One uvicorn worker process per core by default. With more than one, the
+# backend relays push events between workers through MongoDB
+# (EVENTS_SOURCE=mongo) and runs combination searches in threads rather
+# than a process pool per worker.
+WEB_CONCURRENCY=${WEB_CONCURRENCY:-$(nproc)}
+export WEB_CONCURRENCY
+# Workers share their metrics here, so a scrape of any of them reports the
+# totals; values left by a previous run would be added to them
+METRICS_DIR=${METRICS_DIR:-/tmp/mandoob-metrics}
+export METRICS_DIR
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
+READY_TIMEOUT=${READY_TIMEOUT:-60}
+
+echo "Starting FastAPI backend with $WEB_CONCURRENCY workers"
+# Outlive nginx's pooled upstream connections (keepalive_timeout 60s)
+uvicorn server:app --host 127.0.0.1 --port 8001 --workers "$WEB_CONCURRENCY" --timeout-keep-alive 75 &
 BACKEND_PID=$!
 
+# Ready once a worker has finished startup and answers /api/status
 echo "Waiting for backend to start..."
-sleep 30
-
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+waited=0
+until wget -q -O /dev/null http://127.0.0.1:8001/api/status 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$waited" -ge "$READY_TIMEOUT" ]; then
+        echo "Backend not ready after ${READY_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 1
+    waited=$((waited + 1))
+done
+echo "Backend ready after ${waited}s"
 
 # Start Nginx
 nginx -g 'daemon off;' &
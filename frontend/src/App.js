@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { BrowserRouter, Routes, Route, Link, useNavigate, useLocation, useParams } from "react-router-dom";
 import axios from "axios";
 import "./App.css";
@@ -83,6 +83,43 @@ const apiClient = (token) => {
   };
 };
 
+// Subscribe to the backend event stream (/api/events) while mounted
+const useEvents = (token, onEvent) => {
+  // Always call the latest handler without reconnecting on every render
+  const handler = useRef(onEvent);
+  handler.current = onEvent;
+
+  useEffect(() => {
+    if (!token) return;
+    // The token goes in the first message rather than the URL, which
+    // proxies and access logs record
+    const wsUrl = `${API.replace(/^http/, "ws")}/events`;
+    let socket;
+    let retry;
+    let closed = false;
+
+    const connect = () => {
+      socket = new WebSocket(wsUrl);
+      socket.onopen = () => socket.send(JSON.stringify({ type: "auth", token }));
+      socket.onmessage = (message) => {
+        const event = JSON.parse(message.data);
+        if (event.type !== "ping") handler.current(event);
+      };
+      socket.onclose = (event) => {
+        // 1008: the token was rejected or expired, so retrying cannot help
+        if (!closed && event.code !== 1008) retry = setTimeout(connect, 3000);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      socket.close();
+    };
+  }, [token]);
+};
+
 // Components
 function NavBar() {
   const { user, logout } = useAuth();
@@ -648,6 +685,7 @@ function Dashboard() {
   const [deliveryApps, setDeliveryApps] = useState([]);
   const [pendingOrders, setPendingOrders] = useState([]);
   const [combinations, setCombinations] = useState([]);
+  const [analytics, setAnalytics] = useState(null);
   const [loading, setLoading] = useState(true);
   
   useEffect(() => {
@@ -667,6 +705,10 @@ function Dashboard() {
         const combinationsResponse = await api.get(`${API}/combinations`);
         setCombinations(combinationsResponse.data);
         
+        // Fetch the last 30 days of earnings
+        const analyticsResponse = await api.get(`${API}/analytics?days=30`);
+        setAnalytics(analyticsResponse.data);
+        
         setLoading(false);
       } catch (error) {
         console.error("Failed to load dashboard data:", error);
@@ -763,6 +805,47 @@ function Dashboard() {
             )}
           </div>
           
+          {/* Earnings Section */}
+          {analytics && (
+            <div className="md:col-span-2 bg-white rounded-lg shadow-md p-6">
+              <h2 className="text-xl font-semibold mb-4">Last 30 Days</h2>
+              
+              <div className="grid grid-cols-2 md:grid-cols-4 gap-4">
+                <div className="bg-gray-50 rounded p-3">
+                  <p className="text-sm text-gray-600">Completed orders</p>
+                  <p className="text-2xl font-bold">{analytics.totals.completed_orders}</p>
+                </div>
+                <div className="bg-gray-50 rounded p-3">
+                  <p className="text-sm text-gray-600">Earnings</p>
+                  <p className="text-2xl font-bold text-green-700">{analytics.totals.earnings.toFixed(0)} EGP</p>
+                </div>
+                <div className="bg-gray-50 rounded p-3">
+                  <p className="text-sm text-gray-600">Km per order</p>
+                  <p className="text-2xl font-bold">
+                    {analytics.totals.km_per_order === null ? "-" : analytics.totals.km_per_order.toFixed(1)}
+                  </p>
+                </div>
+                <div className="bg-gray-50 rounded p-3">
+                  <p className="text-sm text-gray-600">Km saved by combining</p>
+                  <p className="text-2xl font-bold text-blue-700">{analytics.totals.saved_km.toFixed(1)}</p>
+                </div>
+              </div>
+              
+              {analytics.totals.apps.length > 0 && (
+                <div className="mt-4 space-y-2">
+                  {analytics.totals.apps.map(app => (
+                    <div key={app.app_name} className="flex justify-between text-sm">
+                      <span className="bg-blue-100 text-blue-800 text-xs px-2 py-1 rounded">{app.app_name}</span>
+                      <span className="text-gray-600">
+                        {app.completed_orders} {app.completed_orders === 1 ? 'order' : 'orders'} · {app.earnings.toFixed(0)} EGP
+                      </span>
+                    </div>
+                  ))}
+                </div>
+              )}
+            </div>
+          )}
+          
           {/* Combinations Section */}
           <div className="md:col-span-2 bg-white rounded-lg shadow-md p-6">
             <div className="flex justify-between items-center mb-4">
@@ -933,6 +1016,13 @@ function NotificationsPage() {
     fetchNotifications();
   }, [token]);
   
+  // Notifications parsed while the page is open
+  useEvents(token, (event) => {
+    if (event.type === "notification.created") {
+      setNotifications(current => [event.data, ...current]);
+    }
+  });
+  
   return (
     <div className="container mx-auto px-4 py-8 mb-16">
       <h1 className="text-2xl font-bold mb-6">Notifications</h1>
@@ -1320,6 +1410,19 @@ function OrdersPage() {
     fetchOrders();
   }, [token, statusFilter]);
   
+  // Live updates instead of refetching the list
+  useEvents(token, (event) => {
+    if (event.type === "order.created") {
+      if (statusFilter === "all" || statusFilter === event.data.status) {
+        setOrders(current => [event.data, ...current]);
+      }
+    } else if (event.type === "order.updated") {
+      setOrders(current => current
+        .map(order => order.id === event.data.id ? event.data : order)
+        .filter(order => statusFilter === "all" || order.status === statusFilter));
+    }
+  });
+  
   const getStatusColor = (status) => {
     switch (status) {
       case "pending": return "bg-yellow-100 text-yellow-800";
@@ -1549,6 +1652,33 @@ function CombinationsPage() {
     fetchData();
   }, [token]);
   
+  const refreshCombinations = async () => {
+    try {
+      const api = apiClient(token);
+      const response = await api.get(`${API}/combinations`);
+      setCombinations(response.data);
+    } catch (error) {
+      console.error("Failed to refresh combinations:", error);
+    }
+  };
+  
+  // New or changed orders change which bundles are open
+  useEvents(token, (event) => {
+    if (event.type === "combinations.updated") {
+      refreshCombinations();
+    } else if (event.type === "order.created") {
+      if (event.data.status === "pending") {
+        setPendingOrders(current => [event.data, ...current]);
+      }
+    } else if (event.type === "order.updated") {
+      setPendingOrders(current => [
+        ...(event.data.status === "pending" ? [event.data] : []),
+        ...current.filter(order => order.id !== event.data.id),
+      ]);
+      refreshCombinations();
+    }
+  });
+  
   const generateCombinations = async () => {
     if (pendingOrders.length < 2) {
       alert("You need at least 2 pending orders to generate combinations");
@@ -1575,16 +1705,24 @@ function CombinationsPage() {
       const api = apiClient(token);
       const response = await api.put(`${API}/combinations/${combinationId}/accept`);
       
-      // Update combination in state
-      setCombinations(combinations.map(combo => 
-        combo.id === combinationId ? response.data : combo
-      ));
-      
+      // Update combination in state; open combinations sharing its orders
+      // were invalidated by the server
+      const acceptedIds = new Set(response.data.order_ids);
+      setCombinations(combinations
+        .filter(combo => combo.id === combinationId || combo.is_accepted ||
+          !combo.order_ids.some(orderId => acceptedIds.has(orderId)))
+        .map(combo => combo.id === combinationId ? response.data : combo)
+      );
+
       // Refresh pending orders since some may have been accepted
       const ordersResponse = await api.get(`${API}/orders?status=pending`);
       setPendingOrders(ordersResponse.data);
     } catch (error) {
       console.error("Failed to accept combination:", error);
+      // Already accepted, taken or invalidated: drop the stale combination
+      if (error.response && [404, 409].includes(error.response.status)) {
+        setCombinations(combinations.filter(combo => combo.id !== combinationId));
+      }
     }
   };
   
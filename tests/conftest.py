@@ -0,0 +1,41 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from tests.helpers import sign_up
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server builds its Motor client at import; Motor does not connect until used
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("NOTIFICATION_QUEUE", "false")
+os.environ.setdefault("EVENTS_SOURCE", "local")
+
+
+@pytest.fixture
+def server():
+    """The app module on a fresh mongomock database"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server
+    from benchmarks.harness import use_database
+
+    use_database(server, mongomock_motor.AsyncMongoMockClient()["mandoob_test"])
+    server.user_cache.clear()
+    return server
+
+
+@pytest.fixture
+def client(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def user(client):
+    return sign_up(client)
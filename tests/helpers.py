@@ -0,0 +1,16 @@
+def sign_up(client, username="driver"):
+    """Register a user; returns (user id, auth headers)"""
+    client.post("/api/users", json={
+        "username": username, "email": f"{username}@example.com", "full_name": username.title(), "password": "secret"
+    })
+    token = client.post("/api/token", data={"username": username, "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    return client.get("/api/users/me", headers=headers).json()["id"], headers
+
+
+def insert_orders(client, server, orders):
+    """Store Order models directly, bypassing notification parsing"""
+    for order in orders:
+        # mongomock ignores the partial filter of the one-order-per-notification index
+        order.notification_id = order.notification_id or order.id
+    client.portal.call(server.db.orders.insert_many, [order.dict() for order in orders])
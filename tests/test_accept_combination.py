@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime
+
+from benchmarks.harness import make_orders
+from tests.helpers import insert_orders
+
+EXPIRES_AT = datetime(2030, 1, 1, 12, 0, 0)
+
+
+def generated_combination(client, server, user_id, headers):
+    insert_orders(client, server, make_orders(server, 6, user_id=user_id))
+    combinations = client.post("/api/combinations/generate", headers=headers).json()
+    assert combinations
+    return combinations[0]
+
+
+def find_one(client, collection, query):
+    return client.portal.call(lambda: collection.find_one(query, {"_id": 0}))
+
+
+def test_concurrent_accepts_claim_the_combination_once(server, client, user):
+    user_id, headers = user
+    combo = generated_combination(client, server, user_id, headers)
+
+    async def accept_twice():
+        return await asyncio.gather(
+            server.claim_combination(combo["id"], user_id),
+            server.claim_combination(combo["id"], user_id),
+            return_exceptions=True,
+        )
+
+    outcomes = client.portal.call(accept_twice)
+    accepted = [outcome for outcome in outcomes if isinstance(outcome, dict)]
+    conflicts = [outcome for outcome in outcomes if isinstance(outcome, server.CombinationConflict)]
+    assert len(accepted) == 1 and len(conflicts) == 1
+    assert accepted[0]["is_accepted"] is True
+
+    for order_id in combo["order_ids"]:
+        order = find_one(client, server.db.orders, {"id": order_id})
+        assert order["status"] == "accepted"
+        assert order["combination_id"] == combo["id"]
+
+    # The same through the API: the second accept is a conflict
+    assert client.put(f"/api/combinations/{combo['id']}/accept", headers=headers).status_code == 409
+
+
+def test_accept_is_rolled_back_when_an_order_was_taken(server, client, user):
+    user_id, headers = user
+    combo = generated_combination(client, server, user_id, headers)
+    client.portal.call(server.db.order_combinations.update_one, {"id": combo["id"]}, {"$set": {"expires_at": EXPIRES_AT}})
+    # One order leaves pending without going through the API, so the open
+    # combination is not invalidated and the claim fails halfway
+    taken, *others = combo["order_ids"]
+    client.portal.call(server.db.orders.update_one, {"id": taken}, {"$set": {"status": "in_progress"}})
+
+    response = client.put(f"/api/combinations/{combo['id']}/accept", headers=headers)
+    assert response.status_code == 409
+
+    restored = find_one(client, server.db.order_combinations, {"id": combo["id"]})
+    assert restored["is_accepted"] is False
+    assert restored["expires_at"] == EXPIRES_AT
+    assert "accepted_at" not in restored
+    for order_id in others:
+        order = find_one(client, server.db.orders, {"id": order_id})
+        assert order["status"] == "pending"
+        assert "combination_id" not in order
+    assert find_one(client, server.db.orders, {"id": taken})["status"] == "in_progress"
+
+
+def test_accepting_a_missing_combination_is_not_found(server, client, user):
+    _, headers = user
+    assert client.put("/api/combinations/nope/accept", headers=headers).status_code == 404
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.harness import make_orders
+from tests.helpers import insert_orders
+
+
+def stored_orders(client, server, user_id, payments):
+    orders = make_orders(server, len(payments), user_id=user_id)
+    for order, (app_name, payment) in zip(orders, payments):
+        order.app_name, order.payment_amount = app_name, payment
+    insert_orders(client, server, orders)
+    return orders
+
+
+def set_status(client, headers, order_id, new_status):
+    response = client.put(f"/api/orders/{order_id}/status", json=new_status, headers=headers)
+    assert response.status_code == 200
+
+
+def totals(client, headers, **params):
+    response = client.get("/api/analytics", params=params, headers=headers)
+    assert response.status_code == 200
+    return response.json()["totals"]
+
+
+def test_rollups_follow_orders_in_and_out_of_completed(server, client, user):
+    user_id, headers = user
+    first, second = stored_orders(client, server, user_id, [("Talabat", 80.0), ("Careem", None)])
+
+    set_status(client, headers, first.id, "completed")
+    set_status(client, headers, second.id, "completed")
+    # Completing a completed order again is not counted twice
+    set_status(client, headers, first.id, "completed")
+    completed = totals(client, headers)
+    assert completed["completed_orders"] == 2
+    assert completed["paid_orders"] == 1
+    assert completed["earnings"] == 80.0
+    assert completed["distance_km"] > 0
+    assert {app["app_name"] for app in completed["apps"]} == {"Talabat", "Careem"}
+
+    set_status(client, headers, first.id, "cancelled")
+    set_status(client, headers, second.id, "pending")
+    reverted = totals(client, headers)
+    assert reverted["completed_orders"] == reverted["paid_orders"] == 0
+    assert reverted["earnings"] == 0
+    assert reverted["distance_km"] == pytest.approx(0, abs=0.01)
+    assert reverted["km_per_order"] is None
+
+    set_status(client, headers, first.id, "completed")
+    assert totals(client, headers)["completed_orders"] == 1
+
+
+def test_rollup_of_an_earlier_day_is_taken_back_from_that_day(server, client, user):
+    user_id, headers = user
+    [order] = stored_orders(client, server, user_id, [("Talabat", 50.0)])
+    set_status(client, headers, order.id, "completed")
+    # Completed the day before yesterday, cancelled today
+    earlier = datetime.utcnow() - timedelta(days=2)
+    client.portal.call(server.db.orders.update_one, {"id": order.id}, {"$set": {"completed_at": earlier}})
+    client.portal.call(
+        server.db.daily_order_stats.update_many, {"user_id": user_id},
+        {"$set": {"day": earlier.strftime("%Y-%m-%d")}},
+    )
+
+    set_status(client, headers, order.id, "cancelled")
+    periods = client.get("/api/analytics", headers=headers).json()["periods"]
+    assert [(period["period"], period["completed_orders"]) for period in periods] == [(earlier.strftime("%Y-%m-%d"), 0)]
+
+
+def test_report_is_bucketed_and_counts_accepted_combinations(server, client, user):
+    user_id, headers = user
+    orders = stored_orders(client, server, user_id, [("Talabat", 40.0)] * 4 + [("Careem", 25.5)] * 2)
+    combo = client.post("/api/combinations/generate", headers=headers).json()[0]
+    assert client.put(f"/api/combinations/{combo['id']}/accept", headers=headers).status_code == 200
+    for order in orders:
+        set_status(client, headers, order.id, "completed")
+
+    by_day = client.get("/api/analytics", params={"days": 7}, headers=headers).json()
+    today = datetime.utcnow()
+    assert by_day["bucket"] == "day"
+    assert by_day["since"] == (today - timedelta(days=6)).strftime("%Y-%m-%d")
+    [period] = by_day["periods"]
+    assert period["period"] == today.strftime("%Y-%m-%d")
+    assert period["completed_orders"] == 6
+    assert period["earnings"] == 211.0
+    assert [(app["app_name"], app["earnings"]) for app in period["apps"]] == [("Talabat", 160.0), ("Careem", 51.0)]
+    assert period["accepted_combinations"] == 1
+    assert period["combined_orders"] == len(combo["order_ids"])
+    assert period["route_km"] == pytest.approx(combo["total_distance"], abs=0.01)
+    assert period["saved_km"] > 0
+    assert by_day["totals"]["earnings"] == 211.0
+
+    by_month = client.get("/api/analytics", params={"bucket": "month"}, headers=headers).json()
+    assert [period["period"] for period in by_month["periods"]] == [today.strftime("%Y-%m")]
+    assert client.get("/api/analytics", params={"bucket": "week"}, headers=headers).status_code == 422
+
+
+def test_report_only_covers_the_caller(server, client, user):
+    import analytics
+
+    _, headers = user
+    [order] = make_orders(server, 1, user_id="someone-else")
+    client.portal.call(analytics.record_order_completion, server.db, order.dict(), datetime.utcnow())
+    assert totals(client, headers)["completed_orders"] == 0
@@ -0,0 +1,89 @@
+from benchmarks.harness import make_orders
+from combinations import search_candidates
+from tests.helpers import insert_orders
+
+
+def open_combinations(client, server, user_id):
+    return client.portal.call(
+        lambda: server.db.order_combinations.find({"user_id": user_id, "is_accepted": False}, {"_id": 0}).to_list(None)
+    )
+
+
+def test_incremental_pool_does_not_expire(server, client, user):
+    user_id, headers = user
+    insert_orders(client, server, make_orders(server, 6, user_id=user_id))
+
+    assert client.post("/api/combinations/generate", headers=headers).status_code == 200
+    stored = open_combinations(client, server, user_id)
+    assert stored
+    assert all(combo["expires_at"] is None for combo in stored)
+
+
+def count_rebuilds(server, monkeypatch):
+    rebuilds = []
+    rebuild = server.rebuild_combination_pool
+
+    async def counted(*args, **kwargs):
+        rebuilds.append(args[0])
+        return await rebuild(*args, **kwargs)
+
+    monkeypatch.setattr(server, "rebuild_combination_pool", counted)
+    return rebuilds
+
+
+def test_trimmed_pool_is_rebuilt_once_invalidation_leaves_it_short(server, client, user, monkeypatch):
+    monkeypatch.setattr(server, "COMBINATION_POOL_SIZE", 6)
+    user_id, headers = user
+    insert_orders(client, server, make_orders(server, 40, neighbours=12, user_id=user_id))
+    client.post("/api/combinations/generate", headers=headers)
+    assert len(open_combinations(client, server, user_id)) == 6
+    rebuilds = count_rebuilds(server, monkeypatch)
+
+    # Taking the orders of the best bundles invalidates most of the pool,
+    # and the status update that leaves it short refills it
+    taken = set()
+    for combo in sorted(open_combinations(client, server, user_id), key=lambda combo: -combo["savings_percentage"])[:3]:
+        for order_id in combo["order_ids"]:
+            if order_id not in taken:
+                taken.add(order_id)
+                client.put(f"/api/orders/{order_id}/status", json="in_progress", headers=headers)
+    assert rebuilds
+
+    rebuilds.clear()
+    listed = client.get("/api/combinations", headers=headers).json()
+    assert rebuilds == []
+    assert len(listed) == 6
+    assert not taken & {order_id for combo in listed for order_id in combo["order_ids"]}
+    # The best bundles of the orders still pending, as a full search finds them
+    pending = client.portal.call(server.load_pending_orders, user_id)
+    best = search_candidates(pending, top_k=6)
+    assert [combo["order_ids"] for combo in listed] == [[pending.ids[idx] for idx in candidate.indices] for candidate in best]
+
+
+def test_complete_pool_is_not_rebuilt(server, client, user, monkeypatch):
+    user_id, headers = user
+    orders = make_orders(server, 6, user_id=user_id)
+    insert_orders(client, server, orders)
+    client.post("/api/combinations/generate", headers=headers)
+    rebuilds = count_rebuilds(server, monkeypatch)
+
+    # Listing never writes or rebuilds
+    for _ in range(3):
+        assert client.get("/api/combinations", headers=headers).status_code == 200
+    # Nothing was cut from this pool, so invalidation leaves nothing to add back
+    client.put(f"/api/orders/{orders[0].id}/status", json="in_progress", headers=headers)
+    assert rebuilds == []
+
+
+def test_orders_added_one_by_one_do_not_duplicate_their_bundles(server, client, user):
+    user_id, _ = user
+    orders = make_orders(server, 6, user_id=user_id)
+    # Every order is stored before any add runs, as when two queue workers
+    # finish their batches at once
+    insert_orders(client, server, orders)
+    for order in orders:
+        client.portal.call(server.after_notification_batch, user_id, [order.id])
+
+    bundles = [tuple(sorted(combo["order_ids"])) for combo in open_combinations(client, server, user_id)]
+    assert bundles
+    assert len(bundles) == len(set(bundles))
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.harness import make_orders
+from combinations import Candidate, best_first, evaluate_bundle, keep_best, merge_candidates, search_candidates
+from distance_matrix import DistanceMatrix
+from order_columns import OrderColumns
+from tests.helpers import insert_orders
+
+ZAMALEK = (30.0609, 31.2197)
+DOKKI = (30.0384, 31.2123)
+
+
+def columns(*orders):
+    """OrderColumns of (pickup, dropoff) coordinate pairs"""
+    return OrderColumns(
+        [f"order-{idx}" for idx in range(len(orders))],
+        [pickup[0] for pickup, _ in orders],
+        [pickup[1] for pickup, _ in orders],
+        [dropoff[0] for _, dropoff in orders],
+        [dropoff[1] for _, dropoff in orders],
+    )
+
+
+def test_coincident_orders_are_not_bundled():
+    orders = columns((ZAMALEK, ZAMALEK), (ZAMALEK, ZAMALEK))
+    distances = DistanceMatrix.from_columns(orders)
+
+    assert evaluate_bundle((0, 1), distances) is None
+    assert search_candidates(orders) == []
+
+
+def test_zero_length_order_next_to_a_real_one():
+    # Only the pair's total direct distance has to be positive
+    orders = columns((ZAMALEK, ZAMALEK), (ZAMALEK, DOKKI), (DOKKI, DOKKI))
+    candidates = search_candidates(orders)
+
+    assert candidates
+    for candidate in candidates:
+        assert 0 <= candidate.savings_percentage <= 100
+        assert sorted(candidate.stops) == list(range(2 * len(candidate.indices)))
+
+
+def test_bundles_with_shared_dropoff_save_distance():
+    orders = columns(((30.0600, 31.2200), DOKKI), ((30.0610, 31.2190), DOKKI))
+    (candidate,) = search_candidates(orders)
+
+    assert candidate.indices == (0, 1)
+    assert candidate.savings_percentage > 40
+
+
+def candidate(indices, savings):
+    return Candidate(indices, 1.0, 5, savings, list(range(2 * len(indices))))
+
+
+def test_heap_keeps_the_best_and_prefers_earlier_bundles_on_ties():
+    heap = []
+    entries = [(10.0, -1, "a"), (30.0, -2, "b"), (20.0, -3, "c"), (30.0, -4, "d"), (5.0, -5, "e")]
+    for entry in entries:
+        keep_best(heap, entry, top_k=3)
+    assert best_first(heap) == ["b", "d", "c"]
+
+
+def test_partitions_merge_best_first():
+    first = [candidate((0, 3), 40.0), candidate((1, 2), 10.0)]
+    second = [candidate((4, 5), 40.0), candidate((4, 6), 25.0)]
+    merged = merge_candidates([second, first], n=7, top_k=3)
+    assert [c.indices for c in merged] == [(0, 3), (4, 5), (4, 6)]
+
+
+def test_top_k_search_is_the_head_of_the_full_search(server):
+    orders = OrderColumns.from_orders(make_orders(server, 40))
+    everything = search_candidates(orders)
+    assert len(everything) > 5
+    assert search_candidates(orders, top_k=5) == everything[:5]
+    assert [c.savings_percentage for c in everything] == sorted((c.savings_percentage for c in everything), reverse=True)
+
+
+def stored_combinations(client, server, user_id):
+    return client.portal.call(
+        lambda: server.db.order_combinations.find({"user_id": user_id}, {"_id": 0}).to_list(None)
+    )
+
+
+@pytest.fixture
+def snapshot_mode(server, monkeypatch):
+    """Combinations generated on request only, outside incremental mode"""
+    monkeypatch.setattr(server, "INCREMENTAL_COMBINATIONS", False)
+    monkeypatch.setattr(server, "COMBINATION_TOP_K", 3)
+
+
+def test_generate_stores_only_the_top_k_with_an_expiry(server, client, user, snapshot_mode):
+    user_id, headers = user
+    insert_orders(client, server, make_orders(server, 40, user_id=user_id))
+
+    generated = client.post("/api/combinations/generate", headers=headers).json()
+    assert len(generated) == 3
+    stored = stored_combinations(client, server, user_id)
+    assert {combo["id"] for combo in stored} == {combo["id"] for combo in generated}
+    expected = datetime.utcnow() + timedelta(seconds=server.COMBINATION_TTL_SECONDS)
+    for combo in stored:
+        assert abs(combo["expires_at"] - expected) < timedelta(minutes=1)
+
+    # Generating again replaces the open ones instead of adding to them
+    client.post("/api/combinations/generate", headers=headers)
+    assert len(stored_combinations(client, server, user_id)) == 3
+
+
+def test_accepted_combinations_outlive_the_snapshot(server, client, user, snapshot_mode, monkeypatch):
+    user_id, headers = user
+    insert_orders(client, server, make_orders(server, 40, user_id=user_id))
+    accepted = client.post("/api/combinations/generate", headers=headers).json()[0]
+    client.put(f"/api/combinations/{accepted['id']}/accept", headers=headers)
+
+    monkeypatch.setattr(server, "COMBINATION_TTL_SECONDS", 0)
+    client.post("/api/combinations/generate", headers=headers)
+    stored = {combo["id"]: combo for combo in stored_combinations(client, server, user_id)}
+    assert stored[accepted["id"]]["is_accepted"] is True
+    assert "expires_at" not in stored[accepted["id"]]
+    assert all(combo["expires_at"] is None for combo in stored.values() if not combo["is_accepted"])
@@ -0,0 +1,121 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import database
+from database import MongoSettings, create_client, settings_from_env, warm_up
+from metrics import MONGO_CHECKOUT_WAIT_SECONDS, MONGO_COMMAND_SECONDS, MongoCommandListener, MongoPoolListener
+
+URL = "mongodb://localhost:27017"
+
+
+def observations(histogram, *labels):
+    return sum(series[-1] for label_values, series in histogram.state() if label_values == list(labels))
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    for variable in database.ENVIRONMENT.values():
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setenv("MONGO_URL", URL)
+    return monkeypatch
+
+
+def test_settings_are_read_from_the_environment(environment):
+    environment.setenv("MONGO_MAX_POOL_SIZE", "20")
+    environment.setenv("MONGO_COMPRESSORS", "zlib, ")
+    environment.setenv("MONGO_WRITE_CONCERN", "2")
+    environment.setenv("MONGO_JOURNAL", "true")
+    environment.setenv("MONGO_SOCKET_TIMEOUT_MS", "")
+    options = settings_from_env().client_options()
+
+    assert options["maxPoolSize"] == 20 and options["minPoolSize"] == 4
+    assert options["compressors"] == "zlib"
+    assert options["w"] == 2 and options["journal"] is True
+    # Unset options are left to the driver
+    assert "socketTimeoutMS" not in options and "waitQueueTimeoutMS" not in options
+
+
+def test_options_in_the_url_win():
+    options = MongoSettings(url=f"{URL}/?maxpoolsize=7&w=majority", write_concern="1").client_options()
+    assert "maxPoolSize" not in options and "w" not in options
+    assert options["readPreference"] == "primary"
+
+
+@pytest.mark.parametrize("settings", [
+    {"min_pool_size": 10, "max_pool_size": 5},
+    {"warm_connections": 60},
+    {"read_preference": "fastest"},
+    {"write_concern": "all"},
+    {"compressors": ["lz4"]},
+    {"max_pool_size": 0},
+])
+def test_invalid_settings_fail_at_startup(settings):
+    with pytest.raises(ValueError):
+        MongoSettings(url=URL, **settings)
+
+
+def test_compressor_without_its_package_is_rejected(monkeypatch):
+    monkeypatch.setattr(database.importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(ValueError, match="needs the zstandard package"):
+        MongoSettings(url=URL, compressors=["zstd"])
+
+
+def test_client_is_built_from_the_settings_without_connecting():
+    listener = MongoPoolListener()
+    settings = MongoSettings(url=URL, max_pool_size=12, min_pool_size=0, app_name="tests")
+    client = create_client(settings, [listener])
+    try:
+        options = client.delegate.options
+        assert options.pool_options.max_pool_size == 12
+        assert options.pool_options.metadata["application"]["name"] == "tests"
+        assert listener in options.event_listeners
+    finally:
+        client.close()
+    assert settings.connections_to_warm == 0
+    assert MongoSettings(url=URL, warm_connections=3).connections_to_warm == 3
+
+
+def test_warm_up_opens_the_connections_at_once():
+    in_flight = []
+    peak = []
+
+    class Admin:
+        async def command(self, name):
+            in_flight.append(name)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+
+    client = SimpleNamespace(admin=Admin())
+    assert asyncio.run(warm_up(client, 4)) >= 0.01
+    assert max(peak) == 4
+    asyncio.run(warm_up(client, 0))
+    assert len(peak) == 4
+
+
+def test_pool_listener_counts_connections_and_checkout_waits():
+    listener = MongoPoolListener()
+    waited = observations(MONGO_CHECKOUT_WAIT_SECONDS, "success")
+    timed_out = observations(MONGO_CHECKOUT_WAIT_SECONDS, "timeout")
+
+    for _ in range(2):
+        listener.connection_created(None)
+        listener.connection_check_out_started(None)
+        listener.connection_checked_out(None)
+    listener.connection_checked_in(None)
+    listener.connection_check_out_started(None)
+    listener.connection_check_out_failed(SimpleNamespace(reason="timeout"))
+    listener.connection_closed(None)
+
+    assert (listener.open_connections, listener.in_use) == (1, 1)
+    assert observations(MONGO_CHECKOUT_WAIT_SECONDS, "success") == waited + 2
+    assert observations(MONGO_CHECKOUT_WAIT_SECONDS, "timeout") == timed_out + 1
+
+
+def test_command_listener_records_latency_per_command():
+    listener = MongoCommandListener()
+    before = observations(MONGO_COMMAND_SECONDS, "find", "failure")
+    listener.failed(SimpleNamespace(duration_micros=1500, command_name="find"))
+    assert observations(MONGO_COMMAND_SECONDS, "find", "failure") == before + 1
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+from delivery_apps import DEFAULT_DELIVERY_APPS
+
+
+def get_apps(client, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get("/api/delivery-apps", headers=headers)
+
+
+def add_app(client, server, name):
+    client.portal.call(server.db.delivery_apps.insert_one, {
+        "id": f"{name.lower()}-id", "name": name, "logo_url": None, "is_active": True, "created_at": datetime.utcnow(),
+    })
+
+
+def test_catalogue_is_revalidated_with_its_etag(client):
+    first = get_apps(client)
+    assert first.status_code == 200
+    assert [app["name"] for app in first.json()] == [app["name"] for app in DEFAULT_DELIVERY_APPS]
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"].startswith("public, max-age=")
+
+    for if_none_match in (etag, f'"other", {etag}', "*"):
+        not_modified = get_apps(client, if_none_match)
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["ETag"] == etag
+    assert get_apps(client, '"other"').status_code == 200
+
+
+def test_etag_changes_when_the_apps_do(server, client):
+    before = server.delivery_app_catalogue.snapshot
+    etag = get_apps(client).headers["ETag"]
+
+    # Reloading unchanged apps keeps the version, so clients keep their 304s
+    assert client.portal.call(server.delivery_app_catalogue.refresh, server.db) == before
+    add_app(client, server, "Mrsool")
+    after = client.portal.call(server.delivery_app_catalogue.refresh, server.db)
+    assert after.version == before.version + 1
+
+    response = get_apps(client, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] == after.etag != etag
+    assert "Mrsool" in [app["name"] for app in response.json()]
+
+
+def test_stale_snapshot_is_reloaded_by_the_next_request(server, client, user, monkeypatch):
+    _, headers = user
+    add_app(client, server, "Mrsool")
+    notification = {"app_name": "Mrsool", "title": "New order", "content": "Pickup from Tahrir Square, deliver to Zamalek"}
+    assert client.post("/api/notifications/simulate", json=notification, headers=headers).status_code == 400
+
+    monkeypatch.setattr(server.delivery_app_catalogue, "refresh_seconds", 0)
+    assert client.post("/api/notifications/simulate", json=notification, headers=headers).status_code == 200
+
+
+def test_seeding_again_keeps_the_apps(server, client):
+    before = {app["name"]: app["id"] for app in get_apps(client).json()}
+
+    async def seed_twice():
+        await asyncio.gather(*(server.delivery_app_catalogue.seed(server.db) for _ in range(2)))
+
+    client.portal.call(seed_twice)
+    stored = client.portal.call(lambda: server.db.delivery_apps.find({}, {"_id": 0}).to_list(None))
+    assert {app["name"]: app["id"] for app in stored} == before
@@ -0,0 +1,151 @@
+import time
+from datetime import timedelta
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from benchmarks.harness import make_orders
+from tests.helpers import insert_orders, sign_up
+
+POLICY_VIOLATION = 1008
+
+
+def token_for(server, username, seconds):
+    return server.create_access_token(data={"sub": username}, expires_delta=timedelta(seconds=seconds))
+
+
+def publish(client, server, user_id, event_type, data):
+    client.portal.call(server.publish_event, user_id, event_type, data)
+
+
+def assert_closed_by_server(websocket, code=POLICY_VIOLATION):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        websocket.receive_json()
+    assert closed.value.code == code
+
+
+def test_stream_is_authenticated_by_the_first_message(server, client, user):
+    user_id, headers = user
+    token = headers["Authorization"].split()[1]
+
+    with client.websocket_connect("/api/events") as websocket:
+        websocket.send_json({"type": "auth", "token": token})
+        # The subscription is made once the auth message is handled
+        deadline = time.monotonic() + 5
+        while server.event_bus.subscriber_count() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        publish(client, server, user_id, "order.created", {"id": "order-1"})
+        event = websocket.receive_json()
+    assert event["type"] == "order.created"
+    assert event["data"] == {"id": "order-1"}
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "auth", "token": "not-a-jwt"},
+    {"type": "subscribe"},
+    {"token": None},
+])
+def test_invalid_auth_message_closes_the_stream(client, message):
+    with client.websocket_connect("/api/events") as websocket:
+        websocket.send_json(message)
+        assert_closed_by_server(websocket)
+
+
+def test_token_in_the_url_is_not_accepted(server, client, user, monkeypatch):
+    monkeypatch.setattr(server, "EVENT_AUTH_TIMEOUT_SECONDS", 0.2)
+    token = user[1]["Authorization"].split()[1]
+
+    with client.websocket_connect(f"/api/events?token={token}") as websocket:
+        assert_closed_by_server(websocket)
+
+
+def test_stream_is_closed_when_the_token_expires(server, client, user):
+    token = token_for(server, "driver", seconds=1)
+
+    with client.websocket_connect("/api/events") as websocket:
+        websocket.send_json({"type": "auth", "token": token})
+        started = time.monotonic()
+        assert_closed_by_server(websocket)
+    assert time.monotonic() - started < server.EVENT_HEARTBEAT_SECONDS
+
+
+def test_renewed_token_keeps_the_stream_open(server, client, user):
+    user_id, _ = user
+
+    with client.websocket_connect("/api/events") as websocket:
+        websocket.send_json({"type": "auth", "token": token_for(server, "driver", seconds=1)})
+        websocket.send_json({"type": "auth", "token": token_for(server, "driver", seconds=600)})
+        time.sleep(1.5)
+        publish(client, server, user_id, "order.updated", {"id": "order-2"})
+        assert websocket.receive_json()["type"] == "order.updated"
+
+
+def test_token_of_another_user_closes_the_stream(server, client, user):
+    _, other_headers = sign_up(client, "other")
+    with client.websocket_connect("/api/events") as websocket:
+        websocket.send_json({"type": "auth", "token": token_for(server, "driver", seconds=600)})
+        websocket.send_json({"type": "auth", "token": other_headers["Authorization"].split()[1]})
+        assert_closed_by_server(websocket)
+
+
+@pytest.fixture
+def published(server, monkeypatch):
+    """Every event the app publishes, as (user_id, type, data)"""
+    events = []
+    publish_event = server.publish_event
+
+    def recorded(user_id, event_type, data):
+        events.append((user_id, event_type, data))
+        publish_event(user_id, event_type, data)
+
+    monkeypatch.setattr(server, "publish_event", recorded)
+    return events
+
+
+def batch_of(*app_names):
+    return {"notifications": [
+        {"app_name": app_name, "title": "New order", "content": f"Pickup from KFC Tahrir Square, deliver to Zamalek {idx}"}
+        for idx, app_name in enumerate(app_names)
+    ]}
+
+
+def test_batch_notifications_reach_live_clients(server, client, user):
+    _, headers = user
+    token = headers["Authorization"].split()[1]
+
+    with client.websocket_connect("/api/events") as websocket:
+        websocket.send_json({"type": "auth", "token": token})
+        deadline = time.monotonic() + 5
+        while server.event_bus.subscriber_count() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        result = client.post("/api/notifications/batch", json=batch_of("Talabat", "Nowhere App", "Careem"), headers=headers).json()
+        expected = {("notification.created", item["notification_id"]) for item in result["results"] if item.get("notification_id")}
+        expected |= {("order.created", item["order_id"]) for item in result["results"] if item.get("order_id")}
+        received = set()
+        while not expected <= received:
+            event = websocket.receive_json()
+            if event["type"] in ("notification.created", "order.created"):
+                received.add((event["type"], event["data"]["id"]))
+    assert len([kind for kind, _ in expected if kind == "notification.created"]) == 2
+    assert result["orders_created"] == len(expected) - 2 > 0
+
+
+def test_accepting_a_combination_updates_other_views(server, client, user, published):
+    user_id, headers = user
+    insert_orders(client, server, make_orders(server, 6, user_id=user_id))
+    combo = client.post("/api/combinations/generate", headers=headers).json()[0]
+    published.clear()
+
+    assert client.put(f"/api/combinations/{combo['id']}/accept", headers=headers).status_code == 200
+
+    updated = {data["id"]: data for _, event_type, data in published if event_type == "order.updated"}
+    assert set(updated) == set(combo["order_ids"])
+    assert all(order["status"] == "accepted" for order in updated.values())
+    [(_, _, open_combinations)] = [event for event in published if event[1] == "combinations.updated"]
+    still_open = {order_id for other in open_combinations for order_id in _field(other, "order_ids")}
+    assert not still_open & set(combo["order_ids"])
+    assert all(recipient == user_id for recipient, _, _ in published)
+
+
+def _field(document, name):
+    return document[name] if isinstance(document, dict) else getattr(document, name)
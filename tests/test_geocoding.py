@@ -0,0 +1,75 @@
+import asyncio
+import math
+
+import pytest
+
+from geocoding import (
+    SPREAD_DEGREES, CachedGeocoder, GazetteerGeocoder, GeocodeResult, Geocoder, geocoder_from_env, load_fallback, spread
+)
+
+UNKNOWN = ["Nowhere Street 12", "Unmapped Alley 7"]
+
+
+def test_spread_is_deterministic_and_bounded():
+    district = GeocodeResult(30.06, 31.22, "district", "Zamalek")
+    first, second = spread(district, "zamalek 26 july"), spread(district, "zamalek brazil")
+
+    assert spread(district, "zamalek 26 july") == first
+    assert (first.latitude, first.longitude) != (second.latitude, second.longitude)
+    for moved in (first, second):
+        assert abs(moved.latitude - district.latitude) <= SPREAD_DEGREES["district"]
+        assert abs(moved.longitude - district.longitude) <= SPREAD_DEGREES["district"]
+        assert moved.precision == "district" and moved.match == "Zamalek"
+
+    landmark = GeocodeResult(30.04, 31.23, "landmark", "Tahrir Square")
+    assert spread(landmark, "tahrir square") == landmark
+
+
+def test_unresolved_addresses_do_not_share_the_fallback_point():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    collection = mongomock_motor.AsyncMongoMockClient()["geocoding"]["geocode_cache"]
+    fallback = load_fallback()
+    geocoder = CachedGeocoder(GazetteerGeocoder.load(), collection, fallback)
+
+    located = asyncio.run(geocoder.geocode_many(UNKNOWN))
+    points = {(result.latitude, result.longitude) for result in located.values()}
+    assert len(points) == 2
+    for result in located.values():
+        assert result.precision == "city"
+        assert math.dist((result.latitude, result.longitude), (fallback.latitude, fallback.longitude)) <= SPREAD_DEGREES["city"] * math.sqrt(2)
+
+    # Served again from memory, in the same place
+    assert asyncio.run(geocoder.geocode_many(UNKNOWN)) == located
+
+
+@pytest.mark.parametrize("dropoffs", [UNKNOWN, [UNKNOWN[0], UNKNOWN[0]]], ids=["distinct", "same-as-pickup"])
+def test_orders_on_low_precision_points_can_be_combined(server, client, user, dropoffs):
+    _, headers = user
+    # Without the spread every unresolved address lands on the fallback, and
+    # an order picked up and dropped off at one address has no length
+    for pickup, dropoff in zip([UNKNOWN[0], UNKNOWN[0]], dropoffs):
+        response = client.post("/api/notifications/simulate", json={
+            "app_name": "Talabat",
+            "title": "New order",
+            "content": f"Pickup from {pickup}, deliver to {dropoff}, amount 50 EGP",
+        }, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["is_processed"]
+
+    response = client.post("/api/combinations/generate", headers=headers)
+    assert response.status_code == 200
+    for combo in response.json():
+        assert math.isfinite(combo["savings_percentage"])
+    assert client.get("/api/combinations", headers=headers).status_code == 200
+
+
+def test_geocoders_must_implement_geocode_many(monkeypatch):
+    class Incomplete(Geocoder):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+    monkeypatch.setenv("GEOCODER", "geocoding:CachedGeocoder")
+    with pytest.raises(TypeError, match="not a geocoding.Geocoder"):
+        geocoder_from_env(collection=None)
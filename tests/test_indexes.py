@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+import pytest
+
+from indexes import INDEXES, QUERY_SHAPES, audit_query_shapes, ensure_indexes
+
+
+def index_names(client, collection):
+    return set(client.portal.call(collection.index_information))
+
+
+def test_indexes_are_created_once_per_declaration(server, client):
+    # The lifespan already ran ensure_indexes; running it again changes nothing
+    before = {name: index_names(client, server.db[name]) for name in INDEXES}
+    client.portal.call(ensure_indexes, server.db)
+    for name, indexes in INDEXES.items():
+        declared = {index.document["name"] for index in indexes}
+        assert declared <= before[name]
+        assert index_names(client, server.db[name]) == before[name]
+
+
+def test_index_over_duplicates_does_not_stop_startup(server, client, caplog):
+    client.portal.call(server.db.users.drop_indexes)
+    client.portal.call(server.db.users.insert_many, [
+        {"id": "u1", "username": "twin", "email": "a@example.com"},
+        {"id": "u2", "username": "twin", "email": "b@example.com"},
+    ])
+    with caplog.at_level(logging.ERROR, logger="indexes"):
+        client.portal.call(ensure_indexes, server.db)
+    assert "Could not create indexes on users" in caplog.text
+    # The other collections were still indexed
+    assert "user_created_id" in index_names(client, server.db.orders)
+
+
+@pytest.mark.parametrize("route, collection, query, sort", QUERY_SHAPES, ids=[shape[0] for shape in QUERY_SHAPES])
+def test_every_query_shape_leads_with_an_indexed_field(route, collection, query, sort):
+    # What explain() checks against a real mongod: some declared index on the
+    # collection starts with a field the query filters on
+    leading = {next(iter(index.document["key"])) for index in INDEXES[collection]}
+    assert leading & set(query), f"{route} filters on {sorted(query)}, indexes lead with {sorted(leading)}"
+
+
+def test_audit_reports_collection_scans():
+    class Cursor:
+        def __init__(self, collection):
+            self.collection = collection
+
+        def sort(self, sort):
+            return self
+
+        async def explain(self):
+            if self.collection == "orders":
+                stage = {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}
+            else:
+                stage = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+            return {"queryPlanner": {"winningPlan": stage}}
+
+    class Collection:
+        def __init__(self, name):
+            self.name = name
+
+        def find(self, query):
+            return Cursor(self.name)
+
+    class Database:
+        def __getitem__(self, name):
+            return Collection(name)
+
+    failures = asyncio.run(audit_query_shapes(Database()))
+    assert {route for route, _, _ in failures} == {route for route, collection, _, _ in QUERY_SHAPES if collection == "orders"}
+    assert all(stages == ["SORT", "COLLSCAN"] for _, _, stages in failures)
+
+
+def test_concurrent_sign_ups_register_a_username_once(server, client):
+    async def sign_up_twice():
+        return await asyncio.gather(*(
+            server.create_user(server.UserCreate(
+                username="twin", email=f"twin{idx}@example.com", full_name="Twin", password="secret"
+            ))
+            for idx in range(2)
+        ), return_exceptions=True)
+
+    outcomes = client.portal.call(sign_up_twice)
+    rejected = [outcome for outcome in outcomes if isinstance(outcome, server.HTTPException)]
+    assert len(rejected) == 1 and rejected[0].status_code == 400
+    assert rejected[0].detail == "Username already registered"
+    assert client.portal.call(server.db.users.count_documents, {"username": "twin"}) == 1
@@ -0,0 +1,89 @@
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from metrics import MultiprocessMetrics, Registry
+
+
+def request_from(host, authorization=None, forwarded_for=None):
+    headers = [(b"authorization", authorization.encode())] if authorization else []
+    if forwarded_for:
+        headers.append((b"x-forwarded-for", forwarded_for.encode()))
+    return Request({"type": "http", "method": "GET", "path": "/api/metrics", "headers": headers, "client": (host, 50000)})
+
+
+def test_metrics_are_not_public(server, client):
+    # TestClient requests come from the host "testclient", not loopback
+    assert client.get("/api/metrics").status_code == 403
+
+
+def test_metrics_are_readable_from_this_host(server):
+    assert server.metrics_allowed(request_from("127.0.0.1"))
+    assert server.metrics_allowed(request_from("::1"))
+    assert not server.metrics_allowed(request_from("203.0.113.7"))
+    # Through nginx the peer is loopback too
+    assert not server.metrics_allowed(request_from("127.0.0.1", forwarded_for="203.0.113.7"))
+
+
+def test_metrics_token(server, client, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-secret")
+
+    assert client.get("/api/metrics").status_code == 403
+    assert client.get("/api/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = client.get("/api/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert "mandoob_http_requests_total" in response.text
+    # With a token configured, loopback alone is not enough
+    assert not server.metrics_allowed(request_from("127.0.0.1"))
+    assert server.metrics_allowed(request_from("127.0.0.1", "Bearer scrape-secret", forwarded_for="203.0.113.7"))
+
+
+def worker_registry(requests, open_connections):
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ("route",))
+    histogram = registry.histogram("request_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    registry.gauge("connections_open", "Open connections", lambda: open_connections)
+    for seconds in requests:
+        counter.inc("/api/orders")
+        histogram.observe(seconds, "/api/orders")
+    return registry
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_workers_report_their_combined_metrics(tmp_path):
+    this = MultiprocessMetrics(worker_registry([0.05, 2.0], open_connections=3), tmp_path)
+    other = MultiprocessMetrics(worker_registry([0.5], open_connections=4), tmp_path, pid=exited_pid())
+    other.write()
+
+    lines = set(this.render().splitlines())
+    assert 'requests_total{route="/api/orders"} 3' in lines
+    assert 'request_seconds_bucket{route="/api/orders",le="0.1"} 1' in lines
+    assert 'request_seconds_bucket{route="/api/orders",le="1.0"} 2' in lines
+    assert 'request_seconds_bucket{route="/api/orders",le="+Inf"} 3' in lines
+    assert 'request_seconds_sum{route="/api/orders"} 2.55' in lines
+    # The other worker exited: its requests still count, its connections do not
+    assert "connections_open 3" in lines
+
+
+def test_scrape_reads_the_shared_directory(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "shared_metrics", MultiprocessMetrics(server.registry, tmp_path))
+    monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-secret")
+    # Another worker that served one request
+    other_registry = Registry()
+    other_registry.counter("mandoob_http_requests_total", "Requests", ("method", "route", "status")).inc(
+        "GET", "/api/other-worker", "200"
+    )
+    MultiprocessMetrics(other_registry, tmp_path, pid=exited_pid()).write()
+
+    with TestClient(server.app) as client:
+        response = client.get("/api/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert 'mandoob_http_requests_total{method="GET",route="/api/other-worker",status="200"} 1' in response.text
+    assert (tmp_path / f"{server.shared_metrics.pid}.json").exists()
@@ -0,0 +1,77 @@
+ORDER = "Pickup from KFC Tahrir Square, deliver to Zamalek {}"
+
+
+def item(app_name, content):
+    return {"app_name": app_name, "title": "New order", "content": content}
+
+
+def stored(client, collection):
+    return client.portal.call(lambda: collection.find({}, {"_id": 0}).to_list(None))
+
+
+def test_batch_reports_each_item_and_stores_the_rest(server, client, user):
+    user_id, headers = user
+    response = client.post("/api/notifications/batch", json={"notifications": [
+        item("Talabat", ORDER.format(1)),
+        item("Nowhere App", ORDER.format(2)),
+        item("Careem", "How was your last trip?"),
+        item("Careem", ORDER.format(3)),
+    ]}, headers=headers)
+    assert response.status_code == 200
+    batch = response.json()
+    assert (batch["received"], batch["stored"], batch["orders_created"], batch["queued"]) == (4, 3, 2, 0)
+
+    parsed, unknown, unparsed, second = batch["results"]
+    assert [result["index"] for result in batch["results"]] == [0, 1, 2, 3]
+    assert unknown == {
+        "index": 1, "notification_id": None, "order_id": None, "is_processed": False,
+        "error": "Delivery app Nowhere App not found",
+    }
+    # Content without an order is stored unprocessed, not reported as an error
+    assert unparsed["notification_id"] and unparsed["order_id"] is None
+    assert not unparsed["is_processed"] and unparsed["error"] is None
+
+    notifications = {doc["id"]: doc for doc in stored(client, server.db.notifications)}
+    assert set(notifications) == {parsed["notification_id"], unparsed["notification_id"], second["notification_id"]}
+    assert notifications[parsed["notification_id"]]["is_processed"] is True
+    assert notifications[unparsed["notification_id"]]["is_processed"] is False
+    orders = {doc["id"]: doc for doc in stored(client, server.db.orders)}
+    assert set(orders) == {parsed["order_id"], second["order_id"]}
+    assert orders[second["order_id"]]["notification_id"] == second["notification_id"]
+    assert all(order["user_id"] == user_id for order in orders.values())
+
+
+def test_batch_of_only_unknown_apps_writes_nothing(server, client, user):
+    _, headers = user
+    response = client.post("/api/notifications/batch", json={"notifications": [
+        item("Nowhere App", ORDER.format(1)),
+        item("talabat", ORDER.format(2)),
+    ]}, headers=headers)
+    assert response.status_code == 200
+    batch = response.json()
+    assert (batch["stored"], batch["orders_created"]) == (0, 0)
+    assert all(result["error"] for result in batch["results"])
+    assert stored(client, server.db.notifications) == []
+
+
+def test_batch_size_is_bounded(server, client, user):
+    _, headers = user
+    too_many = [item("Talabat", ORDER.format(idx)) for idx in range(server.MAX_NOTIFICATION_BATCH + 1)]
+    for notifications in ([], too_many):
+        response = client.post("/api/notifications/batch", json={"notifications": notifications}, headers=headers)
+        assert response.status_code == 422
+    assert stored(client, server.db.notifications) == []
+
+
+def test_queued_batch_is_left_to_the_workers(server, client, user, monkeypatch):
+    _, headers = user
+    monkeypatch.setattr(server, "NOTIFICATION_QUEUE", True)
+    batch = client.post("/api/notifications/batch", json={"notifications": [
+        item("Talabat", ORDER.format(1)),
+        item("Nowhere App", ORDER.format(2)),
+    ]}, headers=headers).json()
+    assert (batch["stored"], batch["orders_created"], batch["queued"]) == (1, 0, 1)
+
+    [job] = stored(client, server.db.notification_jobs)
+    assert job["id"] == batch["results"][0]["notification_id"]
+    assert stored(client, server.db.orders) == []
@@ -0,0 +1,225 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from notification_queue import DONE, FAILED, PROCESSING, QUEUED, NotificationQueue, QueueFull
+
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()["queue_test"]
+
+
+def make_queue(db, handler=None, **kwargs):
+    async def parsed(job):
+        return f"order-{job['id']}", True
+
+    return NotificationQueue(db.notification_jobs, handler or parsed, notifications=db.notifications, **kwargs)
+
+
+def notification(idx, received_at=None, is_processed=False):
+    return {
+        "id": f"n{idx}",
+        "user_id": "u1",
+        "received_at": received_at or datetime.utcnow() - timedelta(minutes=5),
+        "is_processed": is_processed,
+    }
+
+
+async def job(db, job_id):
+    return await db.notification_jobs.find_one({"id": job_id}, {"_id": 0})
+
+
+async def make_due(db, job_id):
+    await db.notification_jobs.update_one({"id": job_id}, {"$set": {"available_at": datetime.utcnow()}})
+
+
+def test_leased_job_is_claimed_again_only_after_the_lease_expires(db):
+    queue = make_queue(db, lease_seconds=30)
+
+    async def scenario():
+        await queue.enqueue([notification(1)])
+        leased = await queue.claim("worker-a")
+        assert leased["state"] == PROCESSING and leased["lease_owner"] == "worker-a"
+        assert await queue.claim("worker-b") is None
+
+        # worker-a died: its lease runs out and worker-b takes the job over
+        await db.notification_jobs.update_one({"id": "n1"}, {"$set": {"leased_until": datetime.utcnow() - timedelta(seconds=1)}})
+        taken_over = await queue.claim("worker-b")
+        assert taken_over["lease_owner"] == "worker-b"
+        assert taken_over["attempts"] == 2
+
+        # The late first worker can no longer settle the job
+        await queue._process(leased, "worker-a")
+        assert (await job(db, "n1"))["state"] == PROCESSING
+        await queue._process(taken_over, "worker-b")
+        return await job(db, "n1")
+
+    finished = asyncio.run(scenario())
+    assert finished["state"] == DONE
+    assert finished["order_id"] == "order-n1"
+
+
+def test_failed_job_is_retried_after_a_backoff(db):
+    calls = []
+
+    async def flaky(job):
+        calls.append(job["attempts"])
+        if len(calls) == 1:
+            raise ValueError("geocoder down")
+        return "order-1", True
+
+    queue = make_queue(db, handler=flaky)
+
+    async def scenario():
+        await queue.enqueue([notification(1)])
+        assert await queue.run_once("worker") == 1
+        retried = await job(db, "n1")
+        # Not due yet, so the next run finds nothing
+        assert await queue.run_once("worker") == 0
+        await make_due(db, "n1")
+        assert await queue.run_once("worker") == 1
+        return retried, await job(db, "n1")
+
+    retried, finished = asyncio.run(scenario())
+    assert retried["state"] == QUEUED
+    assert retried["error"] == "geocoder down"
+    assert retried["available_at"] > datetime.utcnow()
+    assert finished["state"] == DONE and finished["error"] is None
+    assert calls == [1, 2]
+
+
+def test_job_is_dead_lettered_after_max_attempts(db):
+    async def broken(job):
+        raise ValueError("unparseable")
+
+    queue = make_queue(db, handler=broken, max_attempts=3)
+
+    async def scenario():
+        await queue.enqueue([notification(1)])
+        for _ in range(3):
+            await make_due(db, "n1")
+            await queue.run_once("worker")
+        await make_due(db, "n1")
+        assert await queue.run_once("worker") == 0
+        return await job(db, "n1"), await queue.backlog()
+
+    failed, backlog = asyncio.run(scenario())
+    assert failed["state"] == FAILED
+    assert failed["attempts"] == 3
+    assert failed["error"] == "unparseable"
+    assert failed["finished_at"] is not None
+    assert backlog == 0
+
+
+def test_jobs_are_leased_as_the_batch_reaches_them(db):
+    states = []
+
+    async def parse(job):
+        other = "n2" if job["id"] == "n1" else "n1"
+        states.append((job["id"], (await db.notification_jobs.find_one({"id": other}))["state"]))
+        return f"order-{job['id']}", True
+
+    queue = make_queue(db, handler=parse)
+
+    async def scenario():
+        await queue.enqueue([notification(1), notification(2)])
+        return await queue.run_once("worker")
+
+    assert asyncio.run(scenario()) == 2
+    # n2 was still queued, not leased, while n1 ran
+    assert states == [("n1", QUEUED), ("n2", DONE)]
+
+
+def test_orders_found_from_an_earlier_run_are_not_post_processed(db):
+    batches = []
+
+    async def parse(job):
+        # n1 ran before (its lease expired), so its order already exists
+        return f"order-{job['id']}", job["id"] != "n1"
+
+    async def after_batch(user_id, order_ids):
+        batches.append((user_id, order_ids))
+
+    queue = make_queue(db, handler=parse)
+    queue.after_batch = after_batch
+
+    async def scenario():
+        await queue.enqueue([notification(1), notification(2)])
+        await queue.run_once("worker")
+        return await job(db, "n1")
+
+    rerun = asyncio.run(scenario())
+    assert batches == [("u1", ["order-n2"])]
+    assert rerun["state"] == DONE
+
+
+def test_capacity_checks_share_a_recent_backlog_count(db):
+    queue = make_queue(db, max_backlog=3, backlog_seconds=60)
+    counts = []
+    backlog = queue.backlog
+
+    async def counted():
+        counts.append(1)
+        return await backlog()
+
+    queue.backlog = counted
+
+    async def scenario():
+        await queue.ensure_capacity(1)
+        await queue.enqueue([notification(1), notification(2)])
+        await queue.ensure_capacity(1)
+        # What this process queued since the count is added to it
+        with pytest.raises(QueueFull):
+            await queue.ensure_capacity(2)
+
+    asyncio.run(scenario())
+    assert len(counts) == 1
+
+
+def test_sweep_queues_stored_notifications_without_a_job(db):
+    queue = make_queue(db, orphan_grace_seconds=60)
+
+    async def scenario():
+        await db.notifications.insert_many([
+            notification(1),
+            notification(2),
+            # Possibly still between its two writes
+            notification(3, received_at=datetime.utcnow()),
+            notification(4, is_processed=True),
+            notification(5, received_at=datetime.utcnow() - timedelta(days=2)),
+        ])
+        await queue.enqueue([notification(2)])
+        first = await queue.requeue_orphans()
+        second = await queue.requeue_orphans()
+        return first, second, sorted(await db.notification_jobs.distinct("id"))
+
+    first, second, queued = asyncio.run(scenario())
+    assert (first, second) == (1, 0)
+    assert queued == ["n1", "n2"]
+
+
+def test_stored_notification_is_parsed_when_queueing_it_failed(server, client, user, monkeypatch):
+    _, headers = user
+    monkeypatch.setattr(server, "NOTIFICATION_QUEUE", True)
+
+    async def unavailable(notifications):
+        raise ConnectionError("queue write failed")
+
+    monkeypatch.setattr(server.notification_queue, "enqueue", unavailable)
+    response = client.post("/api/notifications/simulate", json={
+        "app_name": "Talabat",
+        "title": "New order",
+        "content": "Pickup: Tahrir Square, Cairo - Dropoff: Zamalek, Cairo - Amount: 85 EGP",
+    }, headers=headers)
+    assert response.status_code == 200
+    notification_id = response.json()["id"]
+    assert client.portal.call(job, server.db, notification_id) is None
+
+    monkeypatch.undo()
+    monkeypatch.setattr(server.notification_queue, "orphan_grace", timedelta(0))
+    assert client.portal.call(server.notification_queue.requeue_orphans) == 1
+    assert client.portal.call(server.notification_queue.run_once, "worker") == 1
+    assert client.portal.call(job, server.db, notification_id)["state"] == DONE
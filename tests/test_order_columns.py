@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from benchmarks.harness import make_orders
+from order_columns import OrderColumns
+from tests.helpers import insert_orders
+
+CREATED = datetime(2024, 5, 1, 12, 0, 0, 123456)
+
+
+def document(order_id, lat, payment=None):
+    return {
+        "id": order_id,
+        "pickup_location": {"latitude": lat, "longitude": 31.2},
+        "dropoff_location": {"latitude": lat + 0.01, "longitude": 31.3},
+        "payment_amount": payment,
+        "created_at": CREATED,
+    }
+
+
+def test_documents_become_parallel_columns():
+    orders = OrderColumns.from_documents([document("a", 30.0, 85.5), document("b", 30.1)])
+
+    assert orders.ids == ["a", "b"] and len(orders) == 2
+    assert orders.pickup_lat.tolist() == [30.0, 30.1]
+    assert orders.dropoff_lon.tolist() == [31.3, 31.3]
+    assert orders.payment_amount[0] == 85.5 and np.isnan(orders.payment_amount[1])
+    assert orders.created_at.dtype == np.dtype("datetime64[ms]")
+    assert orders.created_at[0] == np.datetime64("2024-05-01T12:00:00.123")
+    assert orders.coordinates().shape == (4, 2)
+    with pytest.raises(AttributeError):
+        orders.status = "pending"
+
+
+def test_take_reorders_every_column():
+    orders = OrderColumns.from_documents([document(name, 30 + idx / 10, idx) for idx, name in enumerate("abc")])
+    taken = orders.take([2, 0])
+
+    assert taken.ids == ["c", "a"]
+    assert taken.pickup_lat.tolist() == [30.2, 30.0]
+    assert taken.payment_amount.tolist() == [2.0, 0.0]
+    assert len(taken.created_at) == 2
+
+
+def test_models_and_documents_give_the_same_columns(server):
+    models = make_orders(server, 5)
+    from_models = OrderColumns.from_orders(models)
+    from_documents = OrderColumns.from_documents([order.dict() for order in models])
+    for name in OrderColumns.__slots__:
+        assert np.array_equal(getattr(from_models, name), getattr(from_documents, name), equal_nan=name != "ids")
+
+
+def test_pending_orders_are_loaded_in_creation_order(server, client, user):
+    user_id, _ = user
+    orders = make_orders(server, 4, user_id=user_id)
+    for minutes, order in zip([3, 1, 2, 0], orders):
+        order.created_at = CREATED + timedelta(minutes=minutes)
+    orders[2].status = "accepted"
+    someone_elses = make_orders(server, 1, seed=9, user_id="someone-else")
+    insert_orders(client, server, orders + someone_elses)
+
+    loaded = client.portal.call(server.load_pending_orders, user_id)
+    assert loaded.ids == [orders[3].id, orders[1].id, orders[0].id]
+    assert loaded.pickup_lat.tolist() == [orders[idx].pickup_location.latitude for idx in (3, 1, 0)]
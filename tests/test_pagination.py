@@ -0,0 +1,91 @@
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.harness import make_orders
+from pagination import InvalidCursor, decode_cursor, encode_cursor, fetch_page
+from tests.helpers import insert_orders
+
+NOW = datetime(2024, 5, 1, 12, 0, 0, 123000)
+
+
+def raw_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(NOW, "order-7")) == (NOW, "order-7")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    "%%%",
+    raw_cursor(["t", "id"]),
+    raw_cursor({"t": "yesterday", "id": "a"}),
+    raw_cursor({"t": 1714564800, "id": "a"}),
+    raw_cursor({"id": "a"}),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_pages_split_equal_timestamps_by_id():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    collection = mongomock_motor.AsyncMongoMockClient()["pagination"]["orders"]
+    # Seven documents share one timestamp, so every page boundary but the
+    # last falls between equal timestamps
+    docs = [{"id": f"order-{idx}", "created_at": NOW} for idx in range(7)]
+    docs += [{"id": f"older-{idx}", "created_at": NOW - timedelta(minutes=idx + 1)} for idx in range(3)]
+
+    async def pages():
+        await collection.insert_many([dict(doc) for doc in docs])
+        seen, cursor = [], None
+        while True:
+            page, cursor = await fetch_page(collection, {}, "created_at", cursor, 3, {"_id": 0})
+            assert len(page) <= 3
+            seen.extend(doc["id"] for doc in page)
+            if cursor is None:
+                return seen
+
+    expected = sorted(docs, key=lambda doc: (doc["created_at"], doc["id"]), reverse=True)
+    assert asyncio.run(pages()) == [doc["id"] for doc in expected]
+
+
+def test_invalid_cursor_is_a_bad_request(server, client, user):
+    user_id, headers = user
+    insert_orders(client, server, make_orders(server, 3, user_id=user_id))
+
+    truncated = encode_cursor(NOW, "order-7")[:-6]
+    for cursor in ["garbage", truncated]:
+        response = client.get("/api/orders", params={"cursor": cursor}, headers=headers)
+        assert response.status_code == 400
+    assert client.get("/api/notifications", params={"cursor": "garbage"}, headers=headers).status_code == 400
+
+    # A query operator smuggled into the id is compared as a plain string
+    smuggled = raw_cursor({"t": (NOW + timedelta(days=1)).isoformat(), "id": {"$gt": ""}})
+    response = client.get("/api/orders", params={"cursor": smuggled}, headers=headers)
+    assert response.status_code == 200
+
+
+def test_orders_are_paged_through_the_api(server, client, user):
+    user_id, headers = user
+    orders = make_orders(server, 5, user_id=user_id)
+    for order in orders:
+        order.created_at = NOW
+    insert_orders(client, server, orders)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/orders", params=params, headers=headers)
+        assert response.status_code == 200
+        seen.extend(order["id"] for order in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == sorted((order.id for order in orders), reverse=True)
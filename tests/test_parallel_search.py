@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from benchmarks.harness import make_orders
+from combinations import search_candidates
+from order_columns import OrderColumns
+from parallel_search import CombinationSearchEngine, engine_from_env, partition_ranges
+
+
+@pytest.fixture
+def orders(server):
+    return OrderColumns.from_orders(make_orders(server, 80))
+
+
+def test_partitions_cover_every_order_once():
+    neighbours = [[1, 2]] * 10 + [[]] * 30
+    ranges = partition_ranges(neighbours, 4)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(neighbours)
+    assert all(stop == start for (_, stop), (start, _) in zip(ranges, ranges[1:]))
+    assert len(ranges) <= 4
+    # Balanced on the triplet cost, not on the count: the ten orders with
+    # neighbours are split up, the thirty without are not
+    assert ranges[0][1] <= 5
+    assert partition_ranges([], 4) == []
+
+
+@pytest.mark.parametrize("top_k", [None, 5])
+def test_process_pool_finds_what_the_serial_search_does(orders, top_k):
+    engine = CombinationSearchEngine(workers=2, min_parallel_orders=0, partitions_per_worker=3)
+    try:
+        parallel = asyncio.run(engine.search(orders, top_k=top_k))
+    finally:
+        engine.shutdown()
+    serial = search_candidates(orders, top_k=top_k)
+    assert serial
+    assert parallel == serial
+
+
+def test_small_order_sets_stay_out_of_the_process_pool(orders):
+    engine = CombinationSearchEngine(workers=4, min_parallel_orders=len(orders) + 1)
+    assert asyncio.run(engine.search(orders, top_k=3)) == search_candidates(orders, top_k=3)
+    assert engine._executor is None
+
+
+def test_one_pool_per_server_worker_only_when_asked(monkeypatch):
+    monkeypatch.delenv("COMBINATION_WORKERS", raising=False)
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert engine_from_env().workers == 0
+    monkeypatch.setenv("COMBINATION_WORKERS", "3")
+    assert engine_from_env().workers == 3
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from metrics import PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS, PASSWORD_HASH_WAIT_SECONDS
+from password_hashing import HashingPoolBusy, PasswordHasher
+
+
+class BlockingContext:
+    """Stands in for passlib: every call blocks its worker until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def hash(self, password):
+        self.release.wait(5)
+        return f"hashed:{password}"
+
+    def verify(self, password, hashed_password):
+        self.release.wait(5)
+        return hashed_password == f"hashed:{password}"
+
+
+def blocking_hasher(**kwargs):
+    hasher = PasswordHasher(**kwargs)
+    hasher._context = BlockingContext()
+    return hasher
+
+
+def observations(metric, operation):
+    return sum(
+        (value[-1] if isinstance(value, list) else value)
+        for labels, value in metric.state() if labels == [operation]
+    )
+
+
+def test_bcrypt_uses_the_configured_cost():
+    hasher = PasswordHasher(rounds=4)
+    try:
+        hashed = asyncio.run(hasher.hash("secret"))
+        assert hashed.startswith("$2b$04$")
+        assert asyncio.run(hasher.verify("secret", hashed))
+        assert not asyncio.run(hasher.verify("wrong", hashed))
+    finally:
+        hasher.shutdown()
+
+
+def test_event_loop_runs_while_passwords_are_hashed():
+    hasher = blocking_hasher(workers=2)
+
+    async def scenario():
+        hashing = [asyncio.create_task(hasher.hash(f"p{idx}")) for idx in range(4)]
+        ticks = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < 0.2:
+            await asyncio.sleep(0.005)
+            ticks += 1
+        assert hasher.pending == 4
+        hasher._context.release.set()
+        return ticks, await asyncio.gather(*hashing)
+
+    try:
+        ticks, hashes = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    assert ticks > 10
+    assert hashes == [f"hashed:p{idx}" for idx in range(4)]
+    assert hasher.pending == 0
+
+
+def test_calls_beyond_max_pending_are_rejected_and_measured():
+    hasher = blocking_hasher(workers=1, max_pending=2)
+    rejected = observations(PASSWORD_HASH_REJECTED, "verify")
+    waited = observations(PASSWORD_HASH_WAIT_SECONDS, "verify")
+    ran = observations(PASSWORD_HASH_SECONDS, "verify")
+
+    async def scenario():
+        admitted = [asyncio.create_task(hasher.verify("secret", "hashed:secret")) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HashingPoolBusy):
+            await hasher.verify("secret", "hashed:secret")
+        hasher._context.release.set()
+        return await asyncio.gather(*admitted)
+
+    try:
+        assert asyncio.run(scenario()) == [True, True]
+    finally:
+        hasher.shutdown()
+    assert observations(PASSWORD_HASH_REJECTED, "verify") == rejected + 1
+    assert observations(PASSWORD_HASH_WAIT_SECONDS, "verify") == waited + 2
+    assert observations(PASSWORD_HASH_SECONDS, "verify") == ran + 2
+
+
+def test_login_is_refused_with_a_retry_while_the_pool_is_full(server, client, user, monkeypatch):
+    monkeypatch.setattr(server.password_hasher, "max_pending", 0)
+    response = client.post("/api/token", data={"username": "driver", "password": "secret"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+
+from benchmarks.harness import make_orders
+from tests.helpers import insert_orders
+
+# Written before notification_id, combination_id and completed_at existed
+OLD_ORDER = {
+    "id": "old-order",
+    "app_id": "talabat",
+    "app_name": "Talabat",
+    "order_reference": "OLD-1",
+    "pickup_location": {"latitude": 30.05, "longitude": 31.23, "address": "Tahrir Square"},
+    "dropoff_location": {"latitude": 30.06, "longitude": 31.22, "address": "Zamalek"},
+    "payment_amount": 85,
+    "status": "pending",
+    "created_at": datetime(2024, 5, 1, 12, 0, 0),
+    "updated_at": datetime(2024, 5, 1, 12, 0, 0, 250000),
+}
+
+
+def bodies(client, server, monkeypatch, path, headers):
+    """The response of `path` through orjson and through the response models"""
+    responses = []
+    for fast in (True, False):
+        monkeypatch.setattr(server, "FAST_JSON_RESPONSES", fast)
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200
+        responses.append(response)
+    return responses
+
+
+@pytest.mark.parametrize("path", [
+    "/api/orders",
+    "/api/orders?limit=3",
+    "/api/orders?fields=id,status,pickup_location",
+    "/api/notifications",
+    "/api/combinations",
+])
+def test_fast_responses_match_the_model_path(server, client, user, monkeypatch, path):
+    user_id, headers = user
+    insert_orders(client, server, make_orders(server, 6, user_id=user_id))
+    client.portal.call(server.db.orders.insert_one, {**OLD_ORDER, "user_id": user_id})
+    client.post("/api/notifications/simulate", json={
+        "app_name": "Talabat", "title": "New order", "content": "Pickup from Tahrir Square, deliver to Zamalek, 85 EGP",
+    }, headers=headers)
+    assert client.post("/api/combinations/generate", headers=headers).status_code == 200
+
+    fast, validated = bodies(client, server, monkeypatch, path, headers)
+    assert fast.json() == validated.json()
+    assert fast.json()
+    assert fast.headers.get("X-Next-Cursor") == validated.headers.get("X-Next-Cursor")
+    assert fast.headers["content-type"] == validated.headers["content-type"] == "application/json"
+
+
+def test_old_documents_get_the_model_defaults(server, client, user):
+    user_id, headers = user
+    client.portal.call(server.db.orders.insert_one, {**OLD_ORDER, "user_id": user_id})
+
+    [order] = client.get("/api/orders", headers=headers).json()
+    assert order["notification_id"] is None
+    assert order["combination_id"] is None
+    assert order["completed_at"] is None
+    assert order["created_at"] == "2024-05-01T12:00:00"
+    assert order["updated_at"] == "2024-05-01T12:00:00.250000"
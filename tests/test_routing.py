@@ -0,0 +1,68 @@
+import itertools
+import math
+import random
+import time
+
+import pytest
+
+from routing import RoutingEngine, exact_route, is_feasible, local_search_route, route_distance, solve_route
+
+
+def stop_distances(k, seed):
+    """Euclidean distances between 2k random stops, pickups first"""
+    rng = random.Random(seed)
+    points = [(rng.uniform(0, 10), rng.uniform(0, 10)) for _ in range(2 * k)]
+    return [[math.dist(a, b) for b in points] for a in points]
+
+
+def brute_force(dist, k):
+    return min(
+        route_distance(dist, stops)
+        for stops in itertools.permutations(range(2 * k))
+        if is_feasible(list(stops), k)
+    )
+
+
+@pytest.mark.parametrize("engine", list(RoutingEngine))
+@pytest.mark.parametrize("k", [1, 2, 3, 5])
+def test_every_pickup_comes_before_its_dropoff(engine, k):
+    for seed in range(20):
+        dist = stop_distances(k, seed)
+        route = solve_route(dist, k, engine=engine)
+
+        assert sorted(route.stops) == list(range(2 * k))
+        assert is_feasible(route.stops, k)
+        assert route.distance == pytest.approx(route_distance(dist, route.stops))
+
+
+@pytest.mark.parametrize("k", [2, 3])
+def test_exact_route_is_optimal(k):
+    for seed in range(20):
+        dist = stop_distances(k, seed)
+        assert exact_route(dist, k).distance == pytest.approx(brute_force(dist, k))
+
+
+@pytest.mark.parametrize("k", [2, 3])
+def test_local_search_matches_exact_on_small_bundles(k):
+    for seed in range(20):
+        dist = stop_distances(k, seed)
+        assert local_search_route(dist, k).distance == pytest.approx(exact_route(dist, k).distance)
+
+
+def test_local_search_never_beats_exact():
+    for seed in range(20):
+        dist = stop_distances(4, seed)
+        assert local_search_route(dist, 4).distance >= exact_route(dist, 4).distance - 1e-9
+
+
+def test_local_search_stops_at_the_time_budget():
+    dist = stop_distances(15, seed=1)
+    started = time.perf_counter()
+    route = local_search_route(dist, 15, time_budget_ms=10)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    assert is_feasible(route.stops, 15)
+    # The greedy construction and the move in progress may run past it
+    assert elapsed_ms < 10 + 150
+    unbounded = local_search_route(dist, 15, time_budget_ms=10000)
+    assert unbounded.distance <= route.distance + 1e-9
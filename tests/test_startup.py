@@ -0,0 +1,20 @@
+import threading
+
+from fastapi.testclient import TestClient
+
+
+def test_numpy_modules_are_imported_off_the_event_loop_before_serving(server, monkeypatch):
+    imports = []
+    import_deferred_modules = server.import_deferred_modules
+
+    def recorded():
+        imports.append(threading.current_thread())
+        import_deferred_modules()
+
+    monkeypatch.setattr(server, "import_deferred_modules", recorded)
+    with TestClient(server.app) as client:
+        loop_thread = client.portal.call(threading.current_thread)
+        assert client.get("/api/status").status_code == 200
+
+    assert len(imports) == 1
+    assert imports[0] is not loop_thread
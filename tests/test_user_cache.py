@@ -0,0 +1,109 @@
+from datetime import timedelta
+
+import pytest
+
+import cache
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def lookups(server, monkeypatch):
+    """Usernames looked up in the users collection"""
+    usernames = []
+    get_user = server.get_user
+
+    async def counted(username):
+        usernames.append(username)
+        return await get_user(username)
+
+    monkeypatch.setattr(server, "get_user", counted)
+    return usernames
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    users = TTLCache(maxsize=2, ttl=60)
+    users.set("a", 1)
+    users.set("b", 2)
+    assert users.get("a") == 1
+    users.set("c", 3)
+    assert (users.get("a"), users.get("b"), users.get("c")) == (1, None, 3)
+    assert (users.hits, users.misses) == (3, 1)
+
+
+def test_entries_expire_after_their_ttl(clock):
+    users = TTLCache(ttl=60)
+    users.set("default", 1)
+    users.set("short", 2, ttl=5)
+    clock.now += 10
+    assert users.get("short") is None
+    assert users.get("default") == 1
+    clock.now += 60
+    assert users.get("default") is None
+    assert len(users) == 0
+
+
+def test_user_is_looked_up_once_per_token(server, client, user, lookups):
+    _, headers = user
+    # sign_up already resolved this token once
+    server.user_cache.clear()
+    for _ in range(3):
+        assert client.get("/api/users/me", headers=headers).json()["username"] == "driver"
+    assert lookups == ["driver"]
+
+    # Another token is another entry
+    token = client.post("/api/token", data={"username": "driver", "password": "secret"}).json()["access_token"]
+    client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert lookups == ["driver", "driver"]
+
+
+def test_cached_user_is_not_served_past_the_token_expiry(server, client, user, lookups, clock):
+    short = server.create_access_token(data={"sub": "driver"}, expires_delta=timedelta(seconds=30))
+    long = server.create_access_token(data={"sub": "driver"}, expires_delta=timedelta(minutes=10))
+    lookups.clear()
+    for token in (short, long, short, long):
+        client.portal.call(server.resolve_user, token)
+    assert len(lookups) == 2
+
+    clock.now += 31
+    for token in (short, long):
+        client.portal.call(server.resolve_user, token)
+    assert len(lookups) == 3
+
+
+def test_invalid_tokens_are_not_cached(server, client, user):
+    server.user_cache.clear()
+    response = client.get("/api/users/me", headers={"Authorization": "Bearer not-a-jwt"})
+    assert response.status_code == 401
+    assert len(server.user_cache) == 0
+
+
+def test_trusted_claims_skip_the_lookup(server, client, user, lookups, monkeypatch):
+    user_id, _ = user
+    monkeypatch.setattr(server, "TRUST_TOKEN_CLAIMS", True)
+    server.user_cache.clear()
+    lookups.clear()
+    token = client.post("/api/token", data={"username": "driver", "password": "secret"}).json()["access_token"]
+
+    me = client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"}).json()
+    assert me["id"] == user_id and me["email"] == "driver@example.com" and me["full_name"] == "Driver"
+    assert lookups == ["driver"]  # By the login, not by the request
+
+    # Tokens issued before the claims were added still resolve through the database
+    old_token = server.create_access_token(data={"sub": "driver"}, expires_delta=timedelta(minutes=5))
+    assert client.get("/api/users/me", headers={"Authorization": f"Bearer {old_token}"}).json()["id"] == user_id
+    assert lookups == ["driver", "driver"]